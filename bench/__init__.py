@@ -0,0 +1,905 @@
+"""
+Benchmarks for the map bot, run with python -m bench.
+
+synth fills a database with a generated match history, and bench runs
+the read commands (then add) against generated histories of each size
+through a FakeContext, timing them and counting their queries.
+bench --save stores the results as baselines. Later runs exit non-zero
+when a command gets slower than its baseline by more than the
+tolerance, runs more queries, or changes its output.
+"""
+
+import asyncio
+import csv
+import hashlib
+import json
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from collections import deque
+from datetime import datetime
+
+import discord
+
+import map_bot
+from map_bot import (GAME_FIELDS, MESSAGE_LIMIT, QUERIES, SAMPLE_PARAMS, SCHEMA_VERSION, STATEMENT_CACHE_SIZE,
+                     MapCatalog, MapResolver, bot, bot_data, build_digest, build_report, chart_maps, charts, current_invocation,
+                     draw_bar_chart, export_games, format_elapsed, format_timestamp, group_data, import_games,
+                     insert_games, load_roster, logger, map_name_data, metrics, open_tenant, query_params,
+                     read_games, render_map_records,
+                     render_most_played, render_personal_wr, render_winrate, reply, run_offline, sender,
+                     undigested_games, validate_game)
+
+SYNTH_START = 1664841600  # s01 launch, 2022-10-04
+SYNTH_STACKS = "0:1,1:2,2:3,3:3,4:1,5:1"
+BENCH_SIZES = "1000,10000,100000"
+BENCH_REPEAT = 5
+BENCH_TOLERANCE = 1.5
+# Slowdowns smaller than this are noise, however large the ratio
+BENCH_NOISE_SECONDS = 0.002
+# Commands whose output depends on the clock, so only their timings are compared
+BENCH_UNSTABLE = {"lastwon", "lastplayed", "add"}
+# How timestamps were stored before they were epoch seconds
+LEGACY_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# The reads load_bench's simulated commands run
+LOAD_QUERIES = ["last10", "lastwon", "lastplayed", "winrate", "personal_wr", "group_stats", "bestmaptype",
+                "seasonbestmaps", "mostplayed", "bestmaps"]
+# Modules that starting on an up to date database should never import
+STARTUP_HEAVY = ("sqlalchemy", "numpy")
+# Run by startup_bench in a fresh interpreter, so the import is timed from
+# scratch and sys.modules holds only what startup pulled in
+STARTUP_SCRIPT = """
+import asyncio, json, sys, time
+
+start = time.perf_counter()
+import map_bot
+times = {"import": time.perf_counter() - start}
+
+start = time.perf_counter()
+map_bot.prepare_database(sys.argv[1])
+times["prepare (up to date)"] = time.perf_counter() - start
+
+async def open_tenant():
+    start = time.perf_counter()
+    tenant = map_bot.open_tenant(None, sys.argv[1])
+    await tenant.start()
+    await tenant.analytics.ready()
+    times["tenant open"] = time.perf_counter() - start
+    await tenant.close()
+
+asyncio.run(open_tenant())
+heavy = [name for name in sys.argv[3].split(",") if name in sys.modules]
+
+start = time.perf_counter()
+map_bot.prepare_database(sys.argv[2])
+times["prepare (migration)"] = time.perf_counter() - start
+
+print(json.dumps({"times": times, "heavy": heavy}))
+"""
+
+
+def parse_stacks(text):
+    """
+    Parses stack size weights written as "size:weight,...". Size 0 is a game without a stack.
+    """
+    try:
+        weights = {int(size): float(weight) for size, weight in (item.split(":") for item in text.split(","))}
+    except ValueError:
+        raise ValueError(f"invalid stack weights '{text}' (expected size:weight,...)")
+
+    if any(size < 0 or size > 5 for size in weights):
+        raise ValueError("stack sizes must be between 0 and 5")
+    return weights
+
+
+def synth_games(games, seasons, letters, stacks, seed=0):
+    """
+    Yields (line number, row) pairs for import_games: games spread evenly
+    over the seasons up to the default season, played in sessions of a
+    few hours, with skewed map popularity and per map win rates.
+    """
+    rng = random.Random(seed)
+    last = int(bot_data.default_season[1:])
+    names = [f"s{number:02d}" for number in range(max(last - seasons + 1, 1), last + 1)]
+
+    maps = map_name_data.map_names
+    popularity = [rng.paretovariate(1.5) for _ in maps]
+    win_rates = {name: rng.uniform(0.35, 0.65) for name in maps}
+    sizes = [min(size, len(letters)) for size in stacks]
+    size_weights = list(stacks.values())
+
+    timestamp = SYNTH_START
+    session_left = 0
+
+    for line_num in range(1, games + 1):
+        if session_left == 0:
+            session_left = rng.randint(4, 12)
+            timestamp += rng.randint(12, 72) * 3600
+        session_left -= 1
+        timestamp += rng.randint(8, 25) * 60
+
+        map_name = rng.choices(maps, popularity)[0]
+        roll = rng.random()
+        result = "d" if roll < 0.04 else "w" if roll < 0.04 + win_rates[map_name] * 0.96 else "l"
+        size = rng.choices(sizes, size_weights)[0]
+
+        yield line_num, {"season": names[(line_num - 1) * len(names) // games], "map_name": map_name,
+                         "map_result": result, "stack": "".join(rng.sample(letters, size)),
+                         "timestamp": str(timestamp), "added_by": "synth"}
+
+
+def synth_database(connection, games, seasons, players, stacks, seed=0):
+    """
+    Imports a generated history of games using the first players of the roster.
+    """
+    letters = list(load_roster(connection))[:players]
+    return import_games(connection, synth_games(games, seasons, letters, stacks, seed), "synth",
+                        defer_indexes=True)
+
+
+class FakeContext:
+    """
+    Just enough of a commands.Context to run a command callback outside
+    Discord. Replies are collected in output.
+    """
+
+    def __init__(self, tenant):
+        self.tenant = tenant
+        self.author = discord.Object(id=0)
+        self.author.name = "bench"
+        self.guild = None
+        self.message = None
+        self.interaction = None
+        self.bot = bot
+        self.output = []
+
+    async def send(self, content=None, **kwargs):
+        self.output.append(content or "")
+
+    async def defer(self, **kwargs):
+        pass
+
+
+def bench_commands(season):
+    """
+    Returns the (command, arguments) pairs bench runs.
+    """
+    return [("last10", ()), ("lastwon", ("ilios",)), ("lastplayed", ("ilios",)), ("winrate", (season, "ilios")),
+            ("personal_wr", ("W", season)), ("group_stats", (season,)), ("bestmaptype", (season,)),
+            ("seasonbestmaps", (season,)), ("seasonworstmaps", (season,)), ("bestmaps", ()), ("worstmaps", ()),
+            ("mostplayed", (season,)), ("mostplayedall", ()), ("form", ()), ("streaks", ()), ("trend", ()),
+            ("report", (season,)), ("maps", ()), ("roster", ())]
+
+
+async def run_command(tenant, name, *args, **kwargs):
+    """
+    Runs a command's callback as the bot would. Returns (seconds, queries, output).
+    """
+    ctx = FakeContext(tenant)
+    metrics.start()
+    invocation = current_invocation.get()
+
+    await bot.get_command(name).callback(ctx, *args, **kwargs)
+
+    metrics.finish(name)
+    return time.perf_counter() - invocation["started"], invocation["queries"], "\n".join(ctx.output)
+
+
+async def bench_database(path, repeat):
+    """
+    Runs every bench command repeat times against the database at path,
+    with the response cache and the season snapshots in memory emptied
+    before each run. Returns {command: {"seconds": median, "queries": most
+    in a run, "query_counts": per run, "output": digest}}.
+    """
+    tenant = await asyncio.to_thread(open_tenant, None, path)
+    await tenant.start()
+    await tenant.analytics.ready()
+    season = bot_data.default_season
+
+    runs = [(name, args, {}) for name, args in bench_commands(season)]
+    runs.append(("add", (), {"entry": f"ilios w, busan l --season {season} --stack WL"}))
+    results = {}
+
+    try:
+        for name, args, kwargs in runs:
+            timings, counts = [], []
+            for _ in range(repeat):
+                tenant.cache.invalidate()
+                # Otherwise only the first run reads the snapshot a command is built from.
+                # The replica is copied again to hold the snapshots stored so far, as after a restart.
+                tenant.snapshots.seasons.clear()
+                if tenant.replica is not None:
+                    await tenant.replica.refresh()
+                seconds, queries, output = await run_command(tenant, name, *args, **kwargs)
+                timings.append(seconds)
+                counts.append(queries)
+
+            results[name] = {"seconds": statistics.median(timings), "queries": max(counts), "query_counts": counts,
+                             "output": None if name in BENCH_UNSTABLE else hashlib.sha1(output.encode()).hexdigest()}
+    finally:
+        await tenant.close()
+
+    return results
+
+
+def compare_bench(results, baselines, tolerance):
+    """
+    Returns a description of every regression in results against baselines.
+    """
+    regressions = []
+
+    for size, commands in results.items():
+        for name, result in commands.items():
+            baseline = baselines.get(size, {}).get(name)
+            if baseline is None:
+                continue
+
+            if result["seconds"] > baseline["seconds"] * tolerance + BENCH_NOISE_SECONDS:
+                regressions.append(f"{name} @ {size}: {result['seconds'] * 1000:.1f}ms "
+                                   f"(baseline {baseline['seconds'] * 1000:.1f}ms)")
+            if result["queries"] > baseline["queries"]:
+                regressions.append(f"{name} @ {size}: {result['queries']} queries (baseline {baseline['queries']})")
+            if result["output"] != baseline["output"]:
+                regressions.append(f"{name} @ {size}: output changed")
+
+    return regressions
+
+
+async def bench(sizes, directory, repeat, seed=0):
+    """
+    Benchmarks every size of generated history, reusing databases already
+    generated in directory. Each run works on a copy, so the games add
+    writes never reach the saved history. Returns {size: bench_database results}.
+    """
+    results = {}
+
+    for size in sizes:
+        path = os.path.join(directory, f"bench-{size}.db")
+        copy = os.path.join(directory, f"bench-{size}.run.db")
+
+        if not os.path.exists(path):
+            start = time.perf_counter()
+            await run_offline(path, synth_database, size, 4, 6, parse_stacks(SYNTH_STACKS), seed)
+            print(f"✅ Generated {size} games in {time.perf_counter() - start:.2f}s")
+
+        await asyncio.to_thread(shutil.copyfile, path, copy)
+        try:
+            results[str(size)] = commands = await bench_database(copy, repeat)
+        finally:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(copy + suffix):
+                    os.remove(copy + suffix)
+
+        for name, result in commands.items():
+            print(f"{size:>10} {name:<16} {result['seconds'] * 1000:9.2f}ms {result['queries']:3} queries")
+
+    return results
+
+
+def import_row_per_commit(connection, rows, added_by):
+    """
+    Imports (line number, row) pairs one transaction per game, as adding
+    them one madd at a time did. Returns (games imported, 0, []) as import_games would.
+    """
+    catalog = MapCatalog.load(connection)
+    roster = load_roster(connection)
+    imported = 0
+
+    for _, row in rows:
+        with connection:
+            insert_games(connection, [validate_game(row, added_by, catalog, roster)])
+        imported += 1
+
+    return imported, 0, []
+
+
+async def import_bench(directory, games, sample):
+    """
+    Writes a generated history of games to a CSV file, then times
+    importing its first sample rows one transaction per game, importing
+    all of it in batches, in batches with the owmaps indexes rebuilt at
+    the end, and exporting it again. Returns {phase: (rows, seconds)}.
+    """
+    source = os.path.join(directory, "import.csv")
+    with open(source, "w", encoding="utf-8", newline="") as stream:
+        writer = csv.DictWriter(stream, GAME_FIELDS)
+        writer.writeheader()
+        writer.writerows(row for _, row in synth_games(games, 4, list(group_data.members), parse_stacks(SYNTH_STACKS)))
+
+    def rows(limit=None):
+        with open(source, encoding="utf-8", newline="") as stream:
+            for line_num, row in read_games(stream, "csv"):
+                if limit is not None and line_num > limit + 1:
+                    return
+                yield line_num, row
+
+    phases = [("row per commit", import_row_per_commit, (rows(sample), "bench")),
+              ("batched", import_games, (rows(), "bench")),
+              ("batched, indexes deferred", import_games, (rows(), "bench", True))]
+    results = {}
+
+    for number, (phase, func, args) in enumerate(phases):
+        path = os.path.join(directory, f"import-{number}.db")
+        start = time.perf_counter()
+        imported, _, _ = await run_offline(path, func, *args)
+        results[phase] = (imported, time.perf_counter() - start)
+
+    # The last import has the whole history
+    with open(os.path.join(directory, "export.csv"), "w", encoding="utf-8", newline="") as stream:
+        start = time.perf_counter()
+        written = await run_offline(path, export_games, stream, "csv")
+        results["export"] = (written, time.perf_counter() - start)
+
+    return results
+
+
+async def load_bench(path, count):
+    """
+    Fires count simulated commands at the database at path at once, each
+    running one of LOAD_QUERIES, and times each from when they were all
+    fired until it has its rows, while a ticker measures how late the
+    event loop runs. Runs them first as every command used to, opening a
+    connection and querying on the event loop, then through the pooled
+    Database. Returns {mode: (p50, p99, commands per second, max loop lag)}.
+    """
+    tenant = await asyncio.to_thread(open_tenant, None, path, False)
+    sample = {"season": bot_data.default_season, "map_id": tenant.catalog.id("ilios"), "player": "W"}
+    runs = [(name, {key: sample[key] for key in query_params(QUERIES[name])})
+            for name in (LOAD_QUERIES[i % len(LOAD_QUERIES)] for i in range(count))]
+
+    async def connection_per_command(name, params):
+        # Yield first, as a command would before reading, so every command has started
+        await asyncio.sleep(0)
+        connection = sqlite3.connect(path)
+        try:
+            return connection.execute(QUERIES[name], params).fetchall()
+        finally:
+            connection.close()
+
+    async def pooled(name, params):
+        return await tenant.db.fetchall(name, **params)
+
+    lags = []
+    ticking = True
+    results = {}
+
+    async def ticker():
+        while ticking:
+            before = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append(time.perf_counter() - before - 0.005)
+
+    try:
+        for mode, run in (("connection per command", connection_per_command), ("database pool", pooled)):
+            latencies = []
+            ticking = True
+            lags.clear()
+
+            async def command(name, params):
+                await run(name, params)
+                latencies.append(time.perf_counter() - start)
+
+            tick = asyncio.create_task(ticker())
+            start = time.perf_counter()
+            await asyncio.gather(*(command(name, params) for name, params in runs))
+            elapsed = time.perf_counter() - start
+            ticking = False
+            await tick
+
+            percentiles = statistics.quantiles(latencies, n=100)
+            results[mode] = (percentiles[49], percentiles[98], count / elapsed, max(lags, default=0.0))
+    finally:
+        await tenant.close()
+
+    return results
+
+
+class FakeChannel:
+    """
+    A text channel with Discord's per channel rate limit of limit messages
+    a window. A send over the limit is answered with a 429 and retried once
+    the window allows, as discord.py does. Messages over MESSAGE_LIMIT are
+    rejected.
+    """
+
+    def __init__(self, channel_id, limit, window):
+        self.id = channel_id
+        self.limit = limit
+        self.window = window
+        self.sent = 0
+        self.rate_limited = 0
+        self._send_times = deque()
+
+    async def send(self, content=None, **kwargs):
+        if content is not None and len(content) > MESSAGE_LIMIT:
+            raise ValueError(f"Must be {MESSAGE_LIMIT} or fewer in length")
+
+        while True:
+            now = time.monotonic()
+            while self._send_times and now - self._send_times[0] >= self.window:
+                self._send_times.popleft()
+            if len(self._send_times) < self.limit:
+                break
+
+            self.rate_limited += 1
+            await asyncio.sleep(self.window - (now - self._send_times[0]))
+
+        self._send_times.append(now)
+        self.sent += 1
+
+
+async def burst_bench(count, channels, limit, window, seed=0):
+    """
+    Answers a burst of count commands spread over channels fake channels,
+    each replying with one to three messages of up to 60 lines, first
+    sending every message straight to its channel as commands used to, then
+    through reply and the rate limited sender. Returns {mode: (messages
+    sent, 429s, messages rejected, p50 latency, p99 latency)}, latency
+    being from the burst until a command's last message is sent.
+    """
+    rng = random.Random(seed)
+    outputs = [[("\n".join(f"line {line} " + "x" * rng.randint(10, 50) for line in range(rng.randint(1, 60))))
+                for _ in range(rng.randint(1, 3))] for _ in range(count)]
+    per_channel, per_seconds = sender.per_channel, sender.per_seconds
+    results = {}
+
+    async def direct(channel, messages):
+        rejected = 0
+        for message in messages:
+            try:
+                await channel.send(message)
+            except ValueError:
+                rejected += 1
+        return rejected
+
+    async def queued(channel, messages):
+        for message in messages:
+            await reply(channel, message)
+        return 0
+
+    sender.per_channel, sender.per_seconds = limit, window
+    try:
+        for number, (mode, send) in enumerate((("direct", direct), ("sender", queued))):
+            fake = [FakeChannel(number * channels + index, limit, window) for index in range(channels)]
+            latencies = []
+
+            async def command(index, messages):
+                rejected = await send(fake[index % channels], messages)
+                latencies.append(time.perf_counter() - start)
+                return rejected
+
+            start = time.perf_counter()
+            rejected = await asyncio.gather(*(command(index, messages) for index, messages in enumerate(outputs)))
+
+            percentiles = statistics.quantiles(latencies, n=100)
+            results[mode] = (sum(channel.sent for channel in fake), sum(channel.rate_limited for channel in fake),
+                             sum(rejected), percentiles[49], percentiles[98])
+    finally:
+        sender.per_channel, sender.per_seconds = per_channel, per_seconds
+
+    return results
+
+
+async def stress(path, writers, adds):
+    """
+    Runs writers concurrent loops of adds against the database at path,
+    first committing each add in its own transaction as add used to, then
+    through the ingest queue. Returns {mode: (adds per second, errors)}.
+    """
+    tenant = await asyncio.to_thread(open_tenant, None, path)
+    await tenant.start()
+    await tenant.analytics.ready()
+
+    def game():
+        row = {"season": bot_data.default_season, "map_name": "ilios", "map_result": "w", "stack": "WL",
+               "timestamp": str(int(time.time()))}
+        return validate_game(row, "stress", tenant.catalog, tenant.roster)
+
+    modes = {"transaction per add": lambda: tenant.db.transaction(insert_games, [game()]),
+             "ingest queue": lambda: tenant.ingest.add([game()])}
+    results = {}
+
+    try:
+        for mode, add in modes.items():
+            errors = 0
+
+            async def writer():
+                nonlocal errors
+                for _ in range(adds):
+                    try:
+                        await add()
+                    except Exception as e:
+                        errors += 1
+                        logger.error("%s add failed: %s", mode, e)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(writer() for _ in range(writers)))
+            await tenant.ingest.flush()
+            results[mode] = (writers * adds / (time.perf_counter() - start), errors)
+    finally:
+        await tenant.close()
+
+    return results
+
+
+async def replica_bench(path, seconds, readers, writers, add_rate):
+    """
+    Runs readers loops of the heavy analytics reads alongside writers adding
+    add_rate games a second between them against the database at path for
+    seconds, first with the reads on the database itself, then on a
+    replica. Returns {mode: (reads per second, read p95, adds committed per
+    second, add p95)}.
+    """
+    season = bot_data.default_season
+    reads = [lambda tenant: render_map_records(tenant, "BEST MAPS", "bestmaps"), render_most_played,
+             lambda tenant: render_personal_wr(tenant, "W", season),
+             lambda tenant: render_winrate(tenant, season, "ilios")]
+    results = {}
+
+    for mode, replica in (("database", False), ("replica", True)):
+        tenant = await asyncio.to_thread(open_tenant, None, path, replica)
+        await tenant.start()
+        await tenant.analytics.ready()
+        if replica:
+            await tenant.replica.refresh()
+
+        def game():
+            row = {"season": season, "map_name": "ilios", "map_result": "w", "stack": "WL",
+                   "timestamp": str(int(time.time()))}
+            return validate_game(row, "bench", tenant.catalog, tenant.roster)
+
+        read_times, add_times = [], []
+        committed = tenant.ingest.committed
+        deadline = time.perf_counter() + seconds
+
+        async def reader(i):
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                await reads[i % len(reads)](tenant)
+                read_times.append(time.perf_counter() - start)
+                i += 1
+
+        async def writer():
+            due = time.perf_counter()
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                await tenant.ingest.add([game()])
+                add_times.append(time.perf_counter() - start)
+                due += writers / add_rate
+                await asyncio.sleep(due - time.perf_counter())
+
+        async def refresher():
+            # What refresh_replicas does in the bot
+            while time.perf_counter() < deadline:
+                await asyncio.sleep(map_bot.REPLICA_MAX_AGE / 2)
+                await tenant.replica.refresh_stale()
+
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(*(reader(i) for i in range(readers)), *(writer() for _ in range(writers)),
+                                 *([refresher()] if replica else []))
+            await tenant.ingest.flush()
+            elapsed = time.perf_counter() - start
+            results[mode] = (len(read_times) / elapsed, statistics.quantiles(read_times, n=20)[-1],
+                             (tenant.ingest.committed - committed) / elapsed, statistics.quantiles(add_times, n=20)[-1])
+        finally:
+            await tenant.close()
+
+    return results
+
+
+async def digest_bench(directory, sizes, session, repeat):
+    """
+    Adds a session of games to a generated history of each size and times
+    building its digest. Returns {size: (seconds, queries)}.
+    """
+    results = {}
+
+    for size in sizes:
+        path = os.path.join(directory, f"digest-{size}.db")
+        await run_offline(path, synth_database, size, 4, 6, parse_stacks(SYNTH_STACKS))
+
+        tenant = await asyncio.to_thread(open_tenant, None, path, False)
+        try:
+            await undigested_games(tenant)
+
+            rng = random.Random(size)
+            now = int(time.time())
+            rows = [{"season": bot_data.default_season, "map_name": rng.choice(map_name_data.map_names),
+                     "map_result": rng.choice("wwlld"), "stack": "".join(rng.sample("CDEJLW", rng.randint(1, 5))),
+                     "timestamp": str(now + i)} for i in range(session)]
+            await tenant.db.transaction(insert_games, [validate_game(row, "bench", tenant.catalog, tenant.roster)
+                                                       for row in rows])
+
+            timings = []
+            for _ in range(repeat):
+                metrics.start()
+                invocation = current_invocation.get()
+                games = await undigested_games(tenant)
+                await tenant.db.read(build_digest, games, tenant.catalog.names, tenant.roster)
+                metrics.finish("digest")
+                timings.append((time.perf_counter() - invocation["started"], invocation["queries"]))
+
+            results[size] = min(timings)
+        finally:
+            await tenant.close()
+
+    return results
+
+
+async def chart_bench(path, count):
+    """
+    Renders count distinct charts inline on the event loop, then on the
+    chart pool, then again from the cache, while a ticker measures how
+    late the event loop runs. Returns {phase: (charts per second, max lag, p95 lag)}.
+    """
+    # Without a replica, so each data version set below is read straight away
+    tenant = await asyncio.to_thread(open_tenant, None, path, False)
+    await tenant.start()
+    lags = []
+    ticking = True
+
+    async def ticker():
+        while ticking:
+            start = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append(time.perf_counter() - start - 0.005)
+
+    async def inline(i):
+        rows = await tenant.db.fetchall("bestmaps")
+        draw_bar_chart(f"Chart {i}", [tenant.catalog.names[row[0]] for row in rows], [row[5] for row in rows], "%")
+
+    async def pooled(i):
+        # A new data version per chart, so each one renders
+        tenant.data_version = i
+        await chart_maps(tenant)
+
+    async def cached(i):
+        await chart_maps(tenant)
+
+    # Start every worker before timing anything
+    await asyncio.gather(*(pooled(-i) for i in range(charts.workers)))
+    results = {}
+
+    try:
+        for phase, draw in (("inline", inline), ("process pool", pooled), ("cached", cached)):
+            ticking = True
+            lags.clear()
+            tick = asyncio.create_task(ticker())
+            start = time.perf_counter()
+
+            await asyncio.gather(*(draw(i + 1) for i in range(count)))
+
+            elapsed = time.perf_counter() - start
+            ticking = False
+            await tick
+            lags.sort()
+            results[phase] = (count / elapsed, lags[-1], lags[int(len(lags) * 0.95)])
+    finally:
+        charts.close()
+        await tenant.close()
+
+    return results
+
+
+def statement_bench(path, iterations):
+    """
+    Runs every registered read iterations times against the database at
+    path with SAMPLE_PARAMS, on a connection without a statement cache, so
+    each call parses and plans its statement again, and on one with the
+    bot's. Returns {query: (uncached seconds per call, cached seconds per call)}.
+    """
+    results = {}
+    connections = [sqlite3.connect(path, cached_statements=0),
+                   sqlite3.connect(path, cached_statements=STATEMENT_CACHE_SIZE)]
+
+    try:
+        for name, query in QUERIES.items():
+            if not query.startswith("SELECT"):
+                continue
+
+            params = {key: SAMPLE_PARAMS.get(key) for key in query_params(query)}
+            timings = []
+
+            for connection in connections:
+                connection.execute(query, params).fetchall()
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    connection.execute(query, params).fetchall()
+                timings.append((time.perf_counter() - start) / iterations)
+
+            results[name] = tuple(timings)
+    finally:
+        for connection in connections:
+            connection.close()
+
+    return results
+
+
+def legacy_elapsed(connection, query, map_name):
+    """
+    lastwon and lastplayed as they were with formatted timestamps: the
+    current time formatted and parsed back, then the stored one parsed.
+    """
+    now = datetime.strptime(datetime.fromtimestamp(time.time()).strftime(LEGACY_TIME_FORMAT), LEGACY_TIME_FORMAT)
+    last_time = connection.execute(query, (map_name,)).fetchone()[0]
+
+    elapsed = now - datetime.strptime(last_time, LEGACY_TIME_FORMAT)
+    hours, remainder = divmod(elapsed.seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{elapsed.days} days, {hours} hours, {minutes} minutes, {seconds} seconds"
+
+
+def timestamp_bench(path, iterations):
+    """
+    Copies the history at path into a table with the old formatted text
+    timestamps and no indexes, then times last10, lastwon and lastplayed
+    against it as they used to run and against owmaps as they run now.
+    Returns {command: (text seconds per call, epoch seconds per call)}.
+    """
+    connection = sqlite3.connect(path, cached_statements=STATEMENT_CACHE_SIZE)
+
+    try:
+        connection.execute("CREATE TEMP TABLE legacy_owmaps AS "
+                           "SELECT om.season, mr.map_name, om.map_result, "
+                           "strftime(?, om.timestamp, 'unixepoch', 'localtime') AS timestamp "
+                           "FROM owmaps om JOIN map_ref mr ON mr.id = om.map_id", (LEGACY_TIME_FORMAT,))
+        map_id = MapCatalog.load(connection).id("ilios")
+
+        def last10():
+            return [(game_map, result, format_timestamp(timestamp))
+                    for game_map, result, timestamp in connection.execute(QUERIES["last10"]).fetchall()]
+
+        def last(name):
+            return format_elapsed(connection.execute(QUERIES[name], {"map_id": map_id}).fetchone()[0])
+
+        commands = {
+            "last10": (lambda: connection.execute("SELECT map_name, map_result, timestamp FROM legacy_owmaps "
+                                                  "ORDER BY timestamp DESC LIMIT 10").fetchall(), last10),
+            "lastwon": (lambda: legacy_elapsed(connection, "SELECT MAX(timestamp), season FROM legacy_owmaps "
+                                                           "WHERE map_name = ? AND map_result = 'w'", "ilios"),
+                        lambda: last("lastwon")),
+            "lastplayed": (lambda: legacy_elapsed(connection, "SELECT MAX(timestamp) FROM legacy_owmaps "
+                                                              "WHERE map_name = ?", "ilios"),
+                           lambda: last("lastplayed"))}
+        results = {}
+
+        for name, runs in commands.items():
+            timings = []
+            for run in runs:
+                run()
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    run()
+                timings.append((time.perf_counter() - start) / iterations)
+            results[name] = tuple(timings)
+    finally:
+        connection.close()
+
+    return results
+
+
+def per_cell_report(connection, season):
+    """
+    Computes the cells of build_report's map x player, map type x season
+    and stack size x result tables with one query per cell, as group_stats
+    does per player. Returns the number of queries run.
+    """
+    catalog = MapCatalog.load(connection)
+    roster = load_roster(connection)
+    seasons = [row[0] for row in connection.execute("SELECT DISTINCT season FROM owmaps")]
+    queries = 0
+
+    for player in roster:
+        for map_id in catalog.names:
+            connection.execute("SELECT COUNT(*), SUM(CASE WHEN om.map_result = 'w' THEN 1 ELSE 0 END) "
+                               "FROM game_players gp JOIN owmaps om ON om.id = gp.game_id "
+                               "WHERE gp.player = ? AND om.season = ? AND om.map_id = ?",
+                               (player, season, map_id)).fetchone()
+            queries += 1
+
+    for map_type in set(catalog.types.values()):
+        for other in seasons:
+            connection.execute("SELECT COUNT(*), SUM(CASE WHEN om.map_result = 'w' THEN 1 ELSE 0 END) "
+                               "FROM owmaps om JOIN map_ref mr ON mr.id = om.map_id "
+                               "WHERE mr.map_type = ? AND om.season = ?", (map_type, other)).fetchone()
+            queries += 1
+
+    for size in range(len(roster) + 1):
+        for result in "wld":
+            connection.execute("SELECT COUNT(*) FROM owmaps WHERE season = ? AND COALESCE(LENGTH(stack), 0) = ? "
+                               "AND map_result = ?", (season, size, result)).fetchone()
+            queries += 1
+
+    return queries
+
+
+def report_bench(path, season):
+    """
+    Times the report for season from the columnar arrays and computed
+    one query per cell. Returns {method: (seconds, queries)}.
+    """
+    connection = sqlite3.connect(path, cached_statements=STATEMENT_CACHE_SIZE)
+
+    try:
+        start = time.perf_counter()
+        build_report(connection, season)
+        results = {"columnar": (time.perf_counter() - start, 1)}
+
+        start = time.perf_counter()
+        queries = per_cell_report(connection, season)
+        results["query per cell"] = (time.perf_counter() - start, queries)
+    finally:
+        connection.close()
+
+    return results
+
+
+def resolve_bench(iterations):
+    """
+    Times building a MapResolver and resolving each kind of map name.
+    Returns (build seconds, {kind: (name, result, seconds per call)}).
+    """
+    start = time.perf_counter()
+    resolver = MapResolver(map_name_data.map_names, map_name_data.aliases)
+    build = time.perf_counter() - start
+
+    names = {"exact": "kings-row", "normalized": "Kings Row", "alias": "gibby", "word prefix": "gibr",
+             "typo": "kingsrwo", "unknown": "zzzzzz"}
+    results = {}
+
+    for kind, name in names.items():
+        try:
+            result = resolver.resolve(name)
+        except ValueError as e:
+            result = str(e)
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            try:
+                resolver.resolve(name)
+            except ValueError:
+                pass
+        results[kind] = (name, result, (time.perf_counter() - start) / iterations)
+
+    return build, results
+
+
+def startup_bench(path, repeat):
+    """
+    Times importing map_bot, preparing the up to date database at path,
+    opening it as a tenant, then preparing a copy one migration behind, each
+    run in a fresh interpreter. Returns ({stage: median seconds}, the
+    STARTUP_HEAVY modules imported before the migration).
+    """
+    migrate_path = path + ".migrate"
+    times = {}
+    heavy = set()
+
+    for _ in range(repeat):
+        shutil.copyfile(path, migrate_path)
+        connection = sqlite3.connect(migrate_path)
+        try:
+            connection.execute("DROP TABLE player_stats")
+            connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION - 1}")
+        finally:
+            connection.close()
+
+        result = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT, path, migrate_path, ",".join(STARTUP_HEAVY)],
+                                cwd=os.path.dirname(os.path.abspath(map_bot.__file__)),
+                                capture_output=True, text=True, check=True)
+        # prepare_database prints its progress before the results
+        result = json.loads(result.stdout.splitlines()[-1])
+
+        for stage, seconds in result["times"].items():
+            times.setdefault(stage, []).append(seconds)
+        heavy.update(result["heavy"])
+
+    os.remove(migrate_path)
+    return {stage: statistics.median(seconds) for stage, seconds in times.items()}, sorted(heavy)
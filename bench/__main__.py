@@ -0,0 +1,274 @@
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+import map_bot
+from map_bot import bot_data, configure, run_offline, sender, tenant_path
+
+from bench import (BENCH_REPEAT, BENCH_SIZES, BENCH_TOLERANCE, SYNTH_STACKS, bench, burst_bench, chart_bench,
+                   compare_bench, digest_bench, import_bench, load_bench, parse_stacks, replica_bench, report_bench,
+                   resolve_bench, startup_bench, statement_bench, stress, synth_database, timestamp_bench)
+from bench.gateway import read_gateway_events, replay_gateway, slash_gateway_events, synth_gateway_events
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench",
+                                     description="Overwatch map tracking discord bot benchmarks")
+    parser.add_argument("--guild", type=int, help="guild id, when DB is a per guild path template")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    synth_parser = subparsers.add_parser("synth", help="add a generated match history to the database in DB")
+    synth_parser.add_argument("--games", type=int, default=10000)
+    synth_parser.add_argument("--seasons", type=int, default=4, help="seasons up to the default season")
+    synth_parser.add_argument("--players", type=int, default=6, help="how many roster players appear in stacks")
+    synth_parser.add_argument("--stacks", default=SYNTH_STACKS, help="stack size weights, size:weight,...")
+    synth_parser.add_argument("--seed", type=int, default=0)
+
+    bench_parser = subparsers.add_parser("bench", help="benchmark every command on generated histories")
+    bench_parser.add_argument("--sizes", default=BENCH_SIZES, help="comma separated game counts")
+    bench_parser.add_argument("--repeat", type=int, default=BENCH_REPEAT)
+    bench_parser.add_argument("--data-dir", help="keep generated databases here and reuse them")
+    bench_parser.add_argument("--baseline", help="JSON file of baselines to compare with")
+    bench_parser.add_argument("--save", action="store_true", help="write the results to --baseline")
+    bench_parser.add_argument("--tolerance", type=float, default=BENCH_TOLERANCE,
+                              help="slowdown ratio allowed before a command regresses")
+
+    load_parser = subparsers.add_parser("load-bench", help="compare read latency under a burst of concurrent commands "
+                                                      "with a connection per command and with the database pool")
+    load_parser.add_argument("--games", type=int, default=100000)
+    load_parser.add_argument("--commands", type=int, default=500, help="commands fired at once")
+
+    import_parser = subparsers.add_parser("import-bench", help="time importing and exporting a generated history")
+    import_parser.add_argument("--games", type=int, default=1000000)
+    import_parser.add_argument("--sample", type=int, default=10000, help="rows imported one transaction per game")
+
+    burst_parser = subparsers.add_parser("burst-bench", help="compare replies to a burst of commands sent straight "
+                                                        "to fake channels and through the rate limited sender")
+    burst_parser.add_argument("--commands", type=int, default=200)
+    burst_parser.add_argument("--channels", type=int, default=4)
+    burst_parser.add_argument("--limit", type=int, default=5, help="messages a channel accepts a window")
+    burst_parser.add_argument("--window", type=float, default=0.5,
+                              help="rate limit window in seconds (Discord's is 5, shorter runs faster)")
+
+    stress_parser = subparsers.add_parser("stress", help="compare concurrent adds with and without the ingest queue")
+    stress_parser.add_argument("--writers", type=int, default=50)
+    stress_parser.add_argument("--adds", type=int, default=20, help="adds per writer")
+
+    chart_parser = subparsers.add_parser("chart-bench", help="measure chart render throughput and event loop lag")
+    chart_parser.add_argument("--charts", type=int, default=20)
+
+    statement_parser = subparsers.add_parser("statement-bench",
+                                             help="measure each registered read with and without the statement cache")
+    statement_parser.add_argument("--games", type=int, default=10000)
+    statement_parser.add_argument("--iterations", type=int, default=1000)
+
+    timestamp_parser = subparsers.add_parser("timestamp-bench", help="compare last10, lastwon and lastplayed on "
+                                                                 "formatted text timestamps and epoch seconds")
+    timestamp_parser.add_argument("--games", type=int, default=100000)
+    timestamp_parser.add_argument("--iterations", type=int, default=100)
+
+    report_parser = subparsers.add_parser("report-bench", help="time the season report on a generated history "
+                                                          "against one query per report cell")
+    report_parser.add_argument("--games", type=int, default=1000000)
+
+    resolve_parser = subparsers.add_parser("resolve-bench", help="measure map name resolution latency")
+    resolve_parser.add_argument("--iterations", type=int, default=10000)
+
+    digest_parser = subparsers.add_parser("digest-bench", help="time session digests over histories of each size")
+    digest_parser.add_argument("--sizes", default=BENCH_SIZES, help="comma separated game counts")
+    digest_parser.add_argument("--session", type=int, default=20, help="games in the session")
+    digest_parser.add_argument("--repeat", type=int, default=BENCH_REPEAT)
+
+    replica_parser = subparsers.add_parser("replica-bench", help="compare analytics reads during adds with and without a replica")
+    replica_parser.add_argument("--games", type=int, default=200000)
+    replica_parser.add_argument("--seconds", type=float, default=10)
+    replica_parser.add_argument("--readers", type=int, default=4)
+    replica_parser.add_argument("--writers", type=int, default=4)
+    replica_parser.add_argument("--add-rate", type=float, default=100, help="adds per second across the writers")
+
+    startup_parser = subparsers.add_parser("startup", help="time the import, preparing an up to date and a "
+                                                           "migrating database, and opening a tenant")
+    startup_parser.add_argument("--games", type=int, default=100000)
+    startup_parser.add_argument("--repeat", type=int, default=BENCH_REPEAT)
+
+    gateway_parser = subparsers.add_parser("gateway-bench", help="replay gateway events with prefix and slash commands")
+    gateway_parser.add_argument("--messages", type=int, default=100000)
+    gateway_parser.add_argument("--command-rate", type=float, default=0.02, help="share of messages that are commands")
+    gateway_parser.add_argument("--stream", help="JSON lines of recorded gateway dispatches to replay instead")
+
+    args = parser.parse_args()
+
+    bot_data.started = time.perf_counter()
+    configure()
+    start = time.perf_counter()
+
+    if args.command == "synth":
+        if map_bot.DB_PATH is None:
+            parser.error("synth adds to the database in DB, set it")
+        if "{guild}" in map_bot.DB_PATH and args.guild is None:
+            parser.error("DB has a database per guild, pass --guild")
+
+        try:
+            stacks = parse_stacks(args.stacks)
+        except ValueError as e:
+            parser.error(str(e))
+
+        imported, _, _ = asyncio.run(run_offline(tenant_path(args.guild), synth_database, args.games, args.seasons,
+                                                 args.players, stacks, args.seed))
+        print(f"✅ Generated {imported} games in {time.perf_counter() - start:.2f}s")
+
+    elif args.command == "bench":
+        if args.save and not args.baseline:
+            parser.error("--save needs --baseline")
+
+        sizes = [int(size) for size in args.sizes.split(",")]
+        # Measure the bot, not Discord's rate limit
+        sender.per_seconds = 0
+
+        if args.data_dir:
+            os.makedirs(args.data_dir, exist_ok=True)
+            results = asyncio.run(bench(sizes, args.data_dir, args.repeat))
+        else:
+            with tempfile.TemporaryDirectory() as directory:
+                results = asyncio.run(bench(sizes, directory, args.repeat))
+
+        if args.save:
+            with open(args.baseline, "w", encoding="utf-8") as stream:
+                json.dump(results, stream, indent=2)
+            print(f"✅ Baselines saved to {args.baseline}")
+        elif args.baseline:
+            with open(args.baseline, encoding="utf-8") as stream:
+                regressions = compare_bench(results, json.load(stream), args.tolerance)
+
+            for regression in regressions:
+                print(f"⚠️ {regression}")
+            if regressions:
+                raise SystemExit(1)
+            print("✅ No regressions against the baselines")
+
+    elif args.command == "load-bench":
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "load.db")
+            asyncio.run(run_offline(path, synth_database, args.games, 4, 6, parse_stacks(SYNTH_STACKS)))
+            results = asyncio.run(load_bench(path, args.commands))
+
+        for mode, (p50, p99, rate, lag) in results.items():
+            print(f"{mode:<24} p50 {p50 * 1000:8.1f}ms  p99 {p99 * 1000:8.1f}ms  {rate:8.0f} commands/s  "
+                  f"event loop lag max {lag * 1000:7.1f}ms")
+
+    elif args.command == "import-bench":
+        with tempfile.TemporaryDirectory() as directory:
+            results = asyncio.run(import_bench(directory, args.games, args.sample))
+
+        for phase, (rows, seconds) in results.items():
+            print(f"{phase:<26} {rows:9} rows  {seconds:7.2f}s  {rows / seconds:9.0f} rows/s")
+
+    elif args.command == "burst-bench":
+        results = asyncio.run(burst_bench(args.commands, args.channels, args.limit, args.window))
+
+        for mode, (sent, rate_limited, rejected, p50, p99) in results.items():
+            print(f"{mode:<8} {sent:6} messages  {rate_limited:6} 429s  {rejected:5} rejected  "
+                  f"p50 {p50:7.2f}s  p99 {p99:7.2f}s")
+
+    elif args.command == "stress":
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "stress.db")
+            asyncio.run(run_offline(path, synth_database, 10000, 4, 6, parse_stacks(SYNTH_STACKS)))
+            results = asyncio.run(stress(path, args.writers, args.adds))
+
+            connection = sqlite3.connect(path)
+            committed = connection.execute("SELECT COUNT(*) FROM owmaps WHERE added_by = 'stress'").fetchone()[0]
+            connection.close()
+
+        for mode, (rate, errors) in results.items():
+            print(f"{mode:<20} {rate:9.0f} adds/s {errors:5} errors")
+        print(f"✅ {committed} of {2 * args.writers * args.adds} adds committed")
+
+    elif args.command == "chart-bench":
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "charts.db")
+            asyncio.run(run_offline(path, synth_database, 10000, 4, 6, parse_stacks(SYNTH_STACKS)))
+            results = asyncio.run(chart_bench(path, args.charts))
+
+        for phase, (rate, max_lag, p95_lag) in results.items():
+            print(f"{phase:<14} {rate:8.1f} charts/s   event loop lag max {max_lag * 1000:7.1f}ms "
+                  f"p95 {p95_lag * 1000:7.1f}ms")
+
+    elif args.command == "statement-bench":
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "statements.db")
+            asyncio.run(run_offline(path, synth_database, args.games, 4, 6, parse_stacks(SYNTH_STACKS)))
+            results = statement_bench(path, args.iterations)
+
+        for name, (uncached, cached) in results.items():
+            print(f"{name:<16} {uncached * 1e6:10.1f}µs uncached  {cached * 1e6:10.1f}µs cached  "
+                  f"{(uncached - cached) * 1e6:8.1f}µs parse and plan")
+
+    elif args.command == "timestamp-bench":
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "timestamps.db")
+            asyncio.run(run_offline(path, synth_database, args.games, 4, 6, parse_stacks(SYNTH_STACKS)))
+            results = timestamp_bench(path, args.iterations)
+
+        for name, (text, epoch) in results.items():
+            print(f"{name:<12} {text * 1e6:10.1f}µs text  {epoch * 1e6:10.1f}µs epoch  {text / epoch:7.1f}x")
+
+    elif args.command == "report-bench":
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "report.db")
+            asyncio.run(run_offline(path, synth_database, args.games, 4, 6, parse_stacks(SYNTH_STACKS)))
+            results = report_bench(path, bot_data.default_season)
+
+        for method, (seconds, queries) in results.items():
+            print(f"{method:<16} {seconds:8.2f}s  {queries:5} queries")
+
+    elif args.command == "resolve-bench":
+        build, results = resolve_bench(args.iterations)
+
+        print(f"Index built in {build * 1e6:.0f}µs")
+        for kind, (name, result, seconds) in results.items():
+            print(f"{kind:<12} {name!r:<14} {seconds * 1e6:8.2f}µs  {result}")
+
+    elif args.command == "digest-bench":
+        with tempfile.TemporaryDirectory() as directory:
+            sizes = [int(size) for size in args.sizes.split(",")]
+            results = asyncio.run(digest_bench(directory, sizes, args.session, args.repeat))
+
+        for size, (seconds, queries) in results.items():
+            print(f"{size:>10} games  {args.session} game session  {seconds * 1000:7.2f}ms  {queries} database calls")
+
+    elif args.command == "replica-bench":
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "replica.db")
+            asyncio.run(run_offline(path, synth_database, args.games, 4, 6, parse_stacks(SYNTH_STACKS)))
+            results = asyncio.run(replica_bench(path, args.seconds, args.readers, args.writers, args.add_rate))
+
+        for mode, (read_rate, read_p95, add_rate, add_p95) in results.items():
+            print(f"reads on {mode:<9} {read_rate:8.1f} reads/s  p95 {read_p95 * 1000:7.1f}ms   "
+                  f"{add_rate:8.1f} adds/s  p95 {add_p95 * 1000:7.1f}ms")
+
+    elif args.command == "startup":
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "startup.db")
+            asyncio.run(run_offline(path, synth_database, args.games, 4, 6, parse_stacks(SYNTH_STACKS)))
+            times, heavy = startup_bench(path, args.repeat)
+
+        for stage, seconds in times.items():
+            print(f"{stage:<22} {seconds * 1000:8.1f}ms")
+        print(f"Imported before migrating: {', '.join(heavy) or 'nothing heavy'}")
+
+    elif args.command == "gateway-bench":
+        events = read_gateway_events(args.stream) if args.stream else synth_gateway_events(args.messages, args.command_rate)
+
+        for label, replayed in (("prefix (all intents)", events), ("slash (guilds intent)", slash_gateway_events(events))):
+            found, seconds, cpu = asyncio.run(replay_gateway(replayed))
+            print(f"{label:<22} {len(replayed):8} events  {found:6} commands  {seconds:7.2f}s  "
+                  f"{len(replayed) / seconds:9.0f} events/s  {cpu * 1000:8.1f}ms CPU")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Replays Discord gateway events through the bot's parsers, to compare the
+cost of prefix commands with every intent against slash commands with
+only the guilds intent. Swaps out private discord.py connection state
+while it runs, so it only belongs in a benchmark.
+"""
+
+import json
+import random
+import time
+
+import discord
+
+from map_bot import bot, bot_data, metrics
+
+from bench import bench_commands
+
+# Gateway events the bot still receives with only the guilds intent
+GUILD_INTENT_EVENTS = ("READY", "RESUMED", "INTERACTION_CREATE", "GUILD_CREATE", "GUILD_UPDATE", "GUILD_DELETE",
+                       "GUILD_ROLE_", "CHANNEL_", "THREAD_", "STAGE_INSTANCE_")
+
+GATEWAY_CHATTER = ["gg", "one more?", "who's tanking", "brb", "that was close", "queue again", "lol", "nice one"]
+
+
+def gateway_message(index, content, author_id):
+    """
+    Returns a MESSAGE_CREATE payload for a message in guild 1, channel 1.
+    """
+    return {"id": str(10 ** 17 + index), "channel_id": "1", "guild_id": "1", "content": content, "type": 0,
+            "author": {"id": str(author_id), "username": f"player{author_id}", "discriminator": "0", "avatar": None},
+            "timestamp": "2024-01-01T00:00:00+00:00", "edited_timestamp": None, "tts": False,
+            "mention_everyone": False, "mentions": [], "mention_roles": [], "attachments": [], "embeds": [],
+            "pinned": False}
+
+
+def gateway_interaction(message):
+    """
+    Returns the INTERACTION_CREATE payload of the slash command a prefix command message stands for.
+    """
+    name, *options = message["content"][1:].split()
+    return {"id": message["id"], "application_id": "1", "type": 2, "token": "replay", "version": 1,
+            "guild_id": message["guild_id"], "channel_id": message["channel_id"], "locale": "en-US",
+            "app_permissions": "0", "attachment_size_limit": 10 * 1024 * 1024, "entitlements": [],
+            "member": {"user": message["author"], "roles": [], "joined_at": message["timestamp"], "deaf": False,
+                       "mute": False, "flags": 0, "permissions": "0"},
+            "data": {"id": "1", "name": name, "type": 1,
+                     "options": [{"name": f"option{i}", "type": 3, "value": value} for i, value in enumerate(options)]}}
+
+
+def synth_gateway_events(messages, command_rate, seed=0):
+    """
+    Returns the gateway events of a guild chat of messages messages, about
+    command_rate of them bot commands, as every intent delivers them:
+    a TYPING_START and a MESSAGE_CREATE per message.
+    """
+    rng = random.Random(seed)
+    commands_run = [f"m{name} {' '.join(args)}".strip() for name, args in bench_commands(bot_data.default_season)]
+    events = []
+
+    for index in range(messages):
+        author_id = rng.randint(2, 12)
+        content = rng.choice(commands_run) if rng.random() < command_rate else rng.choice(GATEWAY_CHATTER)
+        events.append(("TYPING_START", {"channel_id": "1", "guild_id": "1", "user_id": str(author_id),
+                                        "timestamp": 1704067200}))
+        events.append(("MESSAGE_CREATE", gateway_message(index, content, author_id)))
+
+    return events
+
+
+def slash_gateway_events(events):
+    """
+    Returns the events of the same chat with only the guilds intent: commands
+    arrive as interactions and messages, typing and presences are not sent.
+    """
+    slash = []
+
+    for event_type, payload in events:
+        if event_type == "MESSAGE_CREATE" and payload["content"].startswith("m"):
+            name = payload["content"][1:].split(maxsplit=1)[0] if payload["content"][1:].strip() else ""
+            if bot.get_command(name) is not None:
+                slash.append(("INTERACTION_CREATE", gateway_interaction(payload)))
+        elif event_type.startswith(GUILD_INTENT_EVENTS):
+            slash.append((event_type, payload))
+
+    return slash
+
+
+async def replay_gateway(events):
+    """
+    Feeds (event type, payload) pairs through the bot's gateway parsers as
+    the connection does, and finds the command each message or interaction
+    is for like the bot would, without running it.
+    Returns (commands found, seconds, CPU seconds).
+    """
+    state = bot._connection
+    dispatched = []
+    found = 0
+
+    command_tree, state._command_tree = state._command_tree, None
+    dispatch, state.dispatch = state.dispatch, lambda event, *args: dispatched.append((event, args))
+    prefix, bot.command_prefix = bot.command_prefix, "m"
+    user = state.user
+    if user is None:
+        # get_context ignores the bot's own messages, so it needs to know who the bot is
+        state.user = discord.ClientUser(state=state, data={"id": "1", "username": "MapBot", "discriminator": "0",
+                                                           "avatar": None, "bot": True})
+    start, cpu_start = time.perf_counter(), time.process_time()
+
+    try:
+        for event_type, payload in events:
+            metrics.record_event(event_type)
+            state.parsers[event_type](payload)
+
+            for event, args in dispatched:
+                if event == "message":
+                    found += (await bot.get_context(args[0])).command is not None
+                elif event == "interaction":
+                    found += bot.tree.get_command(args[0].data["name"]) is not None
+            dispatched.clear()
+
+        return found, time.perf_counter() - start, time.process_time() - cpu_start
+    finally:
+        state._command_tree, state.dispatch, bot.command_prefix, state.user = command_tree, dispatch, prefix, user
+
+
+def read_gateway_events(path):
+    """
+    Reads a recorded gateway stream: JSON lines of dispatch payloads with t and d.
+    """
+    with open(path, encoding="utf-8") as stream:
+        return [(event["t"], event["d"]) for event in map(json.loads, stream) if event.get("t") in bot._connection.parsers]
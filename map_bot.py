@@ -1,44 +1,125 @@
 import sqlite3
 import discord
 import datetime
+import argparse
+import asyncio
+import tempfile
+import csv
+import json
+import hashlib
+import io
+import threading
+import importlib.util
+import multiprocessing
+import contextvars
+import logging
+import reprlib
 import time
 import os
 import re
 
 from dotenv import load_dotenv
 from datetime import datetime
-from discord.ext import commands
+from discord import app_commands
+from discord.ext import commands, tasks
 from dataclasses import dataclass
-
-from sqlalchemy import create_engine, Column, Integer, Text, DateTime, String, CheckConstraint, ForeignKey
-from sqlalchemy.ext.declarative import declarative_base
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 # IMPORTANT CONSTATNTS
+#
+# Read from the environment (and .env) by configure() when the bot or a
+# command line tool starts, so importing this module has no side effects.
+
+BOT_TOKEN = None
+CHANNEL_ID = None
+# A SQLite file or a SQLAlchemy async URL such as postgresql+asyncpg://...
+# Either one database for every guild, or containing {guild} for one database per guild
+DB_PATH = None
+# Most per guild databases kept open at once
+MAX_OPEN_TENANTS = 32
+
+# Queries slower than this are logged with their SQL and parameters
+SLOW_QUERY_SECONDS = 0.25
+# Optional path to write Prometheus text format metrics to
+METRICS_FILE = None
+# Also answer mwinrate style prefix commands. They need every guild message
+# and its content from the gateway, where slash commands only need guild events
+PREFIX_COMMANDS = False
+# Analytics read from a copy of a SQLite database at most this many seconds
+# behind it, or from the database itself when 0
+REPLICA_MAX_AGE = 10
+# Keep the copy in two files next to the database rather than in memory
+REPLICA_ON_DISK = False
+# A play session ends once no game has been added for this long
+SESSION_GAP_MINUTES = 60
+# Where the hash of the last slash commands synced to Discord is kept
+COMMAND_HASH_FILE = ".command_tree_hash"
+
+
+def configure():
+    global BOT_TOKEN, CHANNEL_ID, DB_PATH, MAX_OPEN_TENANTS, SLOW_QUERY_SECONDS, METRICS_FILE, PREFIX_COMMANDS
+    global REPLICA_MAX_AGE, REPLICA_ON_DISK, SESSION_GAP_MINUTES, COMMAND_HASH_FILE
+
+    load_dotenv()
+
+    BOT_TOKEN = os.getenv("TOKEN")
+    CHANNEL_ID = int(os.getenv("ID")) if os.getenv("ID") else None
+    DB_PATH = os.getenv("DB")
+    MAX_OPEN_TENANTS = int(os.getenv("MAX_OPEN_TENANTS", MAX_OPEN_TENANTS))
+    SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_MS", SLOW_QUERY_SECONDS * 1000)) / 1000
+    METRICS_FILE = os.getenv("METRICS_FILE")
+    PREFIX_COMMANDS = os.getenv("PREFIX_COMMANDS", "").lower() in ("1", "true", "yes")
+    REPLICA_MAX_AGE = float(os.getenv("REPLICA_MAX_AGE", REPLICA_MAX_AGE))
+    REPLICA_ON_DISK = os.getenv("REPLICA_ON_DISK", "").lower() in ("1", "true", "yes")
+    SESSION_GAP_MINUTES = float(os.getenv("SESSION_GAP_MINUTES", SESSION_GAP_MINUTES))
+    COMMAND_HASH_FILE = os.getenv("COMMAND_HASH_FILE", COMMAND_HASH_FILE)
+
+    # Read by the bot when it connects
+    intents.guild_messages = intents.message_content = PREFIX_COMMANDS
+    bot.command_prefix = "m" if PREFIX_COMMANDS else commands.when_mentioned
+
+    # Extra map aliases as alias=map_name,...
+    for alias in filter(None, os.getenv("MAP_ALIASES", "").split(",")):
+        name, _, map_name = alias.partition("=")
+        map_name_data.aliases[name.strip()] = map_name.strip()
 
-load_dotenv()
-
-BOT_TOKEN = os.getenv("TOKEN")
-CHANNEL_ID = int(os.getenv("ID"))
-DB_PATH = os.getenv("DB")
 
 # DISCORD BOT
 
-bot = commands.Bot(command_prefix="m", intents=discord.Intents.all())
+intents = discord.Intents.none()
+intents.guilds = True
+
+bot = commands.Bot(command_prefix="m", intents=intents)
 
 @dataclass
 class MapNameData:
     """
-    Stores the name of the maps
-    """
-    map_names = ["antarctic-peninsula","busan","ilios",
-                 "lijang-tower","nepal","oasis",
-                 "samoa","circuit-royale","dorado",
-                 "havana","junkertown", "rialto",
-                 "route-66","shambali-monastery","watchpoint-gibraltar",
-                 "new-junk-city","suravasa","blizzard-world",
-                 "eichenwalde","hollywood","kings-row","midtown",
-                 "numbani","paraiso","colosseo",
-                 "esperanca","new-queen-street","runasapi",]
+    Stores the name and type of the maps. This is the one list of maps;
+    map_ref is seeded from it and a new map only needs adding here.
+    """
+    map_types = {"antarctic-peninsula": "control", "busan": "control",
+                 "ilios": "control", "lijang-tower": "control",
+                 "nepal": "control", "oasis": "control",
+                 "samoa": "control", "circuit-royale": "escort",
+                 "dorado": "escort", "havana": "escort",
+                 "junkertown": "escort", "rialto": "escort",
+                 "route-66": "escort", "shambali-monastery": "escort",
+                 "watchpoint-gibraltar": "escort", "new-junk-city": "flashpoint",
+                 "suravasa": "flashpoint", "blizzard-world": "hybrid",
+                 "eichenwalde": "hybrid", "hollywood": "hybrid",
+                 "kings-row": "hybrid", "midtown": "hybrid",
+                 "numbani": "hybrid", "paraiso": "hybrid",
+                 "colosseo": "push", "esperanca": "push",
+                 "new-queen-street": "push", "runasapi": "push",}
+
+    map_names = list(map_types)
+
+    # Nicknames that are not a prefix of the map name or one of its words
+    aliases = {"kr": "kings-row", "gibby": "watchpoint-gibraltar", "wg": "watchpoint-gibraltar",
+               "66": "route-66", "nqs": "new-queen-street", "njc": "new-junk-city",
+               "bw": "blizzard-world", "eich": "eichenwalde", "antarctica": "antarctic-peninsula",
+               "lijiang": "lijang-tower", "shambala": "shambali-monastery"}
     
 
 @dataclass
@@ -46,7 +127,7 @@ class BotData:
     """
     General Data the bot keeps tracks of in a session.
     """
-    bot_commands = ["madd map_name result --stack --season",
+    bot_commands = ["madd map_name result[, map_name result ...] --season s16 --stack WLD",
                     "mwinrate season map_name",
                     "mlastwon map_name",
                     "mlastplayed map_name",
@@ -57,587 +138,4167 @@ class BotData:
                     "mseasonworstmaps",
                     "mmostplayed",
                     "mmostplayedall",
-                    "mmaps"]   
+                    "mmaps",
+                    "mform [map|player|season] [games]",
+                    "mstreaks",
+                    "mtrend [map|player|season]",
+                    "mreport season",
+                    "mchart maps [season] | winrate map_name [season]",
+                    "mroster",
+                    "msetplayer letter name",
+                    "mremoveplayer letter",
+                    "mconfig [key value]",
+                    "mrollover [season]",
+                    "mreplica",
+                    "mdigest",
+                    "mexport csv|jsonl"]   
+
+    default_season = "s16"
+
+    # perf_counter() when main() started, for the startup time logged in on_ready
+    started = None
 
 
-Base = declarative_base()
+@dataclass
+class GroupData:
+    """
+    Players in the group, keyed by the letter used for them in a stack.
+    This is the roster every new database starts with; each guild can
+    change its own with msetplayer and mremoveplayer.
+    """
+    members = {"W":"Will", "L":"Liam", "D":"Dan", "E":"Ewan", "C":"Chelsea", "J":"Justin"}
 
-class MapReference(Base):
-    __tablename__ = 'map_ref'
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    map_name = Column(String, unique=True, nullable=False)
-    map_type = Column(String, nullable=False)
+bot_data = BotData()
+map_name_data = MapNameData()
+group_data = GroupData()
 
 
-class OwMapsTable(Base):
-    __tablename__ = 'owmaps'
+# Map Catalog
 
-    # SCHEMA
+class MapCatalog:
+    """
+    In-memory copy of map_ref, loaded once at startup.
+    Maps names to their integer ids and ids to names and types, so games
+    are stored and aggregated by id without joining on map names.
+    """
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    season = Column(Text, nullable=False)
-    map_name = Column(Text, ForeignKey("map_ref.map_name"), nullable=False)
-    map_result = Column(Text, nullable=False)
-    stack = Column(Text, nullable=True)
-    timestamp = Column(DateTime, nullable=False)
-    added_by = Column(Text, nullable=False)
+    def __init__(self, rows):
+        self.ids = {}
+        self.names = {}
+        self.types = {}
 
-    # CONSTRAINTS
-    __table_args__ = (
-        CheckConstraint("season LIKE 's__' AND CAST(SUBSTR(season, 2, 2) AS INTEGER) BETWEEN 0 and 99", name = 'check_season_format'),
-        CheckConstraint("map_name IN ('antarctic-peninsula','busan','ilios','lijang-tower',"
-                        "'nepal','oasis','samoa','circuit-royale','dorado','havana','junkertown',"
-                        "'rialto','route-66','shambali-monastery','watchpoint-gibraltar','new-junk-city',"
-                        "'suravasa','blizzard-world','eichenwalde','hollywood','kings-row','midtown',"
-                        "'numbani','paraiso','colosseo','esperanca','new-queen-street','runasapi')", 
-                        name ='check_map_name'),
+        for map_id, map_name, map_type in rows:
+            self.ids[map_name] = map_id
+            self.names[map_id] = map_name
+            self.types[map_id] = map_type
 
-        CheckConstraint("map_result IN ('w', 'l', 'd')", name = 'check_map_result'),
-        CheckConstraint("LENGTH(stack) <= 5", name="check_stack_length"),        
-        )
-        
+        self.resolver = MapResolver(self.ids, map_name_data.aliases)
 
-engine = create_engine(f'sqlite:///{DB_PATH}')
-Base.metadata.create_all(engine)
+    @classmethod
+    def load(cls, connection):
+        return cls(connection.execute("SELECT id, map_name, map_type FROM map_ref ORDER BY id"))
 
-bot_data = BotData()
-map_name_data = MapNameData()
+    def resolve(self, map_name):
+        """
+        Returns the map name map_name refers to (see MapResolver),
+        raising ValueError with suggestions for an unknown map.
+        """
+        return self.resolver.resolve(map_name)
 
+    def id(self, map_name):
+        """
+        Returns the id of the map map_name refers to, raising ValueError for an unknown map.
+        """
+        return self.ids[self.resolve(map_name)]
 
-# Populate ref table
 
-connection = sqlite3.connect(DB_PATH)
-cursor = connection.cursor()
+# Map Names
+#
+# Commands take map names the way people type them. MapResolver is built
+# with the catalog and canonicalizes a name without touching the database:
+# the exact name, then names and aliases compared without case, spaces
+# or punctuation, then a unique prefix of a name or of one of its words.
+# Anything else is rejected, suggesting the closest names by edit
+# distance among those sharing a trigram with it.
 
-cursor.execute("SELECT COUNT(*) FROM map_ref")
-count = cursor.fetchone()[0]
+MIN_PREFIX = 3
+MAX_SUGGESTIONS = 3
 
-if count == 0:
-    maps = [("antarctic-peninsula", "control"), ("busan", "control"),
-            ("ilios", "control"), ("lijang-tower", "control"),
-            ("nepal", "control"), ("oasis", "control"),
-            ("samoa", "control"), ("circuit-royale", "escort"),
-            ("dorado", "escort"), ("havana", "escort"),
-            ("junkertown", "escort"), ("rialto", "escort"),
-            ("route-66", "escort"), ("shambali-monastery", "escort"),
-            ("watchpoint-gibraltar", "escort"),("new-junk-city", "flashpoint"),
-            ("suravasa", "flashpoint"), ("blizzard-world", "hybrid"),
-            ("eichenwalde", "hybrid"), ("hollywood", "hybrid"),
-            ("kings-row", "hybrid"), ("midtown", "hybrid"),
-            ("numbani", "hybrid"), ("paraiso", "hybrid"),
-            ("colosseo", "push"), ("esperanca", "push"),
-            ("new-queen-street", "push"), ("runasapi", "push"),]
 
-    cursor.executemany("INSERT INTO map_ref (map_name, map_type) VALUES (?, ?)", maps)
-    connection.commit()
-    print("✅ Map reference table populated!")
-else:
-    print("ℹ️ Table already populated, skipping insert.")
+def normalize_map_name(name):
+    return re.sub(r"[^a-z0-9]", "", name.lower())
 
-connection.close()
 
-# Helper Functions
+def edit_distance(a, b):
+    """
+    Returns the Levenshtein distance between a and b.
+    """
+    previous = list(range(len(b) + 1))
 
-def validate_stack(stack):
-    allowed_chars = 'LWDEJC'
-    return all(char in allowed_chars for char in stack)
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
 
+    return previous[-1]
 
-# Bot Behaviour
 
-@bot.event
-async def on_ready():
-    """
-    Functionaliy when bot activated
-    """
-    channel = bot.get_channel(CHANNEL_ID)
-    msg = "\nMAP BOT RUNNING\n"
-    instr = "\n Information on how to use the bot can be found by typing in 'mcmds'"
-    
-    await channel.send(msg)
-    await channel.send(instr)
+def trigrams(key):
+    padded = f"^{key}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
 
 
-@bot.command()
-async def add(ctx, map_name: str, map_result: str, season='s16', stack=None):
+class MapResolver:
     """
+    Index of map names and aliases: normalized keys, a prefix trie over
+    names and their words, and trigrams for suggestions.
     """
-    cur_timestamp = time.time()
-    added_at = datetime.fromtimestamp(cur_timestamp).strftime("%Y-%m-%d %H:%M:%S")
-    
-    connection = sqlite3.connect(DB_PATH)
-    cursor = connection.cursor()
 
-    try:
+    def __init__(self, names, aliases=None):
+        self.names = set(names)
+        # Normalized name, word or alias -> the map names it stands for
+        self.keys = {}
+        self.trie = {}
+        self.trigrams = {}
+
+        for name in self.names:
+            words = [normalize_map_name(word) for word in re.split(r"[-\s]+", name)]
+            for key in {normalize_map_name(name), *words}:
+                self._add(key, name)
+
+        for alias, name in (aliases or {}).items():
+            if name in self.names:
+                self._add(normalize_map_name(alias), name)
+            else:
+                logger.warning("Ignoring alias %s for unknown map %s", alias, name)
+
+    def _add(self, key, name):
+        if not key:
+            return
+
+        self.keys.setdefault(key, set()).add(name)
+
+        node = self.trie
+        for char in key:
+            node = node.setdefault(char, {})
+            node.setdefault(None, set()).add(name)
+
+        for trigram in trigrams(key):
+            self.trigrams.setdefault(trigram, set()).add(key)
+
+    def match(self, name):
+        """
+        Returns the map name name refers to, or None if it is unknown or ambiguous.
+        """
+        if name in self.names:
+            return name
+
+        key = normalize_map_name(name)
+        names = self.keys.get(key)
+        if names is not None and len(names) == 1:
+            return next(iter(names))
+
+        if len(key) >= MIN_PREFIX:
+            node = self.trie
+            for char in key:
+                node = node.get(char)
+                if node is None:
+                    return None
+            if len(node[None]) == 1:
+                return next(iter(node[None]))
+
+        return None
+
+    def suggest(self, name):
+        """
+        Returns up to MAX_SUGGESTIONS map names close to name, closest first.
+        """
+        key = normalize_map_name(name)
+        limit = max(2, len(key) // 3)
+        distances = {}
+
+        for candidate in set().union(*(self.trigrams.get(trigram, ()) for trigram in trigrams(key))):
+            distance = edit_distance(key, candidate)
+            if distance <= limit:
+                for map_name in self.keys[candidate]:
+                    distances[map_name] = min(distance, distances.get(map_name, distance))
+
+        return sorted(distances, key=lambda map_name: (distances[map_name], map_name))[:MAX_SUGGESTIONS]
+
+    def complete(self, name, limit=25):
+        """
+        Returns up to limit map names that name starts, or one of their words or aliases starts.
+        Falls back to suggest() when nothing does.
+        """
+        key = normalize_map_name(name)
+        if not key:
+            return sorted(self.names)[:limit]
+
+        node = self.trie
+        for char in key:
+            node = node.get(char)
+            if node is None:
+                return self.suggest(name)
+
+        return sorted(node[None])[:limit]
+
+    def resolve(self, name):
+        """
+        Returns the map name name refers to, raising ValueError with suggestions if there is none.
+        """
+        map_name = self.match(name)
+        if map_name is not None:
+            return map_name
+
+        suggestions = self.suggest(name)
+        if suggestions:
+            raise ValueError(f"Unknown map '{name}' (did you mean {' or '.join(suggestions)}?)")
+        raise ValueError(f"Unknown map '{name}' (see mmaps)")
+
+
+def seed_map_ref(connection):
+    """
+    Adds any map in MapNameData missing from map_ref. Returns how many were added.
+    """
+    count = "SELECT COUNT(*) FROM map_ref"
+    before = connection.execute(count).fetchone()[0]
 
-        if stack is not None:
-            check_stack = validate_stack(stack)
-            if stack is not None and not check_stack:
-                raise ValueError("Invalid stack")
-        
-        cursor.execute("INSERT INTO owmaps (season, map_name, map_result, stack, timestamp, added_by) VALUES (?, ?, ?, ?, ?, ?)", (season, map_name, map_result, stack, added_at, ctx.author.name))
-        connection.commit()
-        await ctx.send(f"✅ Map '{map_name}' added successfully by {ctx.author.name} @ {added_at}")
+    with connection:
+        connection.executemany("INSERT INTO map_ref (map_name, map_type) VALUES (:map_name, :map_type) "
+                               "ON CONFLICT (map_name) DO NOTHING",
+                               [{"map_name": name, "map_type": type} for name, type in map_name_data.map_types.items()])
 
-    except ValueError as e:
-        await ctx.send(f"⚠️ ValueError: {e} (Invalid value)")
-    except sqlite3.IntegrityError as e:
-        await ctx.send(f"⚠️ Integrity Error: {e} (Invalid value or constraint failed)")
-    except sqlite3.OperationalError as e:
-        await ctx.send(f"⚠️ Operational Error: {e} (SQL syntax or connection issue)")
-    except sqlite3.DatabaseError as e:
-        await ctx.send(f"⚠️ Database Error: {e}")
-    except Exception as e:
-        await ctx.send(f"⚠️ Unexpected Error: {e}")
-    finally:
-        connection.close()
+    return connection.execute(count).fetchone()[0] - before
 
 
-@bot.command()
-async def bestmaptype(ctx, season):
+def migrate_map_ids(connection):
     """
+    Rebuilds an owmaps table that still stores map names as TEXT so it
+    stores map_ref ids instead, and regenerates map_stats to match.
+    Returns False if there is nothing to migrate.
     """
-   
-    query =  "SELECT " \
-    "mr.map_type, " \
-    "om.season, " \
-    "COUNT(*) AS total_games, " \
-    "SUM(CASE WHEN om.map_result = 'w' THEN 1 ELSE 0 END) AS total_wins, " \
-    "SUM(CASE WHEN om.map_result = 'l' THEN 1 ELSE 0 END) AS total_losses, " \
-    "SUM(CASE WHEN om.map_result = 'd' THEN 1 ELSE 0 END) AS total_draws, " \
-    "(CAST(SUM(CASE WHEN om.map_result = 'w' THEN 1 ELSE 0 END) AS FLOAT) / " \
-    "NULLIF(SUM(CASE WHEN om.map_result IN ('w', 'l', 'd') THEN 1 ELSE 0 END), 0) * 100) AS win_rate " \
-    "FROM owmaps om " \
-    "JOIN map_ref mr ON om.map_name = mr.map_name " \
-    f"WHERE om.season IN ('{season}') " \
-    "GROUP BY mr.map_type " \
-    "ORDER BY win_rate DESC"
-
-
-    connection = sqlite3.connect(DB_PATH)
-    cursor = connection.cursor()
-    
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(owmaps)")]
+    if "map_name" not in columns:
+        return False
+
+    seed_map_ref(connection)
+    indexes = [row[0] for row in connection.execute("SELECT name FROM sqlite_master "
+                                                    "WHERE type = 'index' AND tbl_name = 'owmaps' AND sql IS NOT NULL")]
+
+    # Keep game_players pointing at owmaps while the old table is renamed
+    connection.execute("PRAGMA legacy_alter_table = ON")
+
     try:
-        cursor.execute(query)
-        result = cursor.fetchall()
+        with connection:
+            connection.execute("BEGIN")
 
-        parsed_result = f"=== BEST MAP TYPES - {season} ===\n"
-        
-        for i in result:
-            type = i[0].strip()
-            winrate = round(i[6], 2)
-            record = f"{i[3]}W {i[4]}L {i[5]}D"
-            parsed_result += type + " - " + str(winrate)+"%" + " - " + record + "\n"
+            for name in indexes:
+                connection.execute(f'DROP INDEX "{name}"')
+            connection.execute("ALTER TABLE owmaps RENAME TO owmaps_old")
+            connection.execute("DROP TABLE IF EXISTS map_stats")
 
-        await ctx.send(parsed_result)
+            create_schema(connection)
 
-    except Exception as e:
-        await ctx.send(f"An error occurred: {e}")
+            connection.execute("INSERT INTO owmaps (id, season, map_id, map_result, stack, timestamp, added_by) "
+                               "SELECT o.id, o.season, mr.id, o.map_result, o.stack, o.timestamp, o.added_by "
+                               "FROM owmaps_old o LEFT JOIN map_ref mr ON mr.map_name = o.map_name")
+            connection.execute("DROP TABLE owmaps_old")
+            rebuild_map_stats(connection)
     finally:
-        connection.close()
+        connection.execute("PRAGMA legacy_alter_table = OFF")
 
+    return True
 
-@bot.command()
-async def lastwon(ctx, map_name: str):
+
+def migrate_epoch_timestamps(connection):
     """
-    Fetches the last time you won the specified map.
+    Converts owmaps timestamps stored as local time strings to integer
+    epoch seconds, and regenerates map_stats to match.
+    Returns the number of rows converted.
     """
-    cur_time = time.time()
-    curf_time = datetime.fromtimestamp(cur_time).strftime("%Y-%m-%d %H:%M:%S")
-    cur_time_obj = datetime.strptime(curf_time, "%Y-%m-%d %H:%M:%S")
+    # Text sorts after every integer, so this is one index lookup
+    if connection.execute("SELECT typeof(MAX(timestamp)) FROM owmaps").fetchone()[0] != "text":
+        return 0
 
-    query = f"SELECT MAX(timestamp), season FROM owmaps WHERE map_name = '{map_name}' AND map_result = 'w'"
-    connection = sqlite3.connect(DB_PATH)
-    cursor = connection.cursor()
+    with connection:
+        rows = connection.execute("UPDATE owmaps SET timestamp = CAST(strftime('%s', timestamp, 'utc') AS INTEGER) "
+                                  "WHERE typeof(timestamp) = 'text'").rowcount
+        rebuild_map_stats(connection)
 
-    try:
-        cursor.execute(query)
-        result = cursor.fetchone()
-        last_time = result[0]
-        last_season = result[1]
+    return rows
 
-        if last_time != None:
 
-            last_time_obj = datetime.strptime(last_time, "%Y-%m-%d %H:%M:%S")
-            elapsed_time = cur_time_obj - last_time_obj
-            days = elapsed_time.days
-            hours, remainder = divmod(elapsed_time.seconds, 3600)
-            minutes, seconds = divmod(remainder, 60)
-            await ctx.send(f"You last won {map_name} in {last_season} which was: {days} days, {hours} hours, {minutes} minutes, {seconds} seconds ago")
-        else:
-            await ctx.send(f"No recorded win in database")
+# Queries
+#
+# Every statement the commands run, by name. They all take named
+# parameters, so SQLite reuses one cached prepared statement per query
+# instead of re-parsing an f-string on every call, and they are all
+# prepared at startup so a broken query fails there and not mid-command.
+# They stick to SQL that SQLite and PostgreSQL both accept.
 
-    except Exception as e:
-        await ctx.send(f"An error occurred: {e}")
-    finally:
-        connection.close()
+QUERIES = {
+    # Writes
 
+    "insert_game": "INSERT INTO owmaps (id, season, map_id, map_result, stack, timestamp, added_by) "
+        "VALUES (:id, :season, :map_id, :map_result, :stack, :timestamp, :added_by)",
 
-@bot.command()
-async def personal_wr(ctx, name, season):
-    """
-    """
-    query = f"SELECT COUNT (*) FROM owmaps WHERE stack LIKE '%{name}%' AND map_result = 'w' AND season = '{season}'"
-    query2 = f"SELECT COUNT (*) FROM owmaps WHERE stack LIKE '%{name}%' AND season = '{season}'"
+    "upsert_player": "INSERT INTO roster (letter, name) VALUES (:letter, :player_name) "
+        "ON CONFLICT (letter) DO UPDATE SET name = excluded.name",
 
-    connection = sqlite3.connect(DB_PATH)
-    cursor = connection.cursor()
+    "delete_player": "DELETE FROM roster WHERE letter = :letter",
 
-    try:
-        cursor.execute(query)
-        won = cursor.fetchone()
-        cursor.execute(query2)
-        total = cursor.fetchone()
+    "upsert_config": "INSERT INTO guild_config (key, value) VALUES (:key, :value) "
+        "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
 
-        wrate = round((int(won[0]) / int(total[0]) * 100), 2)
-        await ctx.send(f"{wrate}% - {total[0]} maps played")
+    "upsert_snapshot": "INSERT INTO season_snapshots (season, payload, games, refreshed_at) "
+        "VALUES (:season, :payload, :games, :refreshed_at) "
+        "ON CONFLICT (season) DO UPDATE SET payload = excluded.payload, games = excluded.games, "
+        "refreshed_at = excluded.refreshed_at",
 
-    except Exception as e:
-        await ctx.send(f"An error occurred: {e}")
-    finally:
-        connection.close()
+    "clear_snapshots": "DELETE FROM season_snapshots",
 
+    "upsert_ingest_seq": "INSERT INTO ingest_state (name, seq) VALUES ('journal', :seq) "
+        "ON CONFLICT (name) DO UPDATE SET seq = excluded.seq",
 
-@bot.command()
-async def group_stats(ctx, season):
+    "insert_game_player": "INSERT INTO game_players (game_id, player) VALUES (:game_id, :player)",
 
+    "upsert_map_stats": "INSERT INTO map_stats (season, map_id, wins, losses, draws, last_played, last_won) "
+        "VALUES (:season, :map_id, :wins, :losses, :draws, :last_played, :last_won) "
+        "ON CONFLICT (season, map_id) DO UPDATE SET "
+        "wins = map_stats.wins + excluded.wins, "
+        "losses = map_stats.losses + excluded.losses, "
+        "draws = map_stats.draws + excluded.draws, "
+        "last_played = CASE WHEN map_stats.last_played IS NULL OR excluded.last_played > map_stats.last_played "
+        "THEN excluded.last_played ELSE map_stats.last_played END, "
+        "last_won = CASE WHEN map_stats.last_won IS NULL OR excluded.last_won > map_stats.last_won "
+        "THEN excluded.last_won ELSE map_stats.last_won END",
 
-    group_memebers = {"W":"Will", "L":"Liam", "D":"Dan", "E":"Ewan", "C":"Chelsea", "J":"Justin"}
-    res_string = "=== Season 16 Group Stats ===\n"
+    "upsert_player_stats": "INSERT INTO player_stats (season, player, wins, losses, draws) "
+        "VALUES (:season, :player, :wins, :losses, :draws) "
+        "ON CONFLICT (season, player) DO UPDATE SET "
+        "wins = player_stats.wins + excluded.wins, "
+        "losses = player_stats.losses + excluded.losses, "
+        "draws = player_stats.draws + excluded.draws",
 
-    gstats = []
+    # Reads
 
-    connection = sqlite3.connect(DB_PATH)
-    cursor = connection.cursor()
+    "winrate": "SELECT wins, wins + losses + draws FROM map_stats WHERE season = :season AND map_id = :map_id",
 
-    for name in group_memebers.keys():
+    "player_winrate": "SELECT wins, wins + losses + draws FROM player_stats WHERE season = :season AND player = :player",
 
-        query = "SELECT COUNT(*) AS total_games, " \
-        "(CAST(SUM(CASE WHEN map_result = 'w' THEN 1 ELSE 0 END) AS FLOAT) / " \
-        "NULLIF(SUM(CASE WHEN map_result IN ('w', 'l', 'd') THEN 1 ELSE 0 END), 0) * 100) AS win_rate " \
-        f"FROM owmaps WHERE stack LIKE '%{name}%' AND season = '{season}'"
+    "lastwon": "SELECT MAX(timestamp), season FROM owmaps WHERE map_id = :map_id AND map_result = 'w'",
 
-        cursor.execute(query)
-        stats = cursor.fetchall()
-        gstats.append({"name": name, "games": stats[0][0], "win-rate": stats[0][1]})
+    "lastplayed": "SELECT MAX(timestamp) FROM owmaps WHERE map_id = :map_id",
 
-    gstats.sort(key=lambda x: x["win-rate"])
-    
-    for i in range(len(gstats) - 1, -1, -1) :
-        res_string += f"{group_memebers[gstats[i]["name"]]} - {gstats[i]["games"]} Games Played - {round(gstats[i]["win-rate"], 2)}% win rate\n"
+    "last10": "SELECT map_id, map_result, timestamp FROM owmaps ORDER BY timestamp DESC, id DESC LIMIT 10",
 
-    await ctx.send(res_string)
+    "personal_wr": "SELECT COUNT(*), SUM(CASE WHEN om.map_result = 'w' THEN 1 ELSE 0 END) "
+        "FROM game_players gp JOIN owmaps om ON om.id = gp.game_id "
+        "WHERE gp.player = :player AND om.season = :season",
 
+    "group_stats": "SELECT gp.player, COUNT(*) AS total_games, "
+        "(CAST(SUM(CASE WHEN om.map_result = 'w' THEN 1 ELSE 0 END) AS FLOAT) / COUNT(*) * 100) AS win_rate "
+        "FROM game_players gp JOIN owmaps om ON om.id = gp.game_id "
+        "WHERE om.season = :season "
+        "GROUP BY gp.player "
+        "ORDER BY win_rate DESC, total_games DESC",
 
-@bot.command()
-async def winrate(ctx, season: str, map_name :str):
+    "bestmaptype": "SELECT map_id, wins, losses, draws FROM map_stats WHERE season = :season",
+
+    "seasonbestmaps": "SELECT map_id, wins + losses + draws AS total_results, losses AS total_losses, "
+        "wins AS total_wins, draws AS total_draws, "
+        "(CAST(wins AS FLOAT) / (wins + losses + draws) * 100) AS win_rate "
+        "FROM map_stats WHERE season = :season ORDER BY win_rate DESC, total_wins DESC",
+
+    "seasonworstmaps": "SELECT map_id, wins + losses + draws AS total_results, losses AS total_losses, "
+        "wins AS total_wins, draws AS total_draws, "
+        "(CAST(wins AS FLOAT) / (wins + losses + draws) * 100) AS win_rate "
+        "FROM map_stats WHERE season = :season ORDER BY win_rate ASC, total_losses DESC",
+
+    "bestmaps": "SELECT map_id, SUM(wins + losses + draws) AS total_results, SUM(losses) AS total_losses, "
+        "SUM(wins) AS total_wins, SUM(draws) AS total_draws, "
+        "(CAST(SUM(wins) AS FLOAT) / SUM(wins + losses + draws) * 100) AS win_rate "
+        "FROM map_stats GROUP BY map_id ORDER BY win_rate DESC, total_wins DESC",
+
+    "worstmaps": "SELECT map_id, SUM(wins + losses + draws) AS total_results, SUM(losses) AS total_losses, "
+        "SUM(wins) AS total_wins, SUM(draws) AS total_draws, "
+        "(CAST(SUM(wins) AS FLOAT) / SUM(wins + losses + draws) * 100) AS win_rate "
+        "FROM map_stats GROUP BY map_id ORDER BY win_rate ASC, total_losses DESC",
+
+    "mostplayed": "SELECT map_id, wins + losses + draws AS total FROM map_stats "
+        "WHERE season = :season ORDER BY total DESC",
+
+    "mostplayedall": "SELECT map_id, SUM(wins + losses + draws) AS total FROM map_stats "
+        "GROUP BY map_id ORDER BY total DESC",
+
+    "snapshot": "SELECT payload, games, refreshed_at FROM season_snapshots WHERE season = :season",
+
+    "season_games": "SELECT COUNT(*) FROM owmaps WHERE season = :season",
+
+    "ingest_seq": "SELECT seq FROM ingest_state WHERE name = 'journal'",
+
+    "digest_seq": "SELECT seq FROM ingest_state WHERE name = 'digest'",
+
+    "upsert_digest_seq": "INSERT INTO ingest_state (name, seq) VALUES ('digest', :seq) "
+        "ON CONFLICT (name) DO UPDATE SET seq = excluded.seq",
+
+    "last_game_id": "SELECT MAX(id) FROM owmaps",
+
+    "session_games": "SELECT id, season, map_id, map_result, stack, timestamp FROM owmaps "
+        "WHERE id > :after ORDER BY id",
+
+    "map_history": "SELECT season, timestamp, map_result FROM owmaps WHERE map_id = :map_id ORDER BY timestamp",
+}
+
+# Room for every registered statement plus the maintenance queries
+STATEMENT_CACHE_SIZE = 2 * len(QUERIES)
+
+
+def query_params(query):
     """
-    Fetches winrate for a given map
-    returns as a percentage
-    Arguments: 
-        map_name: the name of the map
+    Returns the names of the named parameters a query takes.
     """
+    return list(dict.fromkeys(re.findall(r":(\w+)", query)))
 
-    query = f"SELECT COUNT(*) FROM owmaps WHERE map_name = '{map_name}' AND map_result = 'w' AND season = '{season}'"
-    query2 = f"SELECT COUNT(*) FROM owmaps WHERE map_name = '{map_name}' AND season = '{season}'"
 
-    connection = sqlite3.connect(DB_PATH)
-    cursor = connection.cursor()
+def prepare_queries(connection):
+    """
+    Compiles every registered query, raising on the first one that is broken.
+    """
+    for name, query in QUERIES.items():
+        try:
+            connection.execute("EXPLAIN " + query, dict.fromkeys(query_params(query)))
+        except sqlite3.Error as e:
+            raise sqlite3.OperationalError(f"Query '{name}' failed to prepare: {e}") from e
+
+
+# Map Stats
+#
+# map_stats holds one row of running totals per (season, map) so the
+# leaderboard commands read O(maps) rows instead of scanning owmaps, and
+# player_stats one per (season, player) for the session digest. Both are
+# updated in the same transaction as every insert into owmaps.
+
+MAP_STATS_SCAN = "SELECT season, map_id, " \
+    "SUM(CASE WHEN map_result = 'w' THEN 1 ELSE 0 END), " \
+    "SUM(CASE WHEN map_result = 'l' THEN 1 ELSE 0 END), " \
+    "SUM(CASE WHEN map_result = 'd' THEN 1 ELSE 0 END), " \
+    "MAX(timestamp), " \
+    "MAX(CASE WHEN map_result = 'w' THEN timestamp END) " \
+    "FROM owmaps GROUP BY season, map_id"
+
+PLAYER_STATS_SCAN = "SELECT om.season, gp.player, " \
+    "SUM(CASE WHEN om.map_result = 'w' THEN 1 ELSE 0 END), " \
+    "SUM(CASE WHEN om.map_result = 'l' THEN 1 ELSE 0 END), " \
+    "SUM(CASE WHEN om.map_result = 'd' THEN 1 ELSE 0 END) " \
+    "FROM game_players gp JOIN owmaps om ON om.id = gp.game_id GROUP BY om.season, gp.player"
+
+
+def dialect(connection):
+    """
+    Returns the SQL dialect of a connection passed to a database function.
+    """
+    return getattr(connection, "dialect", "sqlite")
 
-    try:
-        cursor.execute(query)
-        won = cursor.fetchone()
-        cursor.execute(query2)
-        total = cursor.fetchone()
-        wrate = round((int(won[0]) / int(total[0]) * 100), 2)
-        await ctx.send(f"{wrate}% - {total[0]} maps played")
-    except Exception as e:
-        await ctx.send(f"An error occured: {e}")
-    finally:
-        connection.close()
 
-@bot.command()
-async def seasonbestmaps(ctx, season):
+def insert_games(connection, games):
     """
-    Provides information on the maps with the best recordss
+    Writes a batch of validated games (see validate_game) along with their
+    game_players rows and map_stats and player_stats deltas. Must run inside a transaction.
+    """
+    # Other bots can write to a database server, so hold owmaps while ids are assigned
+    if dialect(connection) == "postgresql":
+        connection.execute("LOCK TABLE owmaps IN SHARE ROW EXCLUSIVE MODE")
+
+    next_id = connection.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM owmaps").fetchone()[0]
+    players = []
+    deltas = {}
+    player_deltas = {}
+
+    for game_id, game in enumerate(games, start=next_id):
+        game["id"] = game_id
+        result = game["map_result"]
+        column = "wins" if result == 'w' else "losses" if result == 'l' else "draws"
+
+        for player in stack_players(game["stack"] or ""):
+            players.append({"game_id": game_id, "player": player})
+
+            key = (game["season"], player)
+            delta = player_deltas.get(key)
+            if delta is None:
+                delta = player_deltas[key] = {"season": key[0], "player": player, "wins": 0, "losses": 0, "draws": 0}
+            delta[column] += 1
+
+        key = (game["season"], game["map_id"])
+        delta = deltas.get(key)
+        if delta is None:
+            delta = deltas[key] = {"season": key[0], "map_id": key[1], "wins": 0, "losses": 0, "draws": 0,
+                                   "last_played": None, "last_won": None}
+
+        delta[column] += 1
+        delta["last_played"] = max(delta["last_played"] or game["timestamp"], game["timestamp"])
+        if result == 'w':
+            delta["last_won"] = max(delta["last_won"] or game["timestamp"], game["timestamp"])
+
+    connection.executemany(QUERIES["insert_game"], games)
+    connection.executemany(QUERIES["insert_game_player"], players)
+    connection.executemany(QUERIES["upsert_map_stats"], deltas.values())
+    connection.executemany(QUERIES["upsert_player_stats"], player_deltas.values())
+
+
+def stack_players(stack):
     """
-    query = "SELECT map_name, COUNT(*) AS total_results," \
-    "SUM(CASE WHEN map_result = 'l' THEN 1 ELSE 0 END) AS total_losses," \
-    "SUM(CASE WHEN map_result = 'w' THEN 1 ELSE 0 END) AS total_wins," \
-    "SUM(CASE WHEN map_result = 'd' THEN 1 ElSE 0 END) AS total_draws," \
-    "(CAST(SUM(CASE WHEN map_result = 'w' THEN 1 ELSE 0 END) AS FLOAT) / COUNT(*) * 100) AS win_rate" \
-    f" FROM owmaps WHERE season = '{season}' GROUP BY map_name ORDER BY win_rate DESC, total_wins DESC"
-    connection = sqlite3.connect(DB_PATH)
-    cursor = connection.cursor()
+    Returns the distinct players in a stack string, in the order they appear.
+    """
+    return list(dict.fromkeys(stack))
 
-    try:
-        cursor.execute(query)
-        result = cursor.fetchall()
 
-        parsed_result = f"=== BEST MAPS - {season} ===\n"
-        
-        for i in result:
-            name = i[0].strip()
-            winrate = round(i[5], 2)
-            record = f"{i[3]}W {i[2]}L {i[4]}D"
-            parsed_result += name + " - " + str(winrate)+"%" + " - " + record + "\n"
+def backfill_game_players(connection):
+    """
+    Populates game_players from the stack strings of games that have none yet.
+    Must run inside a transaction.
+    """
+    games = connection.execute("SELECT id, stack FROM owmaps WHERE stack IS NOT NULL "
+                               "AND id NOT IN (SELECT game_id FROM game_players)").fetchall()
+
+    rows = [{"game_id": game_id, "player": player} for game_id, stack in games for player in stack_players(stack)]
+    connection.executemany(QUERIES["insert_game_player"], rows)
+    return len(rows)
 
-        await ctx.send(parsed_result)
 
-    except Exception as e:
-        await ctx.send(f"An error occurred: {e}")
-    finally:
-        connection.close()
+def rebuild_map_stats(connection):
+    """
+    Regenerates map_stats from a full scan of owmaps. Must run inside a transaction.
+    """
+    connection.execute("DELETE FROM map_stats")
+    connection.execute("INSERT INTO map_stats (season, map_id, wins, losses, draws, last_played, last_won) " + MAP_STATS_SCAN)
+    return connection.execute("SELECT COUNT(*) FROM map_stats").fetchone()[0]
 
 
-@bot.command()
-async def seasonworstmaps(ctx, season):
+def rebuild_player_stats(connection):
     """
-    Provides information on the maps with the worst records
+    Regenerates player_stats from a full scan of game_players. Must run inside a transaction.
     """
-    query = "SELECT map_name, COUNT(*) AS total_results," \
-    "SUM(CASE WHEN result = 0 THEN 1 ELSE 0 END) AS total_losses," \
-    "SUM(CASE WHEN result = 1 THEN 1 ELSE 0 END) AS total_wins," \
-    "SUM(CASE WHEN result = 2 THEN 1 ElSE 0 END) AS total_draws," \
-    "(CAST(SUM(CASE WHEN result = 1 THEN 1 ELSE 0 END) AS FLOAT) / COUNT(*) * 100) AS win_rate" \
-    f"FROM owmaps WWHRE season = '{season}' GROUP BY map_name ORDER BY win_rate ASC, total_losses DESC"
-    connection = sqlite3.connect(DB_PATH)
-    cursor = connection.cursor()
+    connection.execute("DELETE FROM player_stats")
+    connection.execute("INSERT INTO player_stats (season, player, wins, losses, draws) " + PLAYER_STATS_SCAN)
+    return connection.execute("SELECT COUNT(*) FROM player_stats").fetchone()[0]
 
-    try:
-        cursor.execute(query)
-        result = cursor.fetchall()
 
-        parsed_result = f"=== WORST MAPS - {season} ===\n"
-        
-        for i in result:
-            name = i[0].strip()
-            winrate = round(i[5], 2)
-            record = f"{i[3]}W {i[2]}L {i[4]}D"
-            parsed_result += name + " - " + str(winrate)+"%" + " - " + record + "\n"
+def rebuild_stats(connection):
+    """
+    Regenerates map_stats and player_stats. Must run inside a transaction.
+    Returns the number of rows in each.
+    """
+    return rebuild_map_stats(connection), rebuild_player_stats(connection)
 
-        await ctx.send(parsed_result)
 
-    except Exception as e:
-        await ctx.send(f"An error occurred: {e}")
-    finally:
-        connection.close()
+def check_map_stats(connection):
+    """
+    Compares map_stats against a raw scan of owmaps.
+    Returns a list of (season, map_id, expected, stored) for every mismatch.
+    """
+    expected = {(row[0], row[1]): tuple(row[2:]) for row in connection.execute(MAP_STATS_SCAN)}
+    stored = {(row[0], row[1]): tuple(row[2:]) for row in
+              connection.execute("SELECT season, map_id, wins, losses, draws, last_played, last_won FROM map_stats")}
 
+    mismatches = []
+    for key in sorted(expected.keys() | stored.keys()):
+        if expected.get(key) != stored.get(key):
+            mismatches.append((key[0], key[1], expected.get(key), stored.get(key)))
 
-@bot.command()
-async def bestmaps(ctx):
+    return mismatches
+
+
+# Import / Export
+#
+# Match history is streamed in and out as CSV or JSONL with one game per
+# row. Imports are validated up front and written in batched transactions
+# that also update map_stats and game_players, so a large file costs one
+# executemany per table per batch instead of one commit per game.
+
+GAME_FIELDS = ["season", "map_name", "map_result", "stack", "timestamp", "added_by"]
+
+IMPORT_BATCH_SIZE = 10000
+MAX_REPORTED_REJECTS = 20
+
+SEASON_FORMAT = re.compile(r"s\d\d")
+
+EXPORT_SCAN = "SELECT season, map_id, map_result, stack, timestamp, added_by FROM owmaps ORDER BY id"
+
+
+def file_format(filename):
     """
-    Provides information on the maps with the best recordss
+    Picks csv or jsonl from a file name's extension.
+    """
+    if filename.lower().endswith((".jsonl", ".json")):
+        return "jsonl"
+    if filename.lower().endswith(".csv"):
+        return "csv"
+    raise ValueError(f"Unsupported file type '{filename}' (use .csv or .jsonl)")
+
+
+def read_games(stream, fmt):
+    """
+    Yields (line number, row dict) for every game in a CSV or JSONL stream.
     """
-    query = "SELECT map_name, COUNT(*) AS total_results," \
-    "SUM(CASE WHEN map_result = 'l' THEN 1 ELSE 0 END) AS total_losses," \
-    "SUM(CASE WHEN map_result = 'w' THEN 1 ELSE 0 END) AS total_wins," \
-    "SUM(CASE WHEN map_result = 'd' THEN 1 ElSE 0 END) AS total_draws," \
-    "(CAST(SUM(CASE WHEN map_result = 'w' THEN 1 ELSE 0 END) AS FLOAT) / COUNT(*) * 100) AS win_rate" \
-    f" FROM owmaps GROUP BY map_name ORDER BY win_rate DESC, total_wins DESC"
-    connection = sqlite3.connect(DB_PATH)
-    cursor = connection.cursor()
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_num, line in enumerate(stream, start=1):
+            if line.strip():
+                yield line_num, json.loads(line)
 
+
+def validate_game(row, added_by, catalog, roster):
+    """
+    Checks a game row against the map catalog, the roster and the owmaps
+    constraints. Returns the row as an insert parameter dict, or raises ValueError.
+    """
+    season = (row.get("season") or "").strip().lower()
+    map_name = (row.get("map_name") or "").strip().lower()
+    map_result = (row.get("map_result") or "").strip().lower()
+    stack = (row.get("stack") or "").strip().upper() or None
+    timestamp = (row.get("timestamp") or "").strip()
+
+    if not SEASON_FORMAT.fullmatch(season):
+        raise ValueError(f"invalid season '{season}'")
+    map_name = catalog.resolve(map_name)
+    map_id = catalog.ids[map_name]
+    if map_result not in ('w', 'l', 'd'):
+        raise ValueError(f"invalid result '{map_result}'")
+    if stack is not None and (len(stack) > 5 or not validate_stack(stack, roster)):
+        raise ValueError(f"invalid stack '{stack}'")
+
+    # Times without an offset are local, as the bot wrote them before epoch timestamps
     try:
-        cursor.execute(query)
-        result = cursor.fetchall()
+        timestamp = int(timestamp) if timestamp.isdigit() else int(datetime.fromisoformat(timestamp).timestamp())
+    except ValueError:
+        raise ValueError(f"invalid timestamp '{timestamp}'")
 
-        parsed_result = "=== BEST MAPS ===\n"
-        
-        for i in result:
-            name = i[0].strip()
-            winrate = round(i[5], 2)
-            record = f"{i[3]}W {i[2]}L {i[4]}D"
-            parsed_result += name + " - " + str(winrate)+"%" + " - " + record + "\n"
+    return {"season": season, "map_name": map_name, "map_id": map_id, "map_result": map_result, "stack": stack,
+            "timestamp": timestamp, "added_by": (row.get("added_by") or "").strip() or added_by}
 
-        await ctx.send(parsed_result)
 
-    except Exception as e:
-        await ctx.send(f"An error occurred: {e}")
+def import_games(connection, rows, added_by, defer_indexes=False):
+    """
+    Validates and imports (line number, row) pairs in batched transactions,
+    then marks them digested so they are not posted as a session.
+    Returns (games imported, rows rejected, sample of (line number, reason) rejections).
+
+    validate_game already enforces every owmaps CHECK constraint, so SQLite
+    is told to skip re-evaluating them for the duration of the import.
+    With defer_indexes the owmaps indexes are dropped and rebuilt once at
+    the end, which is much faster for large offline imports but leaves
+    concurrent readers without them until the import finishes. Both only
+    apply to SQLite.
+    """
+    sqlite = dialect(connection) == "sqlite"
+    catalog = MapCatalog.load(connection)
+    roster = load_roster(connection)
+    imported = 0
+    rejected = 0
+    rejects = []
+    batch = []
+
+    indexes = []
+    if defer_indexes and sqlite:
+        indexes = connection.execute("SELECT name, sql FROM sqlite_master "
+                                     "WHERE type = 'index' AND tbl_name = 'owmaps' AND sql IS NOT NULL").fetchall()
+        with connection:
+            for name, _ in indexes:
+                connection.execute(f'DROP INDEX "{name}"')
+
+    if sqlite:
+        connection.execute("PRAGMA ignore_check_constraints = ON")
+
+    try:
+        for line_num, row in rows:
+            try:
+                batch.append(validate_game(row, added_by, catalog, roster))
+            except (ValueError, AttributeError) as e:
+                rejected += 1
+                if len(rejects) < MAX_REPORTED_REJECTS:
+                    rejects.append((line_num, str(e)))
+                continue
+
+            if len(batch) == IMPORT_BATCH_SIZE:
+                with connection:
+                    insert_games(connection, batch)
+                imported += len(batch)
+                batch = []
+
+        if batch:
+            with connection:
+                insert_games(connection, batch)
+            imported += len(batch)
+
+        if imported:
+            with connection:
+                skip_digest(connection)
     finally:
-        connection.close()
+        if sqlite:
+            connection.execute("PRAGMA ignore_check_constraints = OFF")
 
+        with connection:
+            for _, sql in indexes:
+                connection.execute(sql)
 
-@bot.command()
-async def worstmaps(ctx):
+    return imported, rejected, rejects
+
+
+def export_games(connection, stream, fmt):
     """
-    Provides information on the maps with the worst records
+    Streams every game to a CSV or JSONL stream in insertion order.
+    Returns the number of games written.
     """
-    query = "SELECT map_name, COUNT(*) AS total_results," \
-    "SUM(CASE WHEN result = 0 THEN 1 ELSE 0 END) AS total_losses," \
-    "SUM(CASE WHEN result = 1 THEN 1 ELSE 0 END) AS total_wins," \
-    "SUM(CASE WHEN result = 2 THEN 1 ElSE 0 END) AS total_draws," \
-    "(CAST(SUM(CASE WHEN result = 1 THEN 1 ELSE 0 END) AS FLOAT) / COUNT(*) * 100) AS win_rate" \
-    " FROM maps GROUP BY map_name ORDER BY win_rate ASC, total_losses DESC"
-    connection = sqlite3.connect(DB_PATH)
-    cursor = connection.cursor()
+    catalog = MapCatalog.load(connection)
+    cursor = connection.execute(EXPORT_SCAN)
+    written = 0
 
-    try:
-        cursor.execute(query)
-        result = cursor.fetchall()
+    if fmt == "csv":
+        writer = csv.writer(stream)
+        writer.writerow(GAME_FIELDS)
 
-        parsed_result = "=== WORST MAPS ===\n"
-        
-        for i in result:
-            name = i[0].strip()
-            winrate = round(i[5], 2)
-            record = f"{i[3]}W {i[2]}L {i[4]}D"
-            parsed_result += name + " - " + str(winrate)+"%" + " - " + record + "\n"
+    while True:
+        rows = cursor.fetchmany(IMPORT_BATCH_SIZE)
+        if not rows:
+            break
 
-        await ctx.send(parsed_result)
+        rows = [(season, catalog.names[map_id], map_result, stack, format_timestamp(timestamp, offset=True), added_by)
+                for season, map_id, map_result, stack, timestamp, added_by in rows]
 
-    except Exception as e:
-        await ctx.send(f"An error occurred: {e}")
-    finally:
-        connection.close()
+        if fmt == "csv":
+            writer.writerows(rows)
+        else:
+            stream.writelines(json.dumps(dict(zip(GAME_FIELDS, row))) + "\n" for row in rows)
+        written += len(rows)
 
+    return written
 
-@bot.command()
-async def last10 (ctx): 
+
+# Query Plans
+#
+# The registered reads are explained with sample parameters so their
+# plans can be checked for full scans as the history grows.
+
+SAMPLE_PARAMS = {"season": "s16", "map_id": 1, "player": "W"}
+
+SCANNED_TABLES = ("owmaps", "om", "game_players", "gp")
+
+# A query that stops after its first rows, so walking an index in order reads only those rows
+ORDER_BY_LIMIT = re.compile(r"\bORDER BY\b.*\bLIMIT\b", re.IGNORECASE | re.DOTALL)
+
+
+def check_queries(connection):
     """
-    Last 10 Results
+    Runs every registered read query with SAMPLE_PARAMS.
+    Returns a list of (name, rows returned, seconds taken).
     """
-    query = f"SELECT map_name, map_result, timestamp FROM owmaps ORDER BY timestamp DESC LIMIT 10"
-    
-    connection = sqlite3.connect(DB_PATH)
-    cursor = connection.cursor()
-
-    try:
-        cursor.execute(query)
-        result = cursor.fetchall()
-        msg = ""
-        
-        for i in result:
-            
-            line = ""
-            if i[1] == 'l':
-                line += "❌ loss "
-            elif i[1] == 'w':
-                line += "✅ win "
-            elif i[1] == 'd':
-                line += "⛔ draw"
-
-            line += i[0].strip()
-            line += f" {i[2]}"
-            msg += f"{line}\n"
-
-        await ctx.send(msg)
+    results = []
 
-    except Exception as e:
-        await ctx.send(f"An error occurred: {e}")
+    for name, query in QUERIES.items():
+        if query.startswith("SELECT"):
+            start = time.perf_counter()
+            rows = connection.execute(query, {key: SAMPLE_PARAMS.get(key) for key in query_params(query)}).fetchall()
+            results.append((name, len(rows), time.perf_counter() - start))
 
-    finally:
-        connection.close()
+    return results
 
 
-@bot.command()
-async def mostplayed(ctx, season):
+def find_full_scans(connection):
     """
-    Shows most played maps
+    Runs EXPLAIN QUERY PLAN for every registered read query.
+    Returns a list of (name, plan detail) for each full scan of a history table.
+
+    A SCAN ... USING INDEX that walks an index in order is not counted when
+    the query has ORDER BY ... LIMIT. Scans of a covering index still read
+    every row, so they always count. SQLite only.
     """
-    query = f"SELECT map_name, COUNT(*) FROM owmaps WHERE season = '{season}' GROUP BY map_name ORDER BY COUNT(*) DESC"
-    connection = sqlite3.connect(DB_PATH)
-    cursor = connection.cursor()
+    if dialect(connection) != "sqlite":
+        raise RuntimeError("Query plans are only checked on SQLite")
 
-    try:
-        cursor.execute(query)
-        result = cursor.fetchall()
-        msg = f"=== Most Played Maps - {season}\n"
+    full_scans = []
 
-        for i in result:
-            msg += f"{i[0]}: {i[1]} times\n"
+    for name, query in QUERIES.items():
+        if not query.startswith("SELECT"):
+            continue
 
-        await ctx.send(msg)
-    except Exception as e:
-        await ctx.send(f"An error occurred: {e}")
-    finally:
-        connection.close()
+        params = {key: SAMPLE_PARAMS.get(key) for key in query_params(query)}
+        ordered = ORDER_BY_LIMIT.search(query) is not None
 
+        for row in connection.execute("EXPLAIN QUERY PLAN " + query, params):
+            detail = row[3]
+            words = detail.split()
 
-@bot.command()
-async def mostplayedall(ctx):
+            if words[0] != "SCAN" or words[1] not in SCANNED_TABLES:
+                continue
+            if ordered and words[2:4] == ["USING", "INDEX"]:
+                continue
+            full_scans.append((name, detail))
+
+    return full_scans
+
+
+# Analytics
+#
+# The last ANALYTICS_HISTORY results for every map, player and season are
+# kept in memory with their current streak, so the form, streak and trend
+# commands never touch owmaps. They are rebuilt with one ordered pass over
+# the history in the background when a guild's tenant opens, and updated by add as
+# games are inserted. add waits for that pass before inserting so no game
+# is counted twice.
+
+ANALYTICS_HISTORY = 100
+TREND_WINDOW = 20
+SPARKLINE = "▁▂▃▄▅▆▇█"
+
+ANALYTICS_SCAN = "SELECT season, map_id, map_result, stack FROM owmaps ORDER BY timestamp, id"
+
+
+class Analytics:
     """
-    Shows most played maps
+    Ring buffers of recent results and current streaks, keyed by scope.
+    A scope is ("all",), ("map", map_id), ("player", letter) or ("season", season).
+    """
+
+    def __init__(self, history=ANALYTICS_HISTORY):
+        self.history = history
+        self.results = {}
+        self.streaks = {}
+        self.loading = None
+
+    def start_loading(self, database):
+        """
+        Loads the buffers on a database reader in the background.
+        """
+        self.loading = asyncio.ensure_future(database.read(self.load))
+
+    async def ready(self):
+        """
+        Waits for a background load to finish.
+        """
+        if self.loading is not None:
+            await asyncio.shield(self.loading)
+
+    def load(self, connection):
+        """
+        Rebuilds every buffer from owmaps in play order. Returns the number of games read.
+        """
+        fresh = Analytics(self.history)
+        games = 0
+
+        for season, map_id, map_result, stack in connection.execute(ANALYTICS_SCAN):
+            fresh.record(season, map_id, map_result, stack)
+            games += 1
+
+        self.results, self.streaks = fresh.results, fresh.streaks
+        return games
+
+    def record(self, season, map_id, map_result, stack):
+        """
+        Adds one game to the buffers and streaks of every scope it belongs to.
+        """
+        scopes = [("all",), ("map", map_id), ("season", season)]
+        scopes += [("player", player) for player in stack_players(stack or "")]
+
+        for scope in scopes:
+            buffer = self.results.get(scope)
+            if buffer is None:
+                buffer = self.results[scope] = deque(maxlen=self.history)
+            buffer.append(map_result)
+
+            result, length = self.streaks.get(scope, (None, 0))
+            self.streaks[scope] = (map_result, length + 1 if result == map_result else 1)
+
+    def seasons(self):
+        """
+        Returns every season with a recorded game, newest first.
+        """
+        return sorted((scope[1] for scope in self.results if scope[0] == "season"), reverse=True)
+
+    def form(self, scope, games):
+        """
+        Returns (wins, losses, draws) over the last games results in scope.
+        """
+        recent = list(self.results.get(scope, ()))[-games:]
+        return tuple(recent.count(result) for result in "wld")
+
+    def trend(self, scope, window=TREND_WINDOW):
+        """
+        Returns the rolling win rate over each run of window consecutive results in scope.
+        """
+        wins = [result == "w" for result in self.results.get(scope, ())]
+        return [sum(wins[end - window:end]) / window * 100 for end in range(window, len(wins) + 1)]
+
+
+analytics = Analytics()
+
+
+# Season Snapshots
+#
+# The season leaderboards (best and worst maps, map types, group stats and
+# most played) are read from a snapshot of their rows in season_snapshots
+# instead of being recomputed by every command. A closed season's snapshot
+# is built once. Seasons that gain games are rebuilt in the background
+# every SNAPSHOT_INTERVAL seconds, or straight away after
+# SNAPSHOT_REFRESH_ADDS adds. A stored snapshot whose game count no longer
+# matches its season is rebuilt when first read, which covers games
+# imported from the command line.
+
+SNAPSHOT_QUERIES = ("seasonbestmaps", "seasonworstmaps", "bestmaptype", "group_stats", "mostplayed")
+SNAPSHOT_INTERVAL = 60
+SNAPSHOT_REFRESH_ADDS = 10
+
+
+def build_snapshot(connection, season):
+    """
+    Runs the leaderboard queries for season. Returns (rows by query, games).
+    Only reads, so it runs on a reader and just the stored result goes to the writer.
     """
-    query = f"SELECT map_name, COUNT(*) FROM owmaps GROUP BY map_name ORDER BY COUNT(*) DESC"
-    connection = sqlite3.connect(DB_PATH)
-    cursor = connection.cursor()
+    # One read transaction, so the game count matches the rows. A ServerConnection
+    # (SQLite ones through aiosqlite too) is already in one.
+    local = isinstance(connection, sqlite3.Connection)
+    if local:
+        connection.execute("BEGIN")
 
     try:
-        cursor.execute(query)
-        result = cursor.fetchall()
-        msg = f"=== Most Played Maps - All Time\n"
+        games = connection.execute(QUERIES["season_games"], {"season": season}).fetchone()[0]
+        rows = {name: [list(row) for row in connection.execute(QUERIES[name], {"season": season}).fetchall()]
+                for name in SNAPSHOT_QUERIES}
+    finally:
+        if local:
+            connection.rollback()
 
-        for i in result:
-            msg += f"{i[0]}: {i[1]} times\n"
+    return rows, games
 
-        await ctx.send(msg)
-    except Exception as e:
-        await ctx.send(f"An error occurred: {e}")
-    finally:
-        connection.close()
 
+def load_snapshot(connection, season):
+    """
+    Returns the stored (rows by query, games, refreshed_at) for season, or
+    None if there is none or the season has gained games since it was built.
+    """
+    stored = connection.execute(QUERIES["snapshot"], {"season": season}).fetchone()
+    if stored is None:
+        return None
 
-@bot.command()
-async def lastplayed(ctx, map_name):
+    payload, games, refreshed_at = stored
+    if games != connection.execute(QUERIES["season_games"], {"season": season}).fetchone()[0]:
+        return None
+
+    return json.loads(payload), games, refreshed_at
+
+
+class Snapshots:
     """
-    Shows the last time we got the map
+    One tenant's season snapshots, kept in memory once read, and how many
+    games each season has gained since its snapshot was built.
     """
-    cur_time = time.time()
-    curf_time = datetime.fromtimestamp(cur_time).strftime("%Y-%m-%d %H:%M:%S")
-    cur_time_obj = datetime.strptime(curf_time, "%Y-%m-%d %H:%M:%S")
 
-    query = f"SELECT MAX(timestamp) FROM owmaps WHERE map_name = '{map_name}'"
-    connection = sqlite3.connect(DB_PATH)
-    cursor = connection.cursor()
+    def __init__(self, db, cache, read=None):
+        self.db = db
+        self.cache = cache
+        # Runs the reads for loading and rebuilding, on db's readers unless given
+        self.read = read or db.read
+        self.seasons = {}
+        self.pending = Counter()
+        self.refreshes = 0
+        self._refreshing = {}
+
+    async def get(self, season):
+        """
+        Returns the latest snapshot for season, building it if there is none.
+        """
+        snapshot = self.seasons.get(season)
+
+        if snapshot is None:
+            snapshot = await self.read(load_snapshot, season)
+            if snapshot is None:
+                snapshot = await self.refresh(season)
+            else:
+                snapshot = self.seasons.setdefault(season, snapshot)
+
+        return snapshot
+
+    async def refresh(self, season):
+        """
+        Rebuilds the snapshot for season. Concurrent calls share one rebuild.
+        """
+        refreshing = self._refreshing.get(season)
+        if refreshing is None:
+            refreshing = self._refreshing[season] = asyncio.ensure_future(self._refresh(season))
+            refreshing.add_done_callback(lambda _: self._refreshing.pop(season, None))
+
+        return await asyncio.shield(refreshing)
+
+    async def _refresh(self, season):
+        added = self.pending[season]
+        rows, games = await self.read(build_snapshot, season)
+        refreshed_at = int(time.time())
+
+        await self.db.execute("upsert_snapshot", season=season, payload=json.dumps(rows), games=games,
+                              refreshed_at=refreshed_at)
+        snapshot = self.seasons[season] = (rows, games, refreshed_at)
+
+        self.pending[season] -= added
+        if self.pending[season] <= 0:
+            del self.pending[season]
+
+        self.refreshes += 1
+        self.cache.invalidate(season)
+        return snapshot
+
+    def schedule(self, season):
+        """
+        Rebuilds the snapshot for season in the background.
+        """
+        asyncio.ensure_future(self.refresh(season)).add_done_callback(self._log_failure)
+
+    @staticmethod
+    def _log_failure(task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Snapshot refresh failed", exc_info=task.exception())
+
+    def record(self, season):
+        """
+        Counts a game added to season, rebuilding its snapshot once
+        SNAPSHOT_REFRESH_ADDS have been added.
+        """
+        self.pending[season] += 1
+
+        if self.pending[season] >= SNAPSHOT_REFRESH_ADDS:
+            self.schedule(season)
+
+    async def refresh_pending(self):
+        """
+        Rebuilds the snapshot of every season that has gained games.
+        """
+        for season in list(self.pending):
+            await self.refresh(season)
+
+    async def invalidate(self):
+        """
+        Drops every snapshot, stored and in memory, so each is rebuilt when next read.
+        """
+        await self.db.execute("clear_snapshots")
+        self.seasons.clear()
+        self.pending.clear()
+
+
+# Reports
+#
+# Season reports cross-tabulate the whole history, so owmaps is read once
+# into integer NumPy columns and every table is a bincount over combined
+# codes rather than one query per cell. NumPy is optional and only
+# imported when a report is built.
+
+def report_scan(roster):
+    """
+    Returns the SELECT that reads owmaps as integer columns: season number,
+    map id, result code (0 win, 1 loss, 2 draw) and a bitmask of the players
+    in the stack, with one bit per roster entry in order.
+    """
+    bits = " + ".join(f"CASE WHEN stack LIKE '%{letter}%' THEN {1 << bit} ELSE 0 END"
+                      for bit, letter in enumerate(roster)) or "0"
+    return f"SELECT CAST(substr(season, 2) AS INTEGER), map_id, " \
+           f"CASE map_result WHEN 'w' THEN 0 WHEN 'l' THEN 1 ELSE 2 END, {bits} FROM owmaps"
+
+
+def load_game_arrays(connection, roster):
+    """
+    Loads owmaps into a (games, 4) int64 array of report_scan columns.
+    """
+    import numpy as np
+
+    cursor = connection.execute(report_scan(roster))
+    chunks = []
+
+    while True:
+        rows = cursor.fetchmany(IMPORT_BATCH_SIZE)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=np.int64))
 
+    return np.concatenate(chunks) if chunks else np.zeros((0, 4), dtype=np.int64)
+
+
+def format_rate(won, played):
+    return f"{round(won / played * 100)}% ({played})" if played else "-"
+
+
+def build_report(connection, season):
+    """
+    Builds the retrospective for season: map x player and stack size x result
+    for the season, and map type x season across every season.
+    """
     try:
-        cursor.execute(query)
-        last_time = cursor.fetchone()[0]
+        import numpy as np
+    except ImportError:
+        raise RuntimeError("Reports need NumPy (pip install numpy)") from None
 
-        if last_time != None:
+    if not SEASON_FORMAT.fullmatch(season):
+        raise ValueError(f"invalid season '{season}'")
 
-            last_time_obj = datetime.strptime(last_time, "%Y-%m-%d %H:%M:%S")
-            elapsed_time = cur_time_obj - last_time_obj
-            days = elapsed_time.days
-            hours, remainder = divmod(elapsed_time.seconds, 3600)
-            minutes, seconds = divmod(remainder, 60)
-            await ctx.send(f"Last played {map_name}: {days} days, {hours} hours, {minutes} minutes, {seconds} seconds ago")
-        else:
-            await ctx.send("Have not played this map.")
+    catalog = MapCatalog.load(connection)
+    roster = load_roster(connection)
+    season_nums, map_ids, results, masks = load_game_arrays(connection, roster).T
+    current = season_nums == int(season[1:])
 
-    except Exception as e:
-        await ctx.send(f"An error occurred: {e}")
-    finally:
-        connection.close()
+    if not current.any():
+        return f"No games recorded in {season}"
 
+    wins = results == 0
+    map_count = max(catalog.names) + 1
+    players = list(roster)
 
-@bot.command()
-async def maps(ctx):
+    # Map x player
+    msg = f"=== {season} Report ===\n\nMap win rate by player\n"
+
+    played = np.zeros((len(players), map_count), dtype=np.int64)
+    won = np.zeros((len(players), map_count), dtype=np.int64)
+    for bit, player in enumerate(players):
+        in_stack = current & (masks & (1 << bit) != 0)
+        played[bit] = np.bincount(map_ids[in_stack], minlength=map_count)
+        won[bit] = np.bincount(map_ids[in_stack & wins], minlength=map_count)
+
+    for map_id in np.flatnonzero(np.bincount(map_ids[current], minlength=map_count)):
+        cells = ", ".join(f"{player} {format_rate(won[bit, map_id], played[bit, map_id])}"
+                          for bit, player in enumerate(players) if played[bit, map_id])
+        msg += f"{catalog.names[map_id]}: {cells or 'no stacks recorded'}\n"
+
+    # Map type x season
+    msg += "\nMap type win rate by season\n"
+
+    type_names = sorted(set(catalog.types.values()))
+    type_codes = np.zeros(map_count, dtype=np.int64)
+    for map_id, map_type in catalog.types.items():
+        type_codes[map_id] = type_names.index(map_type)
+
+    seasons, season_codes = np.unique(season_nums, return_inverse=True)
+    keys = type_codes[map_ids] * len(seasons) + season_codes
+    played = np.bincount(keys, minlength=len(type_names) * len(seasons)).reshape(len(type_names), len(seasons))
+    won = np.bincount(keys[wins], minlength=len(type_names) * len(seasons)).reshape(len(type_names), len(seasons))
+
+    for code, map_type in enumerate(type_names):
+        cells = ", ".join(f"s{number:02d} {format_rate(won[code, index], played[code, index])}"
+                          for index, number in enumerate(seasons) if played[code, index])
+        if cells:
+            msg += f"{map_type}: {cells}\n"
+
+    # Stack size x result
+    msg += "\nResults by stack size\n"
+
+    sizes = sum((masks[current] >> bit) & 1 for bit in range(len(players)))
+    records = np.bincount(sizes * 3 + results[current], minlength=(len(players) + 1) * 3).reshape(-1, 3)
+
+    for size, (size_wins, size_losses, size_draws) in enumerate(records):
+        total = size_wins + size_losses + size_draws
+        if total:
+            label = "no stack" if size == 0 else f"{size} stack"
+            msg += f"{label}: {size_wins}W {size_losses}L {size_draws}D - {round(size_wins / total * 100, 2)}%\n"
+
+    return msg
+
+
+# Session Digests
+#
+# A session ends once no game has been added for SESSION_GAP_MINUTES. Its
+# digest (the record, and each map's and player's results with the change
+# in their season win rate) is then posted to CHANNEL_ID. The digest reads
+# only the games after the last digested owmaps id, which is kept in
+# ingest_state, and the map_stats and player_stats rows of the maps and
+# players in them, so its cost depends on the session and not on the
+# history before it. Imports move the digested id past what they add, as
+# an imported history is not a session.
+
+DIGEST_INTERVAL = 60
+
+
+async def undigested_games(tenant):
     """
-    Shows the possible maps to enter intot the database
+    Returns the games added since the last digest as session_games rows.
+    The first call starts digests from the current history rather than digest all of it.
     """
-    await ctx.send("Trackable Maps")
-    await ctx.send("\n".join(map_name_data.map_names))
+    row = await tenant.db.fetchone("digest_seq")
 
+    if row is None:
+        last_id = (await tenant.db.fetchone("last_game_id"))[0]
+        await tenant.db.execute("upsert_digest_seq", seq=last_id or 0)
+        return []
 
-@bot.command()
-async def cmds(ctx):
+    return await tenant.db.fetchall("session_games", after=row[0])
+
+
+def skip_digest(connection):
     """
-    Prints list of bots commands
+    Marks every game so far as digested. Must run inside a transaction.
     """
-    await ctx.send("=== Commands ===") 
-    await ctx.send("\n".join(bot_data.bot_commands))
+    last_id = connection.execute(QUERIES["last_game_id"]).fetchone()[0]
+    connection.execute(QUERIES["upsert_digest_seq"], {"seq": last_id or 0})
 
 
-@bot.command()
-@commands.is_owner()
-async def stop(ctx):
+def session_ended(games, now=None):
+    return bool(games) and games[-1][5] <= (now or time.time()) - SESSION_GAP_MINUTES * 60
+
+
+def format_record(record):
+    wins, losses, draws = record
+    return f"{wins}W {losses}L {draws}D - {format_rate(wins, sum(record))}"
+
+
+def build_digest(connection, games, names, roster):
     """
-    Powers off the bot
+    Returns the digest of a session's games, given as session_games rows.
     """
-    await ctx.send("Bot is shutting down")
-    await bot.close() # Close port to bot
+    total = [0, 0, 0]
+    maps = {}
+    players = {}
+
+    for _, season, map_id, map_result, stack, _ in games:
+        result = "wld".index(map_result)
+        total[result] += 1
+        maps.setdefault((season, map_id), [0, 0, 0])[result] += 1
+        for player in stack_players(stack or ""):
+            players.setdefault((season, player), [0, 0, 0])[result] += 1
+
+    msg = "=== Session Digest ===\n"
+    msg += f"{format_timestamp(games[0][5])} to {format_timestamp(games[-1][5])}: {format_record(total)}\n"
+
+    msg += "Maps\n"
+    for (season, map_id), record in sorted(maps.items(), key=lambda item: (-sum(item[1]), names[item[0][1]])):
+        wins, played = connection.execute(QUERIES["winrate"], {"season": season, "map_id": map_id}).fetchone()
+        before = format_rate(wins - record[0], played - sum(record))
+        msg += f"{names[map_id]} ({season}): {format_record(record)}, season {before} → {format_rate(wins, played)}\n"
+
+    msg += "Players\n"
+    for (season, player), record in sorted(players.items(), key=lambda item: (-sum(item[1]), item[0][1])):
+        wins, played = connection.execute(QUERIES["player_winrate"], {"season": season, "player": player}).fetchone()
+        before = format_rate(wins - record[0], played - sum(record))
+        msg += f"{roster.get(player, player)} ({season}): {format_record(record)}, " \
+               f"season {before} → {format_rate(wins, played)}\n"
+
+    return msg
+
+
+# Charts
+#
+# Charts are drawn with matplotlib in a pool of CHART_WORKERS processes,
+# so rendering never blocks the event loop, and no more than
+# CHART_WORKERS charts render at once. Rendered PNGs are cached by chart
+# and by the tenant's data version, so a repeated chart is free until
+# games are added. matplotlib is optional and only imported by the
+# worker processes.
+
+CHART_WORKERS = 2
+CHART_CACHE_SIZE = 64
+CHART_MAX_POINTS = 500
+
+
+def save_png(figure):
+    stream = io.BytesIO()
+    figure.savefig(stream, format="png", dpi=100)
+    return stream.getvalue()
+
+
+def draw_bar_chart(title, labels, values, xlabel):
+    """
+    Returns a horizontal bar chart of percentages as PNG bytes, first label at the top.
+    Runs in a chart worker process.
+    """
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(8, max(3, 0.3 * len(labels) + 1)), layout="tight")
+    axes = figure.subplots()
+    axes.barh(labels[::-1], values[::-1], color="tab:blue")
+    axes.set_title(title)
+    axes.set_xlabel(xlabel)
+    axes.set_xlim(0, 100)
+
+    return save_png(figure)
+
+
+def draw_line_chart(title, timestamps, values, ylabel):
+    """
+    Returns a line chart of percentages over time as PNG bytes.
+    Runs in a chart worker process.
+    """
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(8, 4), layout="tight")
+    axes = figure.subplots()
+    axes.plot([datetime.fromtimestamp(timestamp) for timestamp in timestamps], values, color="tab:blue")
+    axes.set_title(title)
+    axes.set_ylabel(ylabel)
+    axes.set_ylim(0, 100)
+    figure.autofmt_xdate()
+
+    return save_png(figure)
+
+
+def downsample(points, limit=CHART_MAX_POINTS):
+    """
+    Returns at most limit evenly spaced points, always keeping the last.
+    """
+    if len(points) <= limit:
+        return points
+
+    step = len(points) / limit
+    return [points[int(i * step)] for i in range(limit - 1)] + [points[-1]]
+
+
+class ChartRenderer:
+    """
+    Renders charts on a bounded process pool and caches the PNGs, LRU.
+    Concurrent requests for the same chart share one render.
+    """
+
+    def __init__(self, workers=CHART_WORKERS, max_entries=CHART_CACHE_SIZE):
+        self.workers = workers
+        self.max_entries = max_entries
+        self.hits = 0
+        self.renders = 0
+        self.render_seconds = 0.0
+        self._pool = None
+        self._slots = None
+        self._cache = OrderedDict()
+        self._rendering = {}
+
+    def cached(self, key):
+        """
+        Returns the cached PNG for key, or None.
+        """
+        png = self._cache.get(key)
+
+        if png is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+        return png
+
+    async def render(self, key, draw, *args):
+        """
+        Returns the PNG draw(*args) renders, from the cache if key has been
+        rendered before. key must change whenever the chart's data does.
+        """
+        png = self.cached(key)
+        if png is not None:
+            return png
+
+        rendering = self._rendering.get(key)
+        if rendering is None:
+            rendering = self._rendering[key] = asyncio.ensure_future(self._render(key, draw, args))
+            rendering.add_done_callback(lambda _: self._rendering.pop(key, None))
+
+        return await asyncio.shield(rendering)
+
+    async def _render(self, key, draw, args):
+        if importlib.util.find_spec("matplotlib") is None:
+            raise RuntimeError("Charts need matplotlib (pip install matplotlib)")
+
+        if self._pool is None:
+            # Forking a process with discord and database threads running is not safe
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            self._slots = asyncio.Semaphore(self.workers)
+
+        async with self._slots:
+            start = time.perf_counter()
+            png = await asyncio.get_running_loop().run_in_executor(self._pool, draw, *args)
+            self.render_seconds += time.perf_counter() - start
+
+        self.renders += 1
+        self._cache[key] = png
+
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+        return png
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+charts = ChartRenderer()
+
+
+# Database Setup
+#
+# PRAGMA user_version records how many of MIGRATIONS a database has had.
+# A normal start only reads it, so SQLAlchemy is imported and the schema
+# checked only when a database is new or behind SCHEMA_VERSION.
+
+def create_schema(connection):
+    """
+    Creates any table or index in the models that the database is missing.
+    """
+    from sqlalchemy.dialects import sqlite
+    from sqlalchemy.schema import CreateTable, CreateIndex
+    from models import Base
+
+    dialect = sqlite.dialect()
+
+    for table in Base.metadata.sorted_tables:
+        connection.execute(str(CreateTable(table, if_not_exists=True).compile(dialect=dialect)))
+        for index in table.indexes:
+            connection.execute(str(CreateIndex(index, if_not_exists=True).compile(dialect=dialect)))
+
+
+def migrate_unversioned(connection):
+    """
+    Brings a new database, or one from before schema versions, to version 1.
+    Every step checks for itself whether it is needed.
+    """
+    if migrate_map_ids(connection):
+        print("✅ owmaps migrated to integer map ids")
+
+    with connection:
+        create_schema(connection)
+
+    converted = migrate_epoch_timestamps(connection)
+    if converted:
+        print(f"✅ Converted {converted} timestamps to epoch seconds")
+
+    # Backfill map_stats for databases created before it existed
+    has_games, has_stats = connection.execute("SELECT EXISTS (SELECT 1 FROM owmaps), "
+                                              "EXISTS (SELECT 1 FROM map_stats)").fetchone()
+
+    if has_games and not has_stats:
+        with connection:
+            rows = rebuild_map_stats(connection)
+        print(f"✅ Map stats rebuilt ({rows} rows)")
+
+    # Migrate stack strings into game_players
+    has_stacks, has_players = connection.execute("SELECT EXISTS (SELECT 1 FROM owmaps WHERE stack IS NOT NULL), "
+                                                 "EXISTS (SELECT 1 FROM game_players)").fetchone()
+
+    if has_stacks and not has_players:
+        with connection:
+            rows = backfill_game_players(connection)
+        print(f"✅ Game players migrated ({rows} rows)")
+
+
+def seed_roster(connection):
+    """
+    Adds the GroupData players to the roster. Must run inside a transaction.
+    """
+    connection.executemany("INSERT INTO roster (letter, name) VALUES (:letter, :player_name) "
+                           "ON CONFLICT (letter) DO NOTHING",
+                           [{"letter": letter, "player_name": name} for letter, name in group_data.members.items()])
+
+
+def add_tenant_tables(connection):
+    """
+    Adds the roster and guild_config tables, starting the roster from GroupData.
+    """
+    with connection:
+        create_schema(connection)
+        seed_roster(connection)
+
+
+def add_season_snapshots(connection):
+    """
+    Adds the season_snapshots table.
+    """
+    with connection:
+        create_schema(connection)
+
+
+def add_ingest_state(connection):
+    """
+    Adds the ingest_state table.
+    """
+    with connection:
+        create_schema(connection)
+
+
+def add_player_stats(connection):
+    """
+    Adds the player_stats table, filled from the games already played.
+    """
+    with connection:
+        create_schema(connection)
+        rows = rebuild_player_stats(connection)
+
+    if rows:
+        print(f"✅ Player stats built ({rows} rows)")
+
+
+MIGRATIONS = [migrate_unversioned, add_tenant_tables, add_season_snapshots, add_ingest_state, add_player_stats]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(connection):
+    """
+    Runs every migration the database has not had yet. Returns how many ran.
+    """
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+
+    for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+        migration(connection)
+        connection.execute(f"PRAGMA user_version = {number}")
+        print(f"✅ Database migrated to schema version {number}")
+
+    return max(SCHEMA_VERSION - version, 0)
+
+
+def prepare_database(path):
+    """
+    Migrates and seeds the database at path and checks its queries.
+    Returns its (map catalog, roster, config).
+    """
+    connection = sqlite3.connect(path)
+
+    try:
+        migrated = migrate(connection)
+
+        added = seed_map_ref(connection)
+        if added:
+            print(f"✅ Map reference table populated! ({added} maps added)")
+
+        prepare_queries(connection)
+
+        # A changed schema can change query plans
+        if migrated:
+            for name, detail in find_full_scans(connection):
+                print(f"⚠️ Query plan for {name} does a full scan: {detail}")
+
+        return MapCatalog.load(connection), load_roster(connection), load_config(connection)
+    finally:
+        connection.close()
+
+
+# Metrics
+#
+# Every command is timed from before_invoke to after_invoke. The database
+# and reply() add their time to the invocation running in the current
+# context, so a command's latency splits into DB time and Discord send
+# time along with the queries it ran and the rows they returned. Neither
+# SQLite's Python bindings nor the database servers report how many rows a
+# query scanned, so a full scan shows up in its time, not its row count.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_INTERVAL = 15
+
+logger = logging.getLogger("map_bot")
+
+current_invocation = contextvars.ContextVar("current_invocation", default=None)
+
+
+class CommandMetrics:
+    """
+    Totals and a latency histogram for one command.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.db_seconds = 0.0
+        self.send_seconds = 0.0
+        self.queries = 0
+        self.rows_returned = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def percentile(self, fraction):
+        """
+        Returns the upper bound of the bucket holding the given fraction of calls.
+        """
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), self.buckets):
+            seen += count
+            if seen >= fraction * self.calls:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """
+    Per command metrics plus the number of slow queries.
+    """
+
+    def __init__(self):
+        self.commands = {}
+        self.slow_queries = 0
+        self.gateway_events = Counter()
+        self.gateway_started = time.monotonic()
+
+    def start(self):
+        current_invocation.set({"started": time.perf_counter(), "db": 0.0, "send": 0.0, "queries": 0,
+                                "rows_returned": 0, "failed": False})
+
+    def finish(self, name):
+        invocation = current_invocation.get()
+        if invocation is None:
+            return
+        current_invocation.set(None)
+
+        elapsed = time.perf_counter() - invocation["started"]
+        command = self.commands.setdefault(name, CommandMetrics())
+        command.calls += 1
+        command.errors += invocation["failed"]
+        command.seconds += elapsed
+        command.db_seconds += invocation["db"]
+        command.send_seconds += invocation["send"]
+        command.queries += invocation["queries"]
+        command.rows_returned += invocation["rows_returned"]
+
+        bucket = 0
+        while bucket < len(LATENCY_BUCKETS) and elapsed > LATENCY_BUCKETS[bucket]:
+            bucket += 1
+        command.buckets[bucket] += 1
+
+    def record_query(self, query, params, elapsed, rows_returned):
+        invocation = current_invocation.get()
+        if invocation is not None:
+            invocation["db"] += elapsed
+            invocation["queries"] += 1
+            invocation["rows_returned"] += rows_returned
+
+        if elapsed >= SLOW_QUERY_SECONDS:
+            self.slow_queries += 1
+            logger.warning("Slow query (%.0f ms): %s %s", elapsed * 1000, query, reprlib.repr(params))
+
+    def record_send(self, elapsed):
+        invocation = current_invocation.get()
+        if invocation is not None:
+            invocation["send"] += elapsed
+
+    def record_event(self, event_type):
+        self.gateway_events[event_type] += 1
+
+    def record_error(self, name=None):
+        """
+        Counts an error against the running invocation, or against name
+        when the command failed outside of one.
+        """
+        invocation = current_invocation.get()
+        if invocation is not None:
+            invocation["failed"] = True
+        elif name is not None:
+            self.commands.setdefault(name, CommandMetrics()).errors += 1
+
+    def prometheus(self):
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        lines = ["# TYPE mapbot_command_seconds histogram"]
+
+        for name, command in sorted(self.commands.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), command.buckets):
+                cumulative += count
+                lines.append(f'mapbot_command_seconds_bucket{{command="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'mapbot_command_seconds_sum{{command="{name}"}} {command.seconds}')
+            lines.append(f'mapbot_command_seconds_count{{command="{name}"}} {command.calls}')
+
+        for metric, attribute in (("db_seconds", "db_seconds"), ("send_seconds", "send_seconds"),
+                                  ("queries", "queries"), ("rows_returned", "rows_returned"),
+                                  ("errors", "errors")):
+            lines.append(f"# TYPE mapbot_command_{metric}_total counter")
+            lines.extend(f'mapbot_command_{metric}_total{{command="{name}"}} {getattr(command, attribute)}'
+                         for name, command in sorted(self.commands.items()))
+
+        lines.append("# TYPE mapbot_slow_queries_total counter")
+        lines.append(f"mapbot_slow_queries_total {self.slow_queries}")
+
+        lines.append("# TYPE mapbot_gateway_events_total counter")
+        lines.extend(f'mapbot_gateway_events_total{{type="{event_type}"}} {count}'
+                     for event_type, count in sorted(self.gateway_events.items()))
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """
+        Writes prometheus() to path, replacing the file in one step so a
+        collector never reads half of it.
+        """
+        with open(path + ".tmp", "w", encoding="utf-8") as stream:
+            stream.write(self.prometheus())
+        os.replace(path + ".tmp", path)
+
+
+metrics = Metrics()
+
+
+# Database Access
+
+class Database:
+    """
+    Shared async access to the SQLite database.
+
+    Reads run on a small pool of worker threads and writes on a single
+    writer thread, so queries never block the event loop. Each worker keeps
+    one long-lived WAL mode connection, opened the first time it is used.
+    """
+
+    def __init__(self, path, readers=4):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._read_pool = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-read")
+        self._write_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False,
+                                         cached_statements=STATEMENT_CACHE_SIZE)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+
+            with self._lock:
+                self._connections.append(connection)
+
+        return connection
+
+    def _fetchall(self, name, params):
+        return self._connection().execute(QUERIES[name], params).fetchall()
+
+    def _fetchone(self, name, params):
+        return self._connection().execute(QUERIES[name], params).fetchone()
+
+    def _execute(self, name, params):
+        connection = self._connection()
+
+        with connection:
+            return connection.execute(QUERIES[name], params).lastrowid
+
+    def _transaction(self, func, args):
+        connection = self._connection()
+
+        with connection:
+            return func(connection, *args)
+
+    def _call(self, func, args):
+        return func(self._connection(), *args)
+
+    @staticmethod
+    def _timed(func, args):
+        start = time.perf_counter()
+        result = func(*args)
+        return result, time.perf_counter() - start
+
+    async def _run(self, pool, func, args, query, params, count=None):
+        """
+        Runs func(*args) on pool and records its time, and the rows count(result)
+        says it returned, against query in the metrics.
+        """
+        loop = asyncio.get_running_loop()
+        result, elapsed = await loop.run_in_executor(pool, self._timed, func, args)
+        metrics.record_query(query, params, elapsed, count(result) if count else 0)
+        return result
+
+    async def fetchall(self, name, **params):
+        """
+        Runs the registered query called name and returns all rows.
+        """
+        return await self._run(self._read_pool, self._fetchall, (name, params), QUERIES[name], params, count=len)
+
+    async def fetchone(self, name, **params):
+        """
+        Runs the registered query called name and returns the first row.
+        """
+        return await self._run(self._read_pool, self._fetchone, (name, params), QUERIES[name], params,
+                               count=lambda row: int(row is not None))
+
+    async def execute(self, name, **params):
+        """
+        Runs the registered write called name and commits it, returning the last row id.
+        """
+        return await self._run(self._write_pool, self._execute, (name, params), QUERIES[name], params)
+
+    async def transaction(self, func, *args):
+        """
+        Runs func(connection, *args) on the writer thread inside one transaction.
+        """
+        return await self._run(self._write_pool, self._transaction, (func, args), func.__name__, args)
+
+    async def read(self, func, *args):
+        """
+        Runs func(connection, *args) on a reader thread.
+        """
+        return await self._run(self._read_pool, self._call, (func, args), func.__name__, args)
+
+    async def write(self, func, *args):
+        """
+        Runs func(connection, *args) on the writer thread, leaving transactions to func.
+        """
+        return await self._run(self._write_pool, self._call, (func, args), func.__name__, args)
+
+    def _close(self):
+        self._read_pool.shutdown(wait=True)
+        self._write_pool.shutdown(wait=True)
+
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+
+    async def close(self):
+        """
+        Waits for queued work, then closes every connection.
+        """
+        await asyncio.to_thread(self._close)
+
+
+# Read Replica
+#
+# The analytics reads (all time map records and most played, win rates,
+# reports, charts, and the season snapshots behind group stats, map types
+# and the season leaderboards) run on a copy of the tenant's SQLite
+# database rather than the database add writes to, so a long report never
+# shares its file, WAL or reader threads with the ingest writer. Snapshots
+# catch the copy up first, as their game counts must match the season's.
+# Only the snapshot itself is written to the database. The copy is made with the
+# SQLite online backup API on its own thread while the previous copy keeps
+# serving reads, then swapped in. A copy that is in use and behind the
+# database is remade every REPLICA_MAX_AGE / 2 seconds, and a read waits
+# for a new copy rather than use one more than REPLICA_MAX_AGE seconds old.
+# Responses read while the copy is behind are not cached. Database servers
+# have no copy; their own replication is the server's business.
+
+def copy_database(path, target):
+    """
+    Copies the database at path into target (a file or ":memory:") with
+    the backup API and returns a read-only connection to the copy.
+    """
+    source = sqlite3.connect(path, timeout=30)
+
+    try:
+        connection = sqlite3.connect(target, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+        source.backup(connection)
+    finally:
+        source.close()
+
+    connection.execute("PRAGMA query_only=1")
+    return connection
+
+
+class Replica(Database):
+    """
+    A read-only copy of a tenant's database, with the same read methods as
+    Database. Reads run on one thread. version returns the tenant's
+    current data version, which tells the copy when it is behind.
+    """
+
+    def __init__(self, path, version, max_age=REPLICA_MAX_AGE, on_disk=False):
+        super().__init__(path, readers=1)
+        self.version = version
+        self.max_age = max_age
+        self.on_disk = on_disk
+        # Data version and time.monotonic() when the current copy was started
+        self.data_version = None
+        self.copied_at = None
+        self.refreshes = 0
+        self.copy_seconds = 0.0
+        self._current = None
+        self._refreshing = None
+        self._copy_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-replica-copy")
+
+    def _connection(self):
+        return self._current
+
+    @property
+    def age(self):
+        return None if self.copied_at is None else time.monotonic() - self.copied_at
+
+    @property
+    def fresh(self):
+        return self._current is not None and self.data_version == self.version()
+
+    async def ready(self):
+        """
+        Makes the first copy, or a new one if this one is behind and too old to read.
+        """
+        if self._current is None or (not self.fresh and self.age > self.max_age):
+            await self.refresh()
+
+    async def _run(self, pool, func, args, query, params, count=None):
+        await self.ready()
+        return await super()._run(pool, func, args, query, params, count)
+
+    async def refresh(self):
+        """
+        Makes a new copy and swaps it in. Concurrent calls share one copy.
+        """
+        if self._refreshing is None:
+            self._refreshing = asyncio.ensure_future(self._refresh())
+            self._refreshing.add_done_callback(lambda _: setattr(self, "_refreshing", None))
+
+        await asyncio.shield(self._refreshing)
+
+    async def _refresh(self):
+        loop = asyncio.get_running_loop()
+        version, copied_at = self.version(), time.monotonic()
+        # Alternate between two files, so the one being read is never overwritten
+        target = f"{self.path}.replica{self.refreshes % 2}" if self.on_disk else ":memory:"
+
+        connection = await loop.run_in_executor(self._copy_pool, copy_database, self.path, target)
+        self.copy_seconds = time.monotonic() - copied_at
+
+        previous, self._current = self._current, connection
+        self.data_version, self.copied_at = version, copied_at
+        self.refreshes += 1
+
+        if previous is not None:
+            # After the reads already queued on it
+            await loop.run_in_executor(self._read_pool, previous.close)
+
+    async def refresh_stale(self):
+        """
+        Remakes a copy that has been read from and is behind the database.
+        """
+        if self._current is not None and not self.fresh:
+            await self.refresh()
+
+    def _close(self):
+        self._copy_pool.shutdown(wait=True)
+        super()._close()
+
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+
+        for generation in range(2 if self.on_disk else 0):
+            path = f"{self.path}.replica{generation}"
+            if os.path.exists(path):
+                os.remove(path)
+
+
+# Database Servers
+#
+# With a SQLAlchemy URL in DB the same interface runs on an async engine,
+# so the database can be a server that several bots and dashboards share.
+# SQLAlchemy is only imported when one is used.
+
+class ServerConnection:
+    """
+    The part of the sqlite3 connection API the database functions use, on a
+    synchronous SQLAlchemy connection: execute and executemany with named
+    parameters, and 'with connection:' committing (or rolling back) a transaction.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.dialect = connection.dialect.name
+
+    def execute(self, sql, params=None):
+        from sqlalchemy import text
+        return self.connection.execute(text(sql), params or {})
+
+    def executemany(self, sql, params):
+        from sqlalchemy import text
+
+        params = list(params)
+        if params:
+            self.connection.execute(text(sql), params)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.connection.commit()
+        else:
+            self.connection.rollback()
+
+
+class ServerDatabase:
+    """
+    Database's interface on a SQLAlchemy async engine. Registered queries
+    run unchanged with the same named parameters, and functions given to
+    read, write and transaction get a ServerConnection.
+    """
+
+    def __init__(self, url):
+        from sqlalchemy import text
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        self.path = url
+        self.engine = create_async_engine(url)
+        self._queries = {name: text(query) for name, query in QUERIES.items()}
+
+    async def _run(self, begin, run, query, params, count=None):
+        """
+        Runs run(connection) on a pooled connection, inside a transaction if
+        begin is set, and records it against query in the metrics.
+        """
+        start = time.perf_counter()
+
+        async with (self.engine.begin() if begin else self.engine.connect()) as connection:
+            result = await run(connection)
+
+        metrics.record_query(query, params, time.perf_counter() - start, count(result) if count else 0)
+        return result
+
+    def _sync(self, func, args):
+        return lambda connection: func(ServerConnection(connection), *args)
+
+    async def fetchall(self, name, **params):
+        async def run(connection):
+            return [tuple(row) for row in await connection.execute(self._queries[name], params)]
+
+        return await self._run(False, run, QUERIES[name], params, count=len)
+
+    async def fetchone(self, name, **params):
+        async def run(connection):
+            row = (await connection.execute(self._queries[name], params)).first()
+            return None if row is None else tuple(row)
+
+        return await self._run(False, run, QUERIES[name], params, count=lambda row: int(row is not None))
+
+    async def execute(self, name, **params):
+        """
+        Runs the registered write called name and commits it. Row ids are not returned.
+        """
+        async def run(connection):
+            await connection.execute(self._queries[name], params)
+
+        return await self._run(True, run, QUERIES[name], params)
+
+    async def transaction(self, func, *args):
+        return await self._run(True, lambda connection: connection.run_sync(self._sync(func, args)),
+                               func.__name__, args)
+
+    async def read(self, func, *args):
+        return await self._run(False, lambda connection: connection.run_sync(self._sync(func, args)),
+                               func.__name__, args)
+
+    async def write(self, func, *args):
+        return await self._run(False, lambda connection: connection.run_sync(self._sync(func, args)),
+                               func.__name__, args)
+
+    async def close(self):
+        await self.engine.dispose()
+
+
+def is_server_url(path):
+    return "://" in path
+
+
+def prepare_server_database(connection):
+    """
+    Creates any missing tables on a database server and seeds them, as
+    prepare_database does for SQLite files. Returns its (map catalog, roster, config).
+    """
+    from sqlalchemy import inspect
+    from models import Base
+
+    tables = inspect(connection.connection)
+    new = not tables.has_table("roster")
+    new_player_stats = not tables.has_table("player_stats")
+
+    with connection:
+        Base.metadata.create_all(connection.connection)
+        if new:
+            seed_roster(connection)
+        elif new_player_stats:
+            rebuild_player_stats(connection)
+
+    added = seed_map_ref(connection)
+    if added:
+        print(f"✅ Map reference table populated! ({added} maps added)")
+
+    return MapCatalog.load(connection), load_roster(connection), load_config(connection)
+
+
+async def run_offline(path, func, *args):
+    """
+    Prepares the database at path (a SQLite file or server URL) and runs
+    func(connection, *args) against it once, for the command line tools.
+    """
+    if is_server_url(path):
+        db = ServerDatabase(path)
+        try:
+            await db.write(prepare_server_database)
+            return await db.write(func, *args)
+        finally:
+            await db.close()
+
+    prepare_database(path)
+    connection = sqlite3.connect(path)
+    try:
+        return func(connection, *args)
+    finally:
+        connection.close()
+
+
+
+# Response Cache
+
+class ResponseCache:
+    """
+    LRU cache of rendered command responses with a time to live.
+
+    Each entry is scoped to the season and map its data came from (None
+    meaning it depends on all of them), so adding a game only evicts the
+    responses that game could change.
+    """
+
+    def __init__(self, max_entries=256, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value, generation, season=None, map_name=None):
+        """
+        Stores value unless the cache was invalidated since generation was read,
+        in which case value may already be stale.
+        """
+        if generation != self.generation:
+            return
+
+        self._entries[key] = (value, time.monotonic() + self.ttl, season, map_name)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, season=None, map_name=None):
+        """
+        Drops every entry that could depend on a game in season on map_name.
+        Leaving either as None matches all seasons or maps.
+        """
+        self.generation += 1
+
+        stale = [key for key, (_, _, entry_season, entry_map) in self._entries.items()
+                 if (season is None or entry_season in (None, season))
+                 and (map_name is None or entry_map in (None, map_name))]
+
+        for key in stale:
+            del self._entries[key]
+        self.invalidations += len(stale)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+
+
+# Ingest Queue
+#
+# add validates its games, appends them to the tenant's journal file and
+# replies once the journal is synced to disk. One writer task per tenant
+# then applies queued adds in order, up to INGEST_BATCH at a time, in a
+# transaction that also stores the last sequence number applied in
+# ingest_state. Adds that arrive together share one journal sync and one
+# commit. On startup, journal entries past the stored sequence number
+# are applied, so an acknowledged add is never lost or applied twice.
+# Database servers have no local journal, so there add replies once its
+# transaction commits. A batch that fails because the database is locked
+# is tried again, up to INGEST_RETRIES times. Any other failure is retried
+# one add at a time, and an add that still fails is moved to the journal's
+# .dead file (or fails its add, without a journal) so the adds behind it
+# are not held up. exclusive runs work, such as reloading analytics after
+# an import, between batches so it sees exactly the adds on_commit has.
+
+INGEST_BATCH = 256
+INGEST_RETRIES = 5
+INGEST_RETRY_SECONDS = 1.0
+
+
+def ingest_seq(connection):
+    row = connection.execute(QUERIES["ingest_seq"]).fetchone()
+    return row[0] if row else 0
+
+
+def transient(error):
+    """
+    Returns whether a failed ingest transaction may succeed if tried again.
+    """
+    return "database is locked" in str(error) or "database table is locked" in str(error)
+
+
+def apply_ingest(connection, entries):
+    """
+    Inserts the games of (sequence number, games) entries and stores the
+    last sequence number applied. Must run inside a transaction.
+    """
+    insert_games(connection, [game for _, games in entries for game in games])
+    connection.execute(QUERIES["upsert_ingest_seq"], {"seq": entries[-1][0]})
+
+
+class IngestQueue:
+    """
+    One tenant's queue of added games, with the journal and writer tasks
+    that make them durable and apply them.
+    """
+
+    def __init__(self, db, journal_path, ready, on_commit):
+        self.db = db
+        self.journal_path = journal_path
+        self.ready = ready
+        self.on_commit = on_commit
+        self.closed = False
+        # Last sequence number handed out, and last one applied to the database
+        self.seq = 0
+        self.committed = 0
+        self.syncs = 0
+        self.batches = 0
+        self.retries = 0
+        self.dead = 0
+        self._written = 0
+        self._journal = None
+        self._unsynced = []
+        self._queue = deque()
+        self._draining = False
+        self._wake_journal = asyncio.Event()
+        self._wake_writer = asyncio.Event()
+        self._progress = asyncio.Event()
+        # Held from a batch's commit until on_commit has seen its games
+        self._committing = asyncio.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="journal")
+        self._tasks = []
+
+    def _open_journal(self):
+        """
+        Opens the journal for appending and returns its (sequence number,
+        games) entries. A last line cut short by a crash was never
+        acknowledged, so it is dropped.
+        """
+        entries = []
+        valid = 0
+
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "rb") as stream:
+                for line in stream:
+                    if not line.endswith(b"\n"):
+                        break
+                    entry = json.loads(line)
+                    entries.append((entry["seq"], entry["games"]))
+                    valid += len(line)
+
+        self._journal = open(self.journal_path, "ab")
+        self._journal.truncate(valid)
+        return entries
+
+    def _journal_size(self):
+        # Not tell(): truncating does not move the position of a file opened for appending
+        return os.fstat(self._journal.fileno()).st_size
+
+    def _append(self, entries):
+        start = self._journal_size()
+        data = "".join(json.dumps({"seq": seq, "games": games}) + "\n" for seq, games, _ in entries)
+
+        try:
+            self._journal.write(data.encode("utf-8"))
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+        except Exception:
+            # Leave no partial line for later entries to follow
+            self._journal.truncate(start)
+            raise
+
+        self._written = entries[-1][0]
+
+    def _compact(self):
+        """
+        Empties the journal once everything written to it has been committed.
+        Runs on the journal thread, so no append can slip in between.
+        """
+        if self.committed >= self._written and self._journal_size():
+            self._journal.truncate(0)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+
+    def _bury(self, seq, games, error):
+        """
+        Appends an add that could not be applied to the dead letter file.
+        """
+        with open(self.journal_path + ".dead", "a", encoding="utf-8") as stream:
+            stream.write(json.dumps({"seq": seq, "games": games, "error": str(error)}) + "\n")
+
+    async def _run_journal(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def start(self):
+        """
+        Queues any journal entries a crash left unapplied, then starts the journal and writer tasks.
+        """
+        self.committed = await self.db.read(ingest_seq)
+        self.seq = self.committed
+
+        if self.journal_path is not None:
+            for seq, games in await self._run_journal(self._open_journal):
+                if seq > self.committed:
+                    self._queue.append((seq, games, None))
+                self.seq = self._written = max(self.seq, seq)
+
+            if self._queue:
+                print(f"✅ Replaying {len(self._queue)} journaled adds")
+            self._tasks.append(asyncio.create_task(self._sync_journal()))
+
+        self._tasks.append(asyncio.create_task(self._write()))
+        self._wake_writer.set()
+
+    async def add(self, games):
+        """
+        Queues games for the writer. Returns once they are durable: synced
+        to the journal, or committed when there is no journal.
+        """
+        if self.closed:
+            raise RuntimeError("This server's database is closing, try again")
+
+        self.seq += 1
+        future = asyncio.get_running_loop().create_future()
+
+        if self.journal_path is None:
+            self._queue.append((self.seq, games, future))
+            self._wake_writer.set()
+        else:
+            self._unsynced.append((self.seq, games, future))
+            self._wake_journal.set()
+
+        await future
+
+    async def _sync_journal(self):
+        while True:
+            await self._wake_journal.wait()
+            self._wake_journal.clear()
+
+            entries, self._unsynced = self._unsynced, []
+            if not entries:
+                if self.closed:
+                    return
+                continue
+
+            try:
+                await self._run_journal(self._append, entries)
+            except Exception as e:
+                for _, _, future in entries:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.syncs += 1
+            for seq, games, future in entries:
+                self._queue.append((seq, games, None))
+                if not future.done():
+                    future.set_result(None)
+            self._wake_writer.set()
+
+            if self.closed:
+                self._wake_journal.set()
+
+    async def _apply(self, entries):
+        """
+        Commits a batch of entries and passes their games to on_commit.
+        Returns the exception if the transaction fails.
+        """
+        async with self._committing:
+            try:
+                await self.db.transaction(apply_ingest, [(seq, games) for seq, games, _ in entries])
+            except Exception as error:
+                return error
+
+            self.committed = entries[-1][0]
+            self.batches += 1
+            for _, games, future in entries:
+                self.on_commit(games)
+                if future is not None and not future.done():
+                    future.set_result(None)
+            self._progress.set()
+
+    async def exclusive(self, func, *args):
+        """
+        Runs func(connection, *args) on the database's writer once analytics
+        have loaded, between batches, so it sees exactly the adds on_commit has.
+        """
+        await self.ready()
+        async with self._committing:
+            return await self.db.write(func, *args)
+
+    async def _write(self):
+        # Analytics must finish loading before any game it has not read is committed
+        try:
+            await self.ready()
+        except Exception:
+            logger.exception("Analytics failed to load, committing adds anyway")
+
+        # Retries of the batch at the head of the queue, and adds left to apply one at a time
+        attempts = 0
+        singles = 0
+
+        while True:
+            await self._wake_writer.wait()
+            self._wake_writer.clear()
+
+            while self._queue:
+                size = 1 if singles else min(INGEST_BATCH, len(self._queue))
+                entries = [self._queue.popleft() for _ in range(size)]
+
+                error = await self._apply(entries)
+                if error is None:
+                    attempts = 0
+                    singles = max(singles - 1, 0)
+                    continue
+
+                logger.error("Ingest of %d adds failed", len(entries), exc_info=error)
+
+                if transient(error) and attempts < INGEST_RETRIES:
+                    self._queue.extendleft(reversed(entries))
+                    attempts += 1
+                    self.retries += 1
+                    await asyncio.sleep(INGEST_RETRY_SECONDS)
+                    continue
+
+                attempts = 0
+                if len(entries) > 1:
+                    # One bad add fails its whole batch, so find it by applying them one at a time
+                    self._queue.extendleft(reversed(entries))
+                    singles = len(entries)
+                    continue
+
+                seq, games, future = entries[0]
+                if self.journal_path is None:
+                    if not future.done():
+                        future.set_exception(error)
+                else:
+                    await self._run_journal(self._bury, seq, games, error)
+                    logger.error("Moved add %d to %s.dead", seq, self.journal_path)
+                self.dead += 1
+                singles = max(singles - 1, 0)
+                self.committed = seq
+                self._progress.set()
+
+            if self.journal_path is not None and not self._unsynced:
+                await self._run_journal(self._compact)
+
+            if self._draining:
+                return
+
+    async def flush(self):
+        """
+        Waits until every add queued so far is committed.
+        """
+        target = self.seq
+        while self.committed < target and self._tasks:
+            self._progress.clear()
+            await self._progress.wait()
+
+    def __len__(self):
+        return len(self._unsynced) + len(self._queue)
+
+    async def close(self):
+        """
+        Stops taking adds and waits for every queued add to be committed.
+        """
+        self.closed = True
+
+        if self.journal_path is not None and self._tasks:
+            self._wake_journal.set()
+            await self._tasks[0]
+
+        self._draining = True
+        self._wake_writer.set()
+        await asyncio.gather(*self._tasks)
+
+        if self._journal is not None:
+            await self._run_journal(self._journal.close)
+        self._executor.shutdown(wait=False)
+
+
+# Tenants
+#
+# Everything the commands use for one guild lives in a Tenant. With a DB
+# path containing {guild} each guild gets its own database file, so one
+# guild's queries cost the same however many guilds share the process.
+# Tenants open on a guild's first command, and only the MAX_OPEN_TENANTS
+# most recently used stay open.
+
+CONFIG_KEYS = {"default_season": SEASON_FORMAT}
+
+
+def tenant_path(key):
+    """
+    Returns the database path for the tenant key (a guild id, or None
+    when every guild shares one database).
+    """
+    if "{guild}" not in DB_PATH:
+        return DB_PATH
+    if key is None:
+        raise ValueError("This bot keeps a database per server, use this command in a server")
+    return DB_PATH.format(guild=key)
+
+
+def load_roster(connection):
+    return dict(connection.execute("SELECT letter, name FROM roster ORDER BY letter").fetchall())
+
+
+def load_config(connection):
+    return dict(connection.execute("SELECT key, value FROM guild_config").fetchall())
+
+
+class Tenant:
+    """
+    One guild's database, map catalog, roster, config, analytics, season
+    snapshots, response cache and ingest queue.
+    """
+
+    def __init__(self, key, db, catalog, roster, config, journal_path=None):
+        self.key = key
+        self.db = db
+        self.catalog = catalog
+        self.roster = roster
+        self.config = config
+        self.analytics = Analytics()
+        self.cache = ResponseCache()
+        self.snapshots = Snapshots(db, self.cache, self.read_current)
+        self.ingest = IngestQueue(db, journal_path, self.analytics.ready, self.ingested)
+        # Bumped whenever games change, so anything cached by it is stale
+        self.data_version = 0
+        # Where analytics read from, when not db
+        self.replica = None
+        self.active = 0
+        self.closed = False
+
+    @property
+    def default_season(self):
+        return self.config.get("default_season", bot_data.default_season)
+
+    @property
+    def reader(self):
+        return self.replica or self.db
+
+    async def read_version(self):
+        """
+        Returns the data version analytics reads see.
+        """
+        if self.replica is None:
+            return self.data_version
+
+        await self.replica.ready()
+        return self.replica.data_version
+
+    async def read_current(self, func, *args):
+        """
+        Runs func(connection, *args) on the reader once it has every committed game.
+        """
+        if self.replica is not None and not self.replica.fresh:
+            await self.replica.refresh()
+
+        return await self.reader.read(func, *args)
+
+    async def reads_current(self):
+        """
+        Returns whether analytics reads see every committed game.
+        """
+        return await self.read_version() == self.data_version
+
+    def ingested(self, games):
+        """
+        Brings the cache, analytics and snapshots up to date with committed games.
+        """
+        self.data_version += 1
+
+        for game in games:
+            self.cache.invalidate(game["season"], game["map_name"])
+            self.analytics.record(game["season"], game["map_id"], game["map_result"], game["stack"])
+            self.snapshots.record(game["season"])
+
+    async def start(self):
+        self.analytics.start_loading(self.db)
+        await self.ingest.start()
+
+    async def close(self):
+        self.closed = True
+        await self.ingest.close()
+        if self.replica is not None:
+            await self.replica.close()
+        await self.db.close()
+
+
+def open_tenant(key, path, replica=True):
+    """
+    Prepares the tenant's SQLite database and opens it, with a replica for
+    analytics unless replica is False or REPLICA_MAX_AGE is 0. Blocks, so
+    run it off the event loop.
+    """
+    catalog, roster, config = prepare_database(path)
+    tenant = Tenant(key, Database(path), catalog, roster, config, path + ".journal")
+
+    if replica and REPLICA_MAX_AGE:
+        tenant.replica = Replica(path, lambda: tenant.data_version, REPLICA_MAX_AGE, REPLICA_ON_DISK)
+
+    return tenant
+
+
+async def open_server_tenant(key, url):
+    db = ServerDatabase(url)
+    catalog, roster, config = await db.write(prepare_server_database)
+    return Tenant(key, db, catalog, roster, config)
+
+
+class Tenants:
+    """
+    Open tenants by key, least recently used first.
+
+    Commands hold a tenant between acquire() and release(). A tenant pushed
+    out of the pool is closed once no command is using it. Only one tenant
+    per key is ever open, since its ingest queue owns the journal: a key
+    whose old tenant is still in use gets it back, and one whose old
+    tenant is closing waits for it to finish.
+    """
+
+    def __init__(self, max_open=32):
+        self.max_open = max_open
+        self._open = OrderedDict()
+        self._opening = {}
+        # Tenants pushed out of the pool by key, until their close() finishes
+        self._retired = {}
+        self._closing = {}
+
+    def key(self, guild_id):
+        return guild_id if "{guild}" in DB_PATH else None
+
+    async def get(self, guild_id):
+        """
+        Returns the open tenant for guild_id, opening it if needed.
+        """
+        key = self.key(guild_id)
+        tenant = self._open.get(key)
+
+        if tenant is not None:
+            self._open.move_to_end(key)
+            return tenant
+
+        opening = self._opening.get(key)
+        if opening is None:
+            opening = self._opening[key] = asyncio.ensure_future(self._open_tenant(key))
+            opening.add_done_callback(lambda _: self._opening.pop(key, None))
+
+        return await asyncio.shield(opening)
+
+    async def _open_tenant(self, key):
+        retired = self._retired.pop(key, None)
+
+        if retired is not None and not retired.closed:
+            tenant = retired
+        else:
+            if key in self._closing:
+                await asyncio.shield(self._closing[key])
+
+            path = tenant_path(key)
+            if is_server_url(path):
+                tenant = await open_server_tenant(key, path)
+            else:
+                tenant = await asyncio.to_thread(open_tenant, key, path)
+            await tenant.start()
+
+        self._open[key] = tenant
+
+        while len(self._open) > self.max_open:
+            _, oldest = self._open.popitem(last=False)
+            self._retired[oldest.key] = oldest
+            if not oldest.active:
+                self._close(oldest)
+
+        return tenant
+
+    def _close(self, tenant):
+        tenant.closed = True
+        self._retired.pop(tenant.key, None)
+
+        closing = self._closing[tenant.key] = asyncio.ensure_future(tenant.close())
+        closing.add_done_callback(lambda _: self._closing.pop(tenant.key, None)
+                                  if self._closing.get(tenant.key) is closing else None)
+
+    async def acquire(self, guild_id):
+        """
+        Returns the tenant for guild_id, kept open until release().
+        """
+        while True:
+            tenant = await self.get(guild_id)
+            if not tenant.closed:
+                self.hold(tenant)
+                return tenant
+
+    def release(self, tenant):
+        tenant.active -= 1
+
+        if not tenant.active and self._open.get(tenant.key) is not tenant and not tenant.closed:
+            self._close(tenant)
+
+    def peek(self, guild_id):
+        """
+        Returns the open tenant for guild_id, or None without opening it.
+        """
+        return self._open.get(self.key(guild_id))
+
+    def values(self):
+        """
+        Returns the open tenants. Hold one with hold() while using it.
+        """
+        return list(self._open.values())
+
+    def hold(self, tenant):
+        tenant.active += 1
+
+    async def close(self):
+        tenants = list(self._open.values()) + list(self._retired.values())
+        self._open.clear()
+        self._retired.clear()
+
+        for tenant in tenants:
+            await tenant.close()
+        await asyncio.gather(*self._closing.values())
+
+
+tenants = Tenants()
+
+# Outbound Messages
+
+MESSAGE_LIMIT = 2000
+
+
+class MessageSender:
+    """
+    Sends messages through a queue per channel, paced to stay inside
+    Discord's per channel rate limit so bursts of commands wait their turn
+    locally instead of being answered with 429s.
+
+    Text-only messages queued back to back for the same destination are
+    merged into one message whenever they fit.
+    """
+
+    def __init__(self, per_channel=5, per_seconds=5.0):
+        self.per_channel = per_channel
+        self.per_seconds = per_seconds
+        self.sent = 0
+        self.coalesced = 0
+        self.queue_time = 0.0
+        self._queues = {}
+        self._send_times = {}
+        # The event loop only keeps weak references to tasks
+        self._tasks = set()
+
+    def enqueue(self, target, content=None, **kwargs):
+        """
+        Queues content for target (a context or channel).
+        Returns a future resolved with the sent message.
+        """
+        channel_id = getattr(getattr(target, "channel", target), "id", id(target))
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(channel_id)
+
+        if queue is None:
+            queue = self._queues[channel_id] = deque()
+            task = asyncio.create_task(self._drain(channel_id, queue))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        queue.append((target, content, kwargs, future, time.monotonic()))
+        return future
+
+    async def _wait_for_slot(self, send_times):
+        if len(send_times) == self.per_channel:
+            wait = self.per_seconds - (time.monotonic() - send_times[0])
+            if wait > 0:
+                await asyncio.sleep(wait)
+            send_times.popleft()
+
+        send_times.append(time.monotonic())
+
+    async def _drain(self, channel_id, queue):
+        send_times = self._send_times.setdefault(channel_id, deque())
+        futures = []
+
+        try:
+            while queue:
+                target, content, kwargs, future, queued_at = queue.popleft()
+                futures = [future]
+                queued = [queued_at]
+
+                while (queue and content is not None and not kwargs and queue[0][0] is target
+                       and queue[0][1] is not None and not queue[0][2]
+                       and len(content) + 1 + len(queue[0][1]) <= MESSAGE_LIMIT):
+                    _, next_content, _, next_future, next_queued_at = queue.popleft()
+                    content += "\n" + next_content
+                    futures.append(next_future)
+                    queued.append(next_queued_at)
+                    self.coalesced += 1
+
+                await self._wait_for_slot(send_times)
+                now = time.monotonic()
+                self.queue_time += sum(now - queued_at for queued_at in queued)
+
+                try:
+                    message = await target.send(content, **kwargs)
+                    self.sent += 1
+                    for future in futures:
+                        if not future.done():
+                            future.set_result(message)
+                except Exception as e:
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(e)
+        finally:
+            # Cancelled by close(), so nothing still queued will be sent
+            for future in futures + [item[3] for item in queue]:
+                if not future.done():
+                    future.cancel()
+            del self._queues[channel_id]
+
+    async def close(self):
+        """
+        Cancels every message still queued and waits for the channels' drain tasks to stop.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+sender = MessageSender()
+
+# Helper Functions
+
+def validate_stack(stack, roster):
+    return all(char in roster for char in stack)
+
+
+def parse_add(entry, default_season):
+    """
+    Parses the text of an add command into (games, season, stack).
+
+    Accepts one or more comma separated 'map_name result' pairs followed by
+    optional --season and --stack flags, e.g.
+    'ilios w, busan l, kings row w --season s16 --stack WLD', as well as the
+    original positional form 'map_name result [season] [stack]'.
+    """
+    tokens = entry.replace(",", " , ").split()
+    season = None
+    stack = None
+    words = []
+
+    while tokens:
+        token = tokens.pop(0)
+
+        if token in ("--season", "--stack"):
+            if not tokens or tokens[0] == ",":
+                raise ValueError(f"{token} needs a value")
+            if token == "--season":
+                season = tokens.pop(0)
+            else:
+                stack = tokens.pop(0)
+        else:
+            words.append(token)
+
+    if "," not in words and len(words) in (3, 4) and SEASON_FORMAT.fullmatch(words[2].lower()):
+        season = season or words[2]
+        stack = stack or (words[3] if len(words) == 4 else None)
+        words = words[:2]
+
+    games = []
+    for game in " ".join(words).split(","):
+        parts = game.split()
+        if len(parts) < 2:
+            raise ValueError(f"Expected 'map_name result' but got '{game.strip()}'")
+        games.append((" ".join(parts[:-1]), parts[-1]))
+
+    return games, season or default_season, stack
+
+
+def split_message(text, limit=MESSAGE_LIMIT):
+    """
+    Splits text into as few messages of at most limit characters as it can,
+    breaking at line boundaries unless a single line is too long.
+    """
+    chunks = []
+    current = ""
+
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+
+        candidate = line if not current else current + "\n" + line
+        if len(candidate) > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = candidate
+
+    if current.strip():
+        chunks.append(current)
+
+    return chunks
+
+
+async def reply(target, content=None, **kwargs):
+    """
+    Sends content to a context or channel through the rate limited sender,
+    split at line boundaries to fit Discord's message length limit.
+    Any attachments go with the last message.
+
+    Slash command replies answer the interaction directly instead. They
+    go to its webhook, not the channel, and it expires if they wait.
+    """
+    chunks = split_message(content) if content else []
+    start = time.perf_counter()
+
+    if getattr(target, "interaction", None) is not None:
+        for chunk in chunks[:-1]:
+            await target.send(chunk)
+        await target.send(chunks[-1] if chunks else None, **kwargs)
+        metrics.record_send(time.perf_counter() - start)
+        return
+
+    if not chunks:
+        if kwargs:
+            await sender.enqueue(target, None, **kwargs)
+            metrics.record_send(time.perf_counter() - start)
+        return
+
+    futures = [sender.enqueue(target, chunk) for chunk in chunks[:-1]]
+    futures.append(sender.enqueue(target, chunks[-1], **kwargs))
+    await asyncio.gather(*futures)
+    metrics.record_send(time.perf_counter() - start)
+
+
+async def report_error(ctx, e, msg=None):
+    """
+    Counts a handled command error in the metrics and replies with msg,
+    or with the error itself.
+    """
+    metrics.record_error()
+    await reply(ctx, msg or f"An error occurred: {e}")
+
+
+def format_timestamp(timestamp, offset=False):
+    """
+    Formats epoch seconds as local time, with the UTC offset if offset is set.
+    """
+    local = datetime.fromtimestamp(timestamp).astimezone()
+    return local.isoformat(sep=" ") if offset else local.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def format_elapsed(timestamp):
+    """
+    Formats the time since timestamp (epoch seconds) as days, hours, minutes and seconds.
+    """
+    minutes, seconds = divmod(max(int(time.time()) - timestamp, 0), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    return f"{days} days, {hours} hours, {minutes} minutes, {seconds} seconds"
+
+
+def player_letter(tenant, target):
+    """
+    Resolves a player's letter or name, in any case, to their roster letter. Returns None when it is neither.
+    """
+    target = target.strip()
+    if target.upper() in tenant.roster:
+        return target.upper()
+    return {name.lower(): letter for letter, name in tenant.roster.items()}.get(target.lower())
+
+
+def analytics_scope(tenant, target):
+    """
+    Resolves a map name, player letter or name, or season to an analytics scope.
+    Returns (scope, label). No target means every game.
+    """
+    if target is None or target.lower() == "all":
+        return ("all",), "All games"
+
+    target = target.strip()
+    letter = player_letter(tenant, target)
+
+    if SEASON_FORMAT.fullmatch(target.lower()):
+        return ("season", target.lower()), target.lower()
+    if letter is not None:
+        return ("player", letter), tenant.roster[letter]
+
+    map_name = tenant.catalog.resolver.match(target)
+    if map_name is not None:
+        return ("map", tenant.catalog.ids[map_name]), map_name
+
+    suggestions = tenant.catalog.resolver.suggest(target)
+    hint = f" (did you mean {' or '.join(suggestions)}?)" if suggestions else ""
+    raise ValueError(f"'{target}' is not a map, player or season{hint}")
+
+
+async def season_rows(tenant, query, season):
+    """
+    Returns the rows of a SNAPSHOT_QUERIES query for season from its latest snapshot.
+    """
+    rows, _, _ = await tenant.snapshots.get(season)
+    return rows[query]
+
+
+async def cached_response(tenant, render, *args, season=None, map_name=None):
+    """
+    Returns render(tenant, *args) from the tenant's response cache, rendering
+    it on a miss. season and map_name scope the entry for invalidation.
+    """
+    key = (render.__name__, *args)
+    msg = tenant.cache.get(key)
+
+    if msg is None:
+        generation = tenant.cache.generation
+        current = await tenant.reads_current()
+        msg = await render(tenant, *args)
+
+        # A response read from a replica that is behind would outlive the games it is missing
+        if current:
+            tenant.cache.put(key, msg, generation, season=season, map_name=map_name)
+
+    return msg
+
+
+# Responses
+
+async def render_map_records(tenant, title, query, season=None):
+    result = await (tenant.reader.fetchall(query) if season is None else season_rows(tenant, query, season))
+
+    parsed_result = f"=== {title} ===\n" if season is None else f"=== {title} - {season} ===\n"
+
+    for i in result:
+        name = tenant.catalog.names[i[0]]
+        winrate = round(i[5], 2)
+        record = f"{i[3]}W {i[2]}L {i[4]}D"
+        parsed_result += name + " - " + str(winrate)+"%" + " - " + record + "\n"
+
+    return parsed_result
+
+
+async def render_map_types(tenant, season):
+    result = await season_rows(tenant, "bestmaptype", season)
+
+    # wins, losses, draws per map type
+    totals = {}
+    for map_id, wins, losses, draws in result:
+        record = totals.setdefault(tenant.catalog.types[map_id], [0, 0, 0])
+        record[0] += wins
+        record[1] += losses
+        record[2] += draws
+
+    parsed_result = f"=== BEST MAP TYPES - {season} ===\n"
+
+    for type, (wins, losses, draws) in sorted(totals.items(), key=lambda item: -item[1][0] / sum(item[1])):
+        winrate = round(wins / (wins + losses + draws) * 100, 2)
+        record = f"{wins}W {losses}L {draws}D"
+        parsed_result += type + " - " + str(winrate)+"%" + " - " + record + "\n"
+
+    return parsed_result
+
+
+async def render_most_played(tenant, season=None):
+    if season is None:
+        result = await tenant.reader.fetchall("mostplayedall")
+        msg = f"=== Most Played Maps - All Time\n"
+    else:
+        result = await season_rows(tenant, "mostplayed", season)
+        msg = f"=== Most Played Maps - {season}\n"
+
+    for i in result:
+        msg += f"{tenant.catalog.names[i[0]]}: {i[1]} times\n"
+
+    return msg
+
+
+async def render_group_stats(tenant, season):
+    result = await season_rows(tenant, "group_stats", season)
+    res_string = f"=== {season} Group Stats ===\n"
+
+    for player, games, win_rate in result:
+        name = tenant.roster.get(player, player)
+        res_string += f"{name} - {games} Games Played - {round(win_rate, 2)}% win rate\n"
+
+    return res_string
+
+
+async def render_personal_wr(tenant, letter, season):
+    total, won = await tenant.reader.fetchone("personal_wr", player=letter, season=season)
+
+    if not total:
+        return f"No games recorded for {tenant.roster.get(letter, letter)} in {season}"
+
+    wrate = round((int(won or 0) / int(total) * 100), 2)
+    return f"{wrate}% - {total} maps played"
+
+
+async def render_winrate(tenant, season, map_name):
+    result = await tenant.reader.fetchone("winrate", season=season, map_id=tenant.catalog.id(map_name))
+
+    if result is None:
+        return f"No {map_name} games recorded in {season}"
+
+    won, total = result
+    wrate = round((int(won) / int(total) * 100), 2)
+    return f"{wrate}% - {total} maps played"
+
+
+async def render_report(tenant, season):
+    return await tenant.reader.read(build_report, season)
+
+
+async def chart_maps(tenant, season=None):
+    """
+    Returns the PNG bar chart of every map's win rate, for one season or all time.
+    """
+    if season is None:
+        key = (tenant.key, await tenant.read_version(), "maps", season)
+    else:
+        # Season charts come from the snapshot, which is rebuilt without a new data version
+        snapshot, games, refreshed_at = await tenant.snapshots.get(season)
+        key = (tenant.key, "maps", season, games, refreshed_at, tenant.snapshots.refreshes)
+
+    png = charts.cached(key)
+    if png is not None:
+        return png
+
+    rows = await tenant.reader.fetchall("bestmaps") if season is None else snapshot["seasonbestmaps"]
+    if not rows:
+        raise ValueError(f"No games recorded in {season}" if season else "No games recorded")
+
+    title = f"Map win rates - {season}" if season else "Map win rates - All Time"
+    labels = [f"{tenant.catalog.names[row[0]]} ({row[1]})" for row in rows]
+    values = [round(row[5], 1) for row in rows]
+
+    return await charts.render(key, draw_bar_chart, title, labels, values, "Win rate %")
+
+
+async def chart_winrate(tenant, map_name, season=None):
+    """
+    Returns the PNG line chart of a map's running win rate over time,
+    for one season or all time.
+    """
+    map_name = tenant.catalog.resolve(map_name)
+    map_id = tenant.catalog.ids[map_name]
+    key = (tenant.key, await tenant.read_version(), "winrate", map_id, season)
+
+    png = charts.cached(key)
+    if png is not None:
+        return png
+
+    rows = await tenant.reader.fetchall("map_history", map_id=map_id)
+    points = []
+    wins = 0
+
+    for game_season, timestamp, map_result in rows:
+        if season is None or game_season == season:
+            wins += map_result == 'w'
+            points.append((timestamp, wins / (len(points) + 1) * 100))
+
+    if not points:
+        raise ValueError(f"No {map_name} games recorded" + (f" in {season}" if season else ""))
+
+    points = downsample(points)
+    title = f"{map_name} win rate - {season}" if season else f"{map_name} win rate - All Time"
+
+    return await charts.render(key, draw_line_chart, title, [point[0] for point in points],
+                               [point[1] for point in points], "Win rate %")
+
+
+async def render_last10(tenant):
+    result = await tenant.db.fetchall("last10")
+    msg = ""
+
+    for i in result:
+
+        line = ""
+        if i[1] == 'l':
+            line += "❌ loss "
+        elif i[1] == 'w':
+            line += "✅ win "
+        elif i[1] == 'd':
+            line += "⛔ draw"
+
+        line += tenant.catalog.names[i[0]]
+        line += f" {format_timestamp(i[2])}"
+        msg += f"{line}\n"
+
+    return msg
+
+
+# Bot Behaviour
+
+def command_tree_hash():
+    """
+    Returns a hash of the slash commands as they are sent to Discord, and the application they belong to.
+    """
+    payload = [command.to_dict(bot.tree) for command in bot.tree.get_commands()]
+    data = json.dumps([bot.application_id, payload], sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+async def sync_commands():
+    """
+    Syncs the slash commands to Discord, unless they are unchanged since the last sync.
+    """
+    tree_hash = command_tree_hash()
+    try:
+        with open(COMMAND_HASH_FILE) as stream:
+            if stream.read().strip() == tree_hash:
+                return
+    except FileNotFoundError:
+        pass
+
+    synced = await bot.tree.sync()
+    logger.info("Synced %d slash commands", len(synced))
+
+    with open(COMMAND_HASH_FILE, "w") as stream:
+        stream.write(tree_hash)
+
+
+@bot.event
+async def setup_hook():
+    """
+    Starts background work once the bot is logged in
+    """
+    if METRICS_FILE:
+        write_metrics_file.start()
+    refresh_snapshots.start()
+    if REPLICA_MAX_AGE:
+        refresh_replicas.change_interval(seconds=REPLICA_MAX_AGE / 2)
+        refresh_replicas.start()
+
+    # Syncing is rate limited, so only when a command has changed
+    await sync_commands()
+
+
+@bot.event
+async def on_socket_event_type(event_type):
+    metrics.record_event(event_type)
+
+
+@tasks.loop(seconds=METRICS_INTERVAL)
+async def write_metrics_file():
+    await asyncio.to_thread(metrics.write_prometheus, METRICS_FILE)
+
+
+@tasks.loop(seconds=SNAPSHOT_INTERVAL)
+async def refresh_snapshots():
+    """
+    Rebuilds the snapshots of every open guild's seasons that have gained games
+    """
+    for tenant in tenants.values():
+        tenants.hold(tenant)
+        try:
+            await tenant.snapshots.refresh_pending()
+        except Exception:
+            logger.exception("Snapshot refresh failed for %s", tenant.key)
+        finally:
+            tenants.release(tenant)
+
+
+@tasks.loop(seconds=DIGEST_INTERVAL)
+async def post_digests():
+    """
+    Posts the digest of the CHANNEL_ID guild's last session once it has ended
+    """
+    channel = bot.get_channel(CHANNEL_ID)
+    if channel is None:
+        return
+
+    tenant = await tenants.acquire(channel.guild.id if getattr(channel, "guild", None) else None)
+    try:
+        games = await undigested_games(tenant)
+
+        if session_ended(games):
+            await reply(channel, await tenant.db.read(build_digest, games, tenant.catalog.names, tenant.roster))
+            # After posting, so a digest that failed to send is retried
+            await tenant.db.execute("upsert_digest_seq", seq=games[-1][0])
+    except Exception:
+        logger.exception("Session digest failed for %s", tenant.key)
+    finally:
+        tenants.release(tenant)
+
+
+@tasks.loop(seconds=REPLICA_MAX_AGE / 2)
+async def refresh_replicas():
+    """
+    Remakes the analytics replica of every open guild that has gained games
+    """
+    for tenant in tenants.values():
+        if tenant.replica is None:
+            continue
+
+        tenants.hold(tenant)
+        try:
+            await tenant.replica.refresh_stale()
+        except Exception:
+            logger.exception("Replica refresh failed for %s", tenant.key)
+        finally:
+            tenants.release(tenant)
+
+
+@bot.before_invoke
+async def start_command(ctx):
+    metrics.start()
+    ctx.tenant = await tenants.acquire(ctx.guild.id if ctx.guild else None)
+
+
+@bot.after_invoke
+async def finish_command(ctx):
+    tenants.release(ctx.tenant)
+    metrics.finish(ctx.command.qualified_name)
+
+
+@bot.event
+async def on_command_error(ctx, error):
+    """
+    Counts errors the commands did not handle themselves, then logs them
+    like the default handler
+    """
+    if isinstance(error, commands.CommandNotFound):
+        return
+
+    metrics.record_error(ctx.command.qualified_name if ctx.command else None)
+    logger.error("Ignoring exception in command %s", ctx.command, exc_info=error)
+
+
+@bot.event
+async def on_ready():
+    """
+    Functionaliy when bot activated
+    """
+    print(f"✅ Online in {time.perf_counter() - bot_data.started:.2f}s")
+
+    if CHANNEL_ID is not None and not post_digests.is_running():
+        post_digests.start()
+
+    channel = bot.get_channel(CHANNEL_ID)
+    if channel is None:
+        return
+
+    msg = "\nMAP BOT RUNNING\n"
+    instr = "\n Information on how to use the bot can be found by typing in 'mcmds'"
+    
+    await reply(channel, msg + instr)
+
+
+@bot.hybrid_command()
+async def add(ctx, *, entry: str):
+    """
+    Adds one or more results in a single transaction.
+    Nothing is written unless every result is valid. Replies once the
+    results are journaled, just before they are committed.
+    """
+    cur_timestamp = int(time.time())
+    added_at = format_timestamp(cur_timestamp)
+
+    try:
+        results, season, stack = parse_add(entry, ctx.tenant.default_season)
+        games = []
+        errors = []
+
+        for map_name, map_result in results:
+            row = {"season": season, "map_name": map_name, "map_result": map_result,
+                   "stack": stack, "timestamp": str(cur_timestamp)}
+            try:
+                games.append(validate_game(row, ctx.author.name, ctx.tenant.catalog, ctx.tenant.roster))
+            except ValueError as e:
+                errors.append(f"{map_name} {map_result}: {e}")
+
+        if errors:
+            raise ValueError("nothing added\n" + "\n".join(errors))
+
+        await ctx.tenant.ingest.add(games)
+
+        if len(games) == 1:
+            await reply(ctx, f"✅ Map '{games[0]['map_name']}' added successfully by {ctx.author.name} @ {added_at}")
+        else:
+            record = " ".join(f"{sum(game['map_result'] == result for game in games)}{result.upper()}" for result in "wld")
+            added = ", ".join(f"{game['map_name']} {game['map_result']}" for game in games)
+            await reply(ctx, f"✅ {len(games)} maps added successfully by {ctx.author.name} @ {added_at} ({record})\n{added}")
+
+    except ValueError as e:
+        await report_error(ctx, e, f"⚠️ ValueError: {e} (Invalid value)")
+    except sqlite3.IntegrityError as e:
+        await report_error(ctx, e, f"⚠️ Integrity Error: {e} (Invalid value or constraint failed)")
+    except sqlite3.OperationalError as e:
+        await report_error(ctx, e, f"⚠️ Operational Error: {e} (SQL syntax or connection issue)")
+    except sqlite3.DatabaseError as e:
+        await report_error(ctx, e, f"⚠️ Database Error: {e}")
+    except Exception as e:
+        await report_error(ctx, e, f"⚠️ Unexpected Error: {e}")
+
+
+@bot.hybrid_command()
+async def bestmaptype(ctx, season):
+    """
+    Provides the win rate of each map type in a season
+    """
+    try:
+        await reply(ctx, await cached_response(ctx.tenant, render_map_types, season, season=season))
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command()
+async def lastwon(ctx, map_name: str):
+    """
+    Fetches the last time you won the specified map.
+    """
+    try:
+        map_name = ctx.tenant.catalog.resolve(map_name)
+        result = await ctx.tenant.db.fetchone("lastwon", map_id=ctx.tenant.catalog.id(map_name))
+        last_time = result[0]
+        last_season = result[1]
+
+        if last_time != None:
+            await reply(ctx, f"You last won {map_name} in {last_season} which was: {format_elapsed(last_time)} ago")
+        else:
+            await reply(ctx, f"No recorded win in database")
+
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command()
+async def personal_wr(ctx, player, season):
+    """
+    Provides a player's win rate in a season
+    """
+    try:
+        letter = player_letter(ctx.tenant, player)
+        if letter is None:
+            raise ValueError(f"'{player}' is not a player")
+        await reply(ctx, await cached_response(ctx.tenant, render_personal_wr, letter, season, season=season))
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command()
+async def group_stats(ctx, season):
+    """
+    Win rate of every player in the group for a season
+    """
+    try:
+        await reply(ctx, await cached_response(ctx.tenant, render_group_stats, season, season=season))
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command()
+async def winrate(ctx, season: str, map_name :str):
+    """
+    Fetches winrate for a given map
+    returns as a percentage
+    Arguments: 
+        map_name: the name of the map
+    """
+    try:
+        map_name = ctx.tenant.catalog.resolve(map_name)
+        await reply(ctx, await cached_response(ctx.tenant, render_winrate, season, map_name, season=season, map_name=map_name))
+    except Exception as e:
+        await report_error(ctx, e, f"An error occured: {e}")
+
+
+@bot.hybrid_command()
+async def seasonbestmaps(ctx, season):
+    """
+    Provides information on the maps with the best recordss
+    """
+    try:
+        await reply(ctx, await cached_response(ctx.tenant, render_map_records, "BEST MAPS", "seasonbestmaps", season, season=season))
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command()
+async def seasonworstmaps(ctx, season):
+    """
+    Provides information on the maps with the worst records
+    """
+    try:
+        await reply(ctx, await cached_response(ctx.tenant, render_map_records, "WORST MAPS", "seasonworstmaps", season, season=season))
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command()
+async def bestmaps(ctx):
+    """
+    Provides information on the maps with the best recordss
+    """
+    try:
+        await reply(ctx, await cached_response(ctx.tenant, render_map_records, "BEST MAPS", "bestmaps"))
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command()
+async def worstmaps(ctx):
+    """
+    Provides information on the maps with the worst records
+    """
+    try:
+        await reply(ctx, await cached_response(ctx.tenant, render_map_records, "WORST MAPS", "worstmaps"))
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command()
+async def last10 (ctx): 
+    """
+    Last 10 Results
+    """
+    try:
+        await reply(ctx, await cached_response(ctx.tenant, render_last10))
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command()
+async def form(ctx, target=None, games: int = TREND_WINDOW):
+    """
+    Record over the last N games for a map, player or season
+    """
+    try:
+        await ctx.tenant.analytics.ready()
+        scope, label = analytics_scope(ctx.tenant, target)
+        wins, losses, draws = ctx.tenant.analytics.form(scope, max(1, min(games, ANALYTICS_HISTORY)))
+        played = wins + losses + draws
+
+        if not played:
+            await reply(ctx, f"No games recorded for {label}")
+            return
+
+        result, length = ctx.tenant.analytics.streaks[scope]
+        winrate = round(wins / played * 100, 2)
+        await reply(ctx, f"{label} - last {played} games: {winrate}% - {wins}W {losses}L {draws}D "
+                         f"(current streak: {length}{result.upper()})")
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command()
+async def streaks(ctx):
+    """
+    Current win and loss streaks for every map and player
+    """
+    try:
+        await ctx.tenant.analytics.ready()
+        msg = "=== Current Streaks ===\n"
+
+        for kind, title, label in (("player", "Players", ctx.tenant.roster.get),
+                                   ("map", "Maps", ctx.tenant.catalog.names.get)):
+            current = [(length, result, label(scope[1])) for scope, (result, length) in ctx.tenant.analytics.streaks.items()
+                       if scope[0] == kind and result != "d" and length > 1]
+            current.sort(key=lambda streak: (streak[1] != "w", -streak[0], streak[2]))
+
+            msg += f"{title}\n"
+            msg += "".join(f"{'✅' if result == 'w' else '❌'} {name}: {length}{result.upper()}\n"
+                           for length, result, name in current) or "No streaks\n"
+
+        await reply(ctx, msg)
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command()
+async def trend(ctx, target=None):
+    """
+    Rolling 20 game win rate over recent games for a map, player or season
+    """
+    try:
+        await ctx.tenant.analytics.ready()
+        scope, label = analytics_scope(ctx.tenant, target)
+        rates = ctx.tenant.analytics.trend(scope)
+
+        if not rates:
+            await reply(ctx, f"Not enough games for a {TREND_WINDOW} game trend for {label}")
+            return
+
+        line = "".join(SPARKLINE[min(int(rate / 100 * len(SPARKLINE)), len(SPARKLINE) - 1)] for rate in rates)
+        msg = f"=== {label} - rolling {TREND_WINDOW} game win rate ===\n"
+        msg += f"{line}\n"
+        msg += f"{round(rates[0], 2)}% → {round(rates[-1], 2)}% (low {round(min(rates), 2)}%, high {round(max(rates), 2)}%)"
+        await reply(ctx, msg)
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command()
+async def report(ctx, season):
+    """
+    Season retrospective: map x player, map type x season and stack size x result
+    """
+    try:
+        await ctx.defer()
+        await reply(ctx, await cached_response(ctx.tenant, render_report, season))
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_group(invoke_without_command=True)
+async def chart(ctx):
+    """
+    Draws a chart of every map's win rate, or of one map's win rate over time
+    """
+    await report_error(ctx, None, "Use mchart maps [season] or mchart winrate map_name [season]")
+
+
+@chart.command(name="maps")
+async def chart_maps_(ctx, season=None):
+    """
+    Bar chart of every map's win rate, for one season or all of them
+    """
+    try:
+        await ctx.defer()
+        png = await chart_maps(ctx.tenant, season)
+        await reply(ctx, file=discord.File(io.BytesIO(png), filename="maps.png"))
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@chart.command(name="winrate")
+async def chart_winrate_(ctx, map_name, season=None):
+    """
+    Line chart of a map's win rate over time, for one season or all of them
+    """
+    try:
+        await ctx.defer()
+        png = await chart_winrate(ctx.tenant, map_name, season)
+        await reply(ctx, file=discord.File(io.BytesIO(png), filename="winrate.png"))
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command()
+async def mostplayed(ctx, season):
+    """
+    Shows most played maps
+    """
+    try:
+        await reply(ctx, await cached_response(ctx.tenant, render_most_played, season, season=season))
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command()
+async def mostplayedall(ctx):
+    """
+    Shows most played maps
+    """
+    try:
+        await reply(ctx, await cached_response(ctx.tenant, render_most_played))
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command()
+async def lastplayed(ctx, map_name):
+    """
+    Shows the last time we got the map
+    """
+    try:
+        map_name = ctx.tenant.catalog.resolve(map_name)
+        last_time = (await ctx.tenant.db.fetchone("lastplayed", map_id=ctx.tenant.catalog.id(map_name)))[0]
+
+        if last_time != None:
+            await reply(ctx, f"Last played {map_name}: {format_elapsed(last_time)} ago")
+        else:
+            await reply(ctx, "Have not played this map.")
+
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command()
+async def maps(ctx):
+    """
+    Shows the possible maps to enter intot the database
+    """
+    await reply(ctx, "Trackable Maps\n" + "\n".join(ctx.tenant.catalog.ids))
+
+
+@bot.hybrid_command()
+async def cmds(ctx):
+    """
+    Prints list of bots commands
+    """
+    prefix = "m" if PREFIX_COMMANDS else "/"
+    await reply(ctx, "=== Commands ===\n" + "\n".join(prefix + command[1:] for command in bot_data.bot_commands))
+
+
+@bot.hybrid_command(name="import")
+@commands.is_owner()
+async def import_(ctx, attachment: discord.Attachment = None):
+    """
+    Imports match history from an attached .csv or .jsonl file
+    """
+    if attachment is None:
+        await reply(ctx, "Attach a .csv or .jsonl file with columns: " + ", ".join(GAME_FIELDS))
+        return
+
+    try:
+        await ctx.defer()
+        fmt = file_format(attachment.filename)
+        stream = io.TextIOWrapper(io.BytesIO(await attachment.read()), encoding="utf-8", newline="")
+        imported, rejected, rejects = await ctx.tenant.db.write(import_games, read_games(stream, fmt), ctx.author.name)
+        ctx.tenant.cache.invalidate()
+        ctx.tenant.data_version += 1
+        await ctx.tenant.snapshots.invalidate()
+        # Between ingest batches, so no add is counted twice or missed
+        await ctx.tenant.ingest.exclusive(ctx.tenant.analytics.load)
+
+        msg = f"✅ Imported {imported} games from {attachment.filename}"
+        if rejected:
+            msg += f"\n⚠️ Rejected {rejected} rows\n"
+            msg += "\n".join(f"line {line_num}: {reason}" for line_num, reason in rejects)
+        await reply(ctx, msg)
+
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command()
+async def export(ctx, fmt="csv"):
+    """
+    Exports the full match history as a .csv or .jsonl file
+    """
+    try:
+        file_format(f"owmaps.{fmt}")
+        await ctx.defer()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, f"owmaps.{fmt}")
+
+            with open(path, "w", encoding="utf-8", newline="") as stream:
+                written = await ctx.tenant.db.read(export_games, stream, fmt)
+
+            await reply(ctx, f"📦 Exported {written} games", file=discord.File(path))
+
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command()
+async def cache(ctx):
+    """
+    Shows response cache hit/miss counters
+    """
+    response_cache = ctx.tenant.cache
+    lookups = response_cache.hits + response_cache.misses
+    hit_rate = round(response_cache.hits / lookups * 100, 2) if lookups else 0
+
+    msg = "=== Response Cache ===\n"
+    msg += f"{len(response_cache)} entries, {response_cache.hits} hits, {response_cache.misses} misses ({hit_rate}% hit rate)\n"
+    msg += f"{response_cache.invalidations} entries invalidated"
+    await reply(ctx, msg)
+
+
+@bot.hybrid_command()
+async def roster(ctx):
+    """
+    Shows the players this server can use in a stack
+    """
+    msg = "=== Roster ===\n"
+    msg += "\n".join(f"{letter}: {name}" for letter, name in ctx.tenant.roster.items()) or "No players"
+    await reply(ctx, msg)
+
+
+@bot.hybrid_command()
+@commands.check_any(commands.is_owner(), commands.has_guild_permissions(manage_guild=True))
+async def setplayer(ctx, letter, *, name):
+    """
+    Adds a player to this server's roster, or renames one
+    """
+    try:
+        letter = letter.upper()
+        if not re.fullmatch("[A-Z]", letter):
+            raise ValueError(f"'{letter}' is not a single letter")
+
+        await ctx.tenant.db.execute("upsert_player", letter=letter, player_name=name)
+        ctx.tenant.roster[letter] = name
+        ctx.tenant.cache.invalidate()
+        await reply(ctx, f"✅ {letter} is now {name}")
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command()
+@commands.check_any(commands.is_owner(), commands.has_guild_permissions(manage_guild=True))
+async def removeplayer(ctx, letter):
+    """
+    Removes a player from this server's roster. Their games are kept.
+    """
+    try:
+        letter = letter.upper()
+        if letter not in ctx.tenant.roster:
+            raise ValueError(f"'{letter}' is not on the roster")
+
+        await ctx.tenant.db.execute("delete_player", letter=letter)
+        del ctx.tenant.roster[letter]
+        ctx.tenant.cache.invalidate()
+        await reply(ctx, f"✅ Removed {letter} from the roster")
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command()
+async def config(ctx, key=None, value=None):
+    """
+    Shows this server's settings, or changes one (Manage Server only)
+    """
+    try:
+        if key is None:
+            msg = "=== Config ===\n"
+            msg += f"default_season: {ctx.tenant.default_season}"
+            await reply(ctx, msg)
+            return
+
+        await commands.check_any(commands.is_owner(), commands.has_guild_permissions(manage_guild=True)).predicate(ctx)
+        if key not in CONFIG_KEYS:
+            raise ValueError(f"Unknown setting '{key}' (settings: {', '.join(CONFIG_KEYS)})")
+        if value is None or not CONFIG_KEYS[key].fullmatch(value):
+            raise ValueError(f"Invalid value '{value}' for {key}")
+
+        await ctx.tenant.db.execute("upsert_config", key=key, value=value)
+        ctx.tenant.config[key] = value
+        await reply(ctx, f"✅ {key} set to {value}")
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command()
+@commands.check_any(commands.is_owner(), commands.has_guild_permissions(manage_guild=True))
+async def rollover(ctx, season=None):
+    """
+    Closes the current season and starts the next one, or the one given (Manage Server only)
+    """
+    try:
+        current = ctx.tenant.default_season
+        if season is None:
+            season = f"s{int(current[1:]) + 1:02d}"
+
+        season = season.lower()
+        if not SEASON_FORMAT.fullmatch(season):
+            raise ValueError(f"Invalid season '{season}'")
+        if season == current:
+            raise ValueError(f"{season} is already the current season")
+
+        await ctx.tenant.db.execute("upsert_config", key="default_season", value=season)
+        ctx.tenant.config["default_season"] = season
+
+        # Freeze the closed season's leaderboards now rather than on their first read
+        ctx.tenant.snapshots.schedule(current)
+
+        await reply(ctx, f"✅ {current} closed, new games go to {season}")
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command(name="metrics")
+@commands.is_owner()
+async def metrics_(ctx):
+    """
+    Shows per command latency, DB and send time, queries, rows and errors
+    """
+    msg = "=== Command Metrics ===\n"
+
+    for name, command in sorted(metrics.commands.items(), key=lambda item: -item[1].seconds):
+        calls = command.calls or 1
+        msg += (f"{name}: {command.calls} calls, p50 ≤{command.percentile(0.5) * 1000:g}ms, "
+                f"p95 ≤{command.percentile(0.95) * 1000:g}ms, "
+                f"avg {command.seconds / calls * 1000:.1f}ms (db {command.db_seconds / calls * 1000:.1f}ms, "
+                f"send {command.send_seconds / calls * 1000:.1f}ms), "
+                f"{command.queries / calls:.1f} queries, {command.rows_returned / calls:.1f} rows returned, "
+                f"{command.errors} errors\n")
+
+    if not metrics.commands:
+        msg += "No commands run yet\n"
+
+    msg += f"{metrics.slow_queries} queries slower than {SLOW_QUERY_SECONDS * 1000:g}ms\n"
+
+    events = sum(metrics.gateway_events.values())
+    msg += f"{events} gateway events ({events / (time.monotonic() - metrics.gateway_started):.2f}/s): "
+    msg += ", ".join(f"{event_type} {count}" for event_type, count in metrics.gateway_events.most_common(5))
+    await reply(ctx, msg)
+
+
+@bot.hybrid_command()
+@commands.is_owner()
+async def ingest(ctx):
+    """
+    Shows the ingest queue's depth and how adds have been grouped
+    """
+    queue = ctx.tenant.ingest
+    msg = "=== Ingest Queue ===\n"
+    msg += f"Queued: {len(queue)}\n"
+    msg += f"Committed through add #{queue.committed} of #{queue.seq}\n"
+    msg += f"Commits since start: {queue.batches}\n"
+    msg += f"Journal syncs since start: {queue.syncs}\n"
+    msg += f"Retries: {queue.retries}\n"
+    msg += f"Failed adds: {queue.dead}"
+    await reply(ctx, msg)
+
+
+@bot.hybrid_command()
+async def digest(ctx):
+    """
+    Shows the digest of the games added since the last one was posted
+    """
+    try:
+        games = await undigested_games(ctx.tenant)
+
+        if not games:
+            await reply(ctx, "No games added since the last digest")
+            return
+
+        msg = await ctx.tenant.db.read(build_digest, games, ctx.tenant.catalog.names, ctx.tenant.roster)
+        if not session_ended(games):
+            msg += f"Session still going, posted {SESSION_GAP_MINUTES:g} minutes after the last add"
+        await reply(ctx, msg)
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command()
+async def replica(ctx):
+    """
+    Shows how old the copy of the database that analytics read from is
+    """
+    replica = ctx.tenant.replica
+
+    if replica is None:
+        await reply(ctx, "Analytics read from the database itself")
+        return
+
+    msg = "=== Analytics Replica ===\n"
+    msg += f"Kept {'on disk' if replica.on_disk else 'in memory'}, at most {replica.max_age:g}s behind\n"
+
+    if replica.copied_at is None:
+        msg += "No copy made yet"
+    else:
+        msg += f"Copy made {replica.age:.1f}s ago, {'up to date' if replica.fresh else 'behind the database'}\n"
+        msg += f"{replica.refreshes} copies made, the last in {replica.copy_seconds * 1000:.0f}ms"
+
+    await reply(ctx, msg)
+
+
+@bot.hybrid_command()
+@commands.is_owner()
+async def rebuildstats(ctx):
+    """
+    Regenerates the map_stats and player_stats aggregates from owmaps
+    """
+    try:
+        await ctx.defer()
+        rows, player_rows = await ctx.tenant.db.transaction(rebuild_stats)
+        ctx.tenant.cache.invalidate()
+        ctx.tenant.data_version += 1
+        await ctx.tenant.snapshots.invalidate()
+        await reply(ctx, f"✅ Map stats rebuilt ({rows} rows), player stats rebuilt ({player_rows} rows)")
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command()
+@commands.is_owner()
+async def checkstats(ctx):
+    """
+    Verifies the map_stats aggregates match a raw scan of owmaps
+    """
+    try:
+        await ctx.defer()
+        mismatches = await ctx.tenant.db.transaction(check_map_stats)
+
+        if not mismatches:
+            await reply(ctx, "✅ Map stats match owmaps")
+        else:
+            msg = f"⚠️ {len(mismatches)} map stats rows out of sync (run mrebuildstats)\n"
+            for season, map_id, expected, stored in mismatches[:10]:
+                msg += f"{season} {ctx.tenant.catalog.names.get(map_id, map_id)}: expected {expected}, stored {stored}\n"
+            await reply(ctx, msg)
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command()
+@commands.is_owner()
+async def plans(ctx):
+    """
+    Checks every command's owmaps query plan for full table scans
+    """
+    try:
+        await ctx.defer()
+        full_scans = await ctx.tenant.db.transaction(find_full_scans)
+
+        if not full_scans:
+            await reply(ctx, "✅ No full scans in any command query plan")
+        else:
+            msg = f"⚠️ {len(full_scans)} full scans found\n"
+            for name, detail in full_scans:
+                msg += f"{name}: {detail}\n"
+            await reply(ctx, msg)
+    except Exception as e:
+        await report_error(ctx, e)
+
+
+@bot.hybrid_command()
+@commands.is_owner()
+async def stop(ctx):
+    """
+    Powers off the bot
+    """
+    await reply(ctx, "Bot is shutting down")
+    await bot.close() # Close port to bot
+    await sender.close()
+    await tenants.close()
+    charts.close()
+
+
+# Autocomplete
+#
+# Slash command options are completed from memory: the open tenant's map
+# index, roster and analytics. A guild whose database is not open yet gets
+# map names only, since completions must answer within Discord's deadline.
+
+MAX_CHOICES = 25
+
+
+def choices(values, current):
+    """
+    Returns up to MAX_CHOICES choices from (name, value) pairs whose name contains current.
+    """
+    current = current.lower()
+    return [app_commands.Choice(name=name, value=value) for name, value in values
+            if current in name.lower()][:MAX_CHOICES]
+
+
+def complete_map_names(tenant, current):
+    if tenant is None:
+        return [name for name in map_name_data.map_names if name.startswith(current.lower())][:MAX_CHOICES]
+    return tenant.catalog.resolver.complete(current, MAX_CHOICES)
+
+
+def complete_seasons(tenant):
+    if tenant is None:
+        return [bot_data.default_season]
+    return list(dict.fromkeys([tenant.default_season, *tenant.analytics.seasons()]))
+
+
+def complete_players(tenant):
+    return [(f"{letter} ({name})", letter) for letter, name in (tenant.roster.items() if tenant else ())]
+
+
+async def map_name_autocomplete(interaction, current):
+    return [app_commands.Choice(name=name, value=name)
+            for name in complete_map_names(tenants.peek(interaction.guild_id), current)]
+
+
+async def season_autocomplete(interaction, current):
+    return choices([(season, season) for season in complete_seasons(tenants.peek(interaction.guild_id))], current)
+
+
+async def player_autocomplete(interaction, current):
+    return choices(complete_players(tenants.peek(interaction.guild_id)), current)
+
+
+async def target_autocomplete(interaction, current):
+    """
+    Completes a form or trend target, which is a map, player or season.
+    """
+    tenant = tenants.peek(interaction.guild_id)
+    values = [(season, season) for season in complete_seasons(tenant)] + complete_players(tenant)
+    values += [(name, name) for name in complete_map_names(tenant, current)]
+    return choices(values, current)
+
+
+AUTOCOMPLETE = {"map_name": map_name_autocomplete, "season": season_autocomplete, "player": player_autocomplete,
+                "letter": player_autocomplete, "target": target_autocomplete}
+
+for command in bot.walk_commands():
+    if isinstance(command, commands.HybridCommand):
+        for parameter in command.app_command.parameters:
+            if parameter.name in AUTOCOMPLETE:
+                command.autocomplete(parameter.name)(AUTOCOMPLETE[parameter.name])
+
+
+# Command Line
+
+def main():
+    parser = argparse.ArgumentParser(description="Overwatch map tracking discord bot")
+    parser.add_argument("--guild", type=int, help="guild id, when DB is a per guild path template")
+    subparsers = parser.add_subparsers(dest="command")
+
+    subparsers.add_parser("run", help="run the discord bot (default)")
+
+    import_parser = subparsers.add_parser("import", help="import match history from a .csv or .jsonl file")
+    import_parser.add_argument("file")
+    import_parser.add_argument("--added-by", default="import", help="added_by for rows that do not set it")
+
+    export_parser = subparsers.add_parser("export", help="export match history to a .csv or .jsonl file")
+    export_parser.add_argument("file")
+
+    report_parser = subparsers.add_parser("report", help="print the report for a season")
+    report_parser.add_argument("season")
+
+    subparsers.add_parser("check-backend", help="run every registered query against the database in DB")
+
+    args = parser.parse_args()
+
+    bot_data.started = time.perf_counter()
+    configure()
+    tenants.max_open = MAX_OPEN_TENANTS
+
+    if args.command in ("import", "export", "report", "check-backend"):
+        if "{guild}" in DB_PATH and args.guild is None:
+            parser.error("DB has a database per guild, pass --guild")
+
+        path = tenant_path(args.guild)
+        start = time.perf_counter()
+
+    if args.command == "import":
+        with open(args.file, encoding="utf-8", newline="") as stream:
+            imported, rejected, rejects = asyncio.run(run_offline(path, import_games, read_games(stream, file_format(args.file)),
+                                                                  args.added_by, True))
+
+        print(f"✅ Imported {imported} games in {time.perf_counter() - start:.2f}s")
+        for line_num, reason in rejects:
+            print(f"⚠️ line {line_num}: {reason}")
+        if rejected:
+            print(f"⚠️ Rejected {rejected} rows")
+
+    elif args.command == "export":
+        with open(args.file, "w", encoding="utf-8", newline="") as stream:
+            written = asyncio.run(run_offline(path, export_games, stream, file_format(args.file)))
+
+        print(f"✅ Exported {written} games in {time.perf_counter() - start:.2f}s")
+
+    elif args.command == "report":
+        report = asyncio.run(run_offline(path, build_report, args.season))
+
+        print(report)
+        print(f"✅ Report built in {time.perf_counter() - start:.2f}s")
+
+    elif args.command == "check-backend":
+        for name, rows, seconds in asyncio.run(run_offline(path, check_queries)):
+            print(f"✅ {name}: {rows} rows in {seconds * 1000:.1f}ms")
+        print(f"✅ Every query ran in {time.perf_counter() - start:.2f}s")
+
+    else:
+        bot.run(BOT_TOKEN)
+
 
-bot.run(BOT_TOKEN)
+if __name__ == "__main__":
+    main()
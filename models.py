@@ -0,0 +1,128 @@
+"""
+SQLAlchemy models for the map bot database.
+
+Only imported by map_bot.create_schema when a database is created or
+migrated, so a normal start does not pay for importing SQLAlchemy.
+"""
+from sqlalchemy import Column, Integer, BigInteger, Text, String, CheckConstraint, ForeignKey, Index
+from sqlalchemy.ext.declarative import declarative_base
+
+
+Base = declarative_base()
+
+class MapReference(Base):
+    __tablename__ = 'map_ref'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    map_name = Column(String, unique=True, nullable=False)
+    map_type = Column(String, nullable=False)
+
+
+class OwMapsTable(Base):
+    __tablename__ = 'owmaps'
+
+    # SCHEMA
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    season = Column(Text, nullable=False)
+    map_id = Column(Integer, ForeignKey("map_ref.id"), nullable=False)
+    map_result = Column(Text, nullable=False)
+    stack = Column(Text, nullable=True)
+    timestamp = Column(BigInteger, nullable=False)
+    added_by = Column(Text, nullable=False)
+
+    # CONSTRAINTS
+    __table_args__ = (
+        CheckConstraint("season LIKE 's__' AND CAST(SUBSTR(season, 2, 2) AS INTEGER) BETWEEN 0 and 99", name = 'check_season_format'),
+        CheckConstraint("map_result IN ('w', 'l', 'd')", name = 'check_map_result'),
+        CheckConstraint("LENGTH(stack) <= 5", name="check_stack_length"),        
+
+        # INDEXES
+        Index('ix_owmaps_season_map_id_result', 'season', 'map_id', 'map_result'),
+        Index('ix_owmaps_map_id_result_timestamp', 'map_id', 'map_result', 'timestamp'),
+        Index('ix_owmaps_map_id_timestamp', 'map_id', 'timestamp'),
+        Index('ix_owmaps_timestamp', 'timestamp'),
+        )
+
+
+class MapStats(Base):
+    __tablename__ = 'map_stats'
+
+    # SCHEMA
+
+    season = Column(Text, primary_key=True)
+    map_id = Column(Integer, ForeignKey("map_ref.id"), primary_key=True)
+    wins = Column(Integer, nullable=False, default=0)
+    losses = Column(Integer, nullable=False, default=0)
+    draws = Column(Integer, nullable=False, default=0)
+    last_played = Column(BigInteger, nullable=True)
+    last_won = Column(BigInteger, nullable=True)
+
+
+class PlayerStats(Base):
+    __tablename__ = 'player_stats'
+
+    # SCHEMA
+
+    season = Column(Text, primary_key=True)
+    player = Column(Text, primary_key=True)
+    wins = Column(Integer, nullable=False, default=0)
+    losses = Column(Integer, nullable=False, default=0)
+    draws = Column(Integer, nullable=False, default=0)
+
+
+class GamePlayers(Base):
+    __tablename__ = 'game_players'
+
+    # SCHEMA
+
+    game_id = Column(Integer, ForeignKey("owmaps.id"), primary_key=True)
+    player = Column(Text, primary_key=True)
+
+    # INDEXES
+    __table_args__ = (
+        Index('ix_game_players_player', 'player', 'game_id'),
+        )
+
+
+class Roster(Base):
+    __tablename__ = 'roster'
+
+    # SCHEMA
+
+    letter = Column(Text, primary_key=True)
+    name = Column(Text, nullable=False)
+
+    # CONSTRAINTS
+    __table_args__ = (
+        CheckConstraint("LENGTH(letter) = 1", name="check_roster_letter"),
+        )
+
+
+class GuildConfig(Base):
+    __tablename__ = 'guild_config'
+
+    # SCHEMA
+
+    key = Column(Text, primary_key=True)
+    value = Column(Text, nullable=False)
+
+
+class SeasonSnapshot(Base):
+    __tablename__ = 'season_snapshots'
+
+    # SCHEMA
+
+    season = Column(Text, primary_key=True)
+    payload = Column(Text, nullable=False)
+    games = Column(Integer, nullable=False)
+    refreshed_at = Column(BigInteger, nullable=False)
+
+
+class IngestState(Base):
+    __tablename__ = 'ingest_state'
+
+    # SCHEMA
+
+    name = Column(Text, primary_key=True)
+    seq = Column(BigInteger, nullable=False)
@@ -0,0 +1,36 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from map_bot import run_offline, sender
+from bench import SYNTH_STACKS, parse_stacks, synth_database
+
+
+def generate_history(path, games):
+    """
+    Fills the database at path with games generated games.
+    """
+    asyncio.run(run_offline(path, synth_database, games, 4, 6, parse_stacks(SYNTH_STACKS)))
+    return path
+
+
+@pytest.fixture(scope="session")
+def history(tmp_path_factory):
+    """
+    A database of 5000 generated games. Copy it before writing to it.
+    """
+    return generate_history(str(tmp_path_factory.mktemp("history") / "history.db"), 5000)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def unpaced_sender():
+    """
+    Replies are not held back by Discord's rate limit.
+    """
+    per_seconds, sender.per_seconds = sender.per_seconds, 0
+    yield
+    sender.per_seconds = per_seconds
@@ -0,0 +1,66 @@
+import asyncio
+import os
+
+import pytest
+
+from map_bot import bot_data, open_server_tenant, open_tenant
+from bench import BENCH_UNSTABLE, bench_commands, run_command
+
+from conftest import generate_history
+
+# The most queries each command may run, with the season snapshot built by the first that needs it
+QUERY_BUDGETS = {"group_stats": 3, "bestmaptype": 3, "seasonbestmaps": 3, "seasonworstmaps": 3, "mostplayed": 3,
+                 "form": 0, "streaks": 0, "trend": 0, "maps": 0, "roster": 0}
+
+# An empty database server to run the commands against as well, e.g. postgresql+asyncpg://...
+SERVER_URL = os.getenv("TEST_DATABASE_URL")
+
+
+async def run_commands(tenant):
+    """
+    Runs every bench command on tenant. Returns {command: (queries, output)}.
+    """
+    await tenant.start()
+    await tenant.analytics.ready()
+    results = {}
+
+    try:
+        for name, args in bench_commands(bot_data.default_season):
+            _, queries, output = await run_command(tenant, name, *args)
+            results[name] = (queries, output)
+    finally:
+        await tenant.close()
+
+    return results
+
+
+@pytest.fixture(scope="module")
+def sqlite_results(tmp_path_factory):
+    path = generate_history(str(tmp_path_factory.mktemp("sqlite") / "history.db"), 2000)
+    return asyncio.run(run_commands(open_tenant(None, path, False)))
+
+
+@pytest.fixture(params=["sqlite+aiosqlite"] + ([SERVER_URL] if SERVER_URL else []))
+def server_url(request, tmp_path):
+    if request.param == "sqlite+aiosqlite":
+        return f"sqlite+aiosqlite:///{tmp_path / 'history.db'}"
+    return request.param
+
+
+def test_commands_match_sqlite(sqlite_results, server_url):
+    generate_history(server_url, 2000)
+
+    async def run():
+        return await run_commands(await open_server_tenant(None, server_url))
+
+    results = asyncio.run(run())
+
+    for name, (queries, output) in sqlite_results.items():
+        assert results[name][0] == queries, name
+        if name not in BENCH_UNSTABLE:
+            assert results[name][1] == output, name
+
+
+def test_query_budgets(sqlite_results):
+    for name, (queries, _) in sqlite_results.items():
+        assert queries <= QUERY_BUDGETS.get(name, 1), name
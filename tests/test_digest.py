@@ -0,0 +1,61 @@
+import sqlite3
+
+from map_bot import QUERIES, MapCatalog, bot_data, build_digest, insert_games, load_roster, validate_game
+
+from conftest import generate_history
+
+SESSION = [("ilios", "w", "WL"), ("busan", "l", "WLD"), ("ilios", "d", "W"), ("kings-row", "w", "CJ")]
+
+
+def digest_steps(path):
+    """
+    Adds SESSION to the history at path and builds its digest, counting
+    the SQLite VM instructions it takes. Returns (steps, digest).
+    """
+    connection = sqlite3.connect(path)
+    steps = 0
+
+    def step():
+        nonlocal steps
+        steps += 1
+
+    try:
+        catalog = MapCatalog.load(connection)
+        roster = load_roster(connection)
+        games = [validate_game({"season": bot_data.default_season, "map_name": map_name, "map_result": result,
+                                "stack": stack, "timestamp": str(2000000000 + i)}, "test", catalog, roster)
+                 for i, (map_name, result, stack) in enumerate(SESSION)]
+        with connection:
+            insert_games(connection, games)
+
+        connection.set_progress_handler(step, 1)
+        after = connection.execute(QUERIES["digest_seq"]).fetchone()[0]
+        session = connection.execute(QUERIES["session_games"], {"after": after}).fetchall()
+        digest = build_digest(connection, session, catalog.names, roster)
+    finally:
+        connection.close()
+
+    return steps, digest
+
+
+def test_imports_are_not_a_session(history):
+    connection = sqlite3.connect(history)
+    try:
+        digested = connection.execute(QUERIES["digest_seq"]).fetchone()
+        assert digested == connection.execute(QUERIES["last_game_id"]).fetchone()
+    finally:
+        connection.close()
+
+
+def test_digest_shows_season_rates(tmp_path):
+    _, digest = digest_steps(generate_history(str(tmp_path / "history.db"), 1000))
+
+    assert digest.count("→") == len({map_name for map_name, _, _ in SESSION}) + len(set("WLDCJ"))
+    assert f"Will ({bot_data.default_season}): 1W 1L 1D" in digest
+
+
+def test_digest_cost_is_flat(tmp_path):
+    small, _ = digest_steps(generate_history(str(tmp_path / "small.db"), 1000))
+    large, _ = digest_steps(generate_history(str(tmp_path / "large.db"), 50000))
+
+    assert large <= small * 1.2 + 5
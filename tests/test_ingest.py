@@ -0,0 +1,183 @@
+import asyncio
+import json
+import os
+import sqlite3
+
+from map_bot import Database, IngestQueue, apply_ingest, bot_data, prepare_database, validate_game
+
+
+def make_games(path, count, start=0):
+    catalog, roster, _ = prepare_database(path)
+    return [validate_game({"season": bot_data.default_season, "map_name": "ilios", "map_result": "w",
+                           "stack": "W", "timestamp": str(2000000000 + i)}, "test", catalog, roster)
+            for i in range(start, start + count)]
+
+
+def write_journal(path, entries, torn=b""):
+    with open(path + ".journal", "wb") as stream:
+        for seq, games in entries:
+            stream.write(json.dumps({"seq": seq, "games": games}).encode("utf-8") + b"\n")
+        stream.write(torn)
+
+
+def stored(path):
+    """
+    Returns (games stored, ingest sequence number) for the database at path.
+    """
+    connection = sqlite3.connect(path)
+    try:
+        games = connection.execute("SELECT COUNT(*) FROM owmaps").fetchone()[0]
+        seq = connection.execute("SELECT seq FROM ingest_state WHERE name = 'journal'").fetchone()
+        return games, seq[0] if seq else 0
+    finally:
+        connection.close()
+
+
+async def ready():
+    pass
+
+
+async def run_queue(path, adds=(), ready=ready):
+    """
+    Starts an ingest queue on path, adds each list of games in adds at
+    once, and closes it. Returns (queue, games passed to on_commit).
+    """
+    db = Database(path)
+    committed = []
+    queue = IngestQueue(db, path + ".journal", ready, committed.extend)
+    try:
+        await queue.start()
+        await asyncio.gather(*(queue.add(games) for games in adds))
+        await queue.close()
+    finally:
+        await db.close()
+    return queue, committed
+
+
+def test_torn_last_line_is_dropped(tmp_path):
+    path = str(tmp_path / "ingest.db")
+    games = make_games(path, 3)
+    write_journal(path, [(1, games[:1]), (2, games[1:2])], torn=b'{"seq": 3, "games": [{"sea')
+
+    queue, committed = asyncio.run(run_queue(path))
+
+    assert stored(path) == (2, 2)
+    assert len(committed) == 2
+    assert queue.seq == 2
+
+
+def test_committed_entries_are_skipped(tmp_path):
+    path = str(tmp_path / "ingest.db")
+    games = make_games(path, 3)
+    connection = sqlite3.connect(path)
+    with connection:
+        apply_ingest(connection, [(1, [dict(game) for game in games[:2]])])
+    connection.close()
+    write_journal(path, [(1, games[:2]), (2, games[2:])])
+
+    _, committed = asyncio.run(run_queue(path))
+
+    assert stored(path) == (3, 2)
+    assert len(committed) == 1
+
+
+def test_acknowledged_adds_are_applied_after_a_crash(tmp_path):
+    path = str(tmp_path / "ingest.db")
+    games = make_games(path, 4)
+
+    async def crash():
+        # The writer never gets past ready(), so adds are journaled but never committed
+        db = Database(path)
+        queue = IngestQueue(db, path + ".journal", asyncio.Event().wait, lambda games: None)
+        await queue.start()
+        await asyncio.gather(*(queue.add([game]) for game in games))
+        for task in queue._tasks:
+            task.cancel()
+        await asyncio.gather(*queue._tasks, return_exceptions=True)
+        queue._journal.close()
+        queue._executor.shutdown()
+        await db.close()
+
+    asyncio.run(crash())
+    assert stored(path) == (0, 0)
+
+    _, committed = asyncio.run(run_queue(path))
+
+    assert stored(path) == (4, 4)
+    assert len(committed) == 4
+
+
+def test_journal_is_compacted_after_replay(tmp_path):
+    path = str(tmp_path / "ingest.db")
+    games = make_games(path, 2)
+    write_journal(path, [(1, games[:1]), (2, games[1:])])
+
+    asyncio.run(run_queue(path))
+
+    assert stored(path) == (2, 2)
+    assert os.path.getsize(path + ".journal") == 0
+
+
+def test_concurrent_adds_commit_once(tmp_path):
+    path = str(tmp_path / "ingest.db")
+    games = make_games(path, 100)
+
+    queue, committed = asyncio.run(run_queue(path, [[game] for game in games]))
+
+    assert stored(path) == (100, 100)
+    assert sorted(game["timestamp"] for game in committed) == [game["timestamp"] for game in games]
+    assert queue.batches < 100
+    assert queue.syncs < 100
+
+
+def test_failing_add_is_moved_aside(tmp_path):
+    path = str(tmp_path / "ingest.db")
+    games = make_games(path, 2)
+    write_journal(path, [(1, games[:1]), (2, [{"season": bot_data.default_season}]), (3, games[1:])])
+
+    queue, committed = asyncio.run(run_queue(path))
+
+    assert stored(path) == (2, 3)
+    assert len(committed) == 2
+    assert queue.dead == 1
+    with open(path + ".journal.dead") as stream:
+        assert [json.loads(line)["seq"] for line in stream] == [2]
+    assert os.path.getsize(path + ".journal") == 0
+
+
+class SlowCommitDatabase(Database):
+    """
+    Widens the gap between a transaction committing and the ingest queue hearing of it.
+    """
+
+    async def transaction(self, func, *args):
+        result = await super().transaction(func, *args)
+        await asyncio.sleep(0.01)
+        return result
+
+
+def test_exclusive_runs_between_batches(tmp_path):
+    path = str(tmp_path / "ingest.db")
+    games = make_games(path, 200)
+
+    async def run():
+        db = SlowCommitDatabase(path)
+        committed = []
+        queue = IngestQueue(db, path + ".journal", ready, committed.extend)
+        await queue.start()
+        adds = [asyncio.ensure_future(queue.add([game])) for game in games]
+        seen = []
+
+        try:
+            while len(seen) < 20:
+                # Whatever the database holds, on_commit must have seen exactly that
+                seen.append(await queue.exclusive(
+                    lambda connection: (connection.execute("SELECT COUNT(*) FROM owmaps").fetchone()[0],
+                                        len(committed))))
+            await asyncio.gather(*adds)
+            await queue.close()
+        finally:
+            await db.close()
+        return seen
+
+    assert all(stored_games == seen_games for stored_games, seen_games in asyncio.run(run()))
@@ -0,0 +1,13 @@
+import sqlite3
+
+from map_bot import find_full_scans
+
+
+def test_no_full_scans(history):
+    connection = sqlite3.connect(history)
+    try:
+        full_scans = find_full_scans(connection)
+    finally:
+        connection.close()
+
+    assert full_scans == []
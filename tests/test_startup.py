@@ -0,0 +1,13 @@
+import shutil
+
+from bench import startup_bench
+
+
+def test_fast_path_skips_heavy_imports(history, tmp_path):
+    path = str(tmp_path / "startup.db")
+    shutil.copyfile(history, path)
+
+    times, heavy = startup_bench(path, 1)
+
+    assert heavy == []
+    assert set(times) == {"import", "prepare (up to date)", "tenant open", "prepare (migration)"}